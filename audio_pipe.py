@@ -0,0 +1,54 @@
+"""
+Giải mã audio qua ffmpeg pipe, dùng chung cho transdub.py (16 kHz mono int16 cho Whisper)
+và karaoke_maker.py (float32 nhiều kênh cho Demucs).
+- Không ghi WAV tạm: PCM đọc thẳng từ stdout của ffmpeg.
+- iter_pcm_blocks trả từng khối trong lúc ffmpeg còn đang giải mã, bộ nhớ không phụ thuộc độ dài file.
+"""
+import subprocess
+import tempfile
+import numpy as np
+
+_SAMPLE_FORMATS = {np.dtype(np.int16): "s16le", np.dtype(np.float32): "f32le"}
+
+
+def ffmpeg_pcm_cmd(media_path, samplerate, channels, dtype=np.int16):
+    return ["ffmpeg", "-nostdin", "-v", "error", "-i", media_path, "-vn", "-ac", str(channels),
+            "-ar", str(samplerate), "-f", _SAMPLE_FORMATS[np.dtype(dtype)], "pipe:1"]
+
+
+def ffmpeg_error(media_path, returncode, stderr):
+    msg = stderr.decode("utf-8", "ignore").strip().splitlines()
+    return RuntimeError(f"ffmpeg lỗi ({returncode}) khi đọc {media_path}: {msg[-1] if msg else 'không rõ'}")
+
+
+def read_pcm(media_path, samplerate, channels=1, dtype=np.int16):
+    """Decode the whole audio track -> (frames, channels) array of dtype."""
+    proc = subprocess.run(ffmpeg_pcm_cmd(media_path, samplerate, channels, dtype),
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise ffmpeg_error(media_path, proc.returncode, proc.stderr)
+    return np.frombuffer(proc.stdout, dtype=dtype).reshape(-1, channels)
+
+
+def iter_pcm_blocks(media_path, samplerate, channels, block_frames, dtype=np.int16):
+    """Yield (<=block_frames, channels) arrays as ffmpeg decodes them; raises if ffmpeg fails."""
+    frame_bytes = channels * np.dtype(dtype).itemsize
+    # stderr goes to a temp file: a full stderr pipe would stall ffmpeg while we only read stdout
+    with tempfile.TemporaryFile() as err:
+        proc = subprocess.Popen(ffmpeg_pcm_cmd(media_path, samplerate, channels, dtype),
+                                stdout=subprocess.PIPE, stderr=err)
+        try:
+            while True:
+                data = proc.stdout.read(block_frames * frame_bytes)
+                if not data:
+                    break
+                n = len(data) // frame_bytes
+                yield np.frombuffer(data[:n * frame_bytes], dtype=dtype).reshape(-1, channels)
+            proc.stdout.close()
+            if proc.wait() != 0:
+                err.seek(0)
+                raise ffmpeg_error(media_path, proc.returncode, err.read())
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
@@ -0,0 +1,406 @@
+"""
+Benchmark cho các bước xử lý nặng (chạy offline, không gọi edge-tts).
+Chạy:
+    python benchmarks.py              # tất cả
+    python benchmarks.py assembly     # chỉ một benchmark
+"""
+import os
+import re
+import sys
+import time
+import random
+import asyncio
+import tempfile
+import subprocess
+import threading
+from datetime import datetime
+import numpy as np
+from pydub import AudioSegment
+
+from srt_to_mp3_tts import TimelineAssembler, fit_to_slot, change_speed, time_stretch
+from srt_parser import parse_srt
+
+
+def _timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return out, time.perf_counter() - t0
+
+
+def _tone(ms, rate=24000, freq=220.0):
+    n = int(rate * ms / 1000)
+    pcm = (np.sin(2 * np.pi * freq * np.arange(n) / rate) * 8000).astype(np.int16)
+    return AudioSegment(data=pcm.tobytes(), sample_width=2, frame_rate=rate, channels=1)
+
+
+def _fake_cues(n, seed=0):
+    """n cues with ~1s slots; some lines shorter, some longer than their slot."""
+    rnd = random.Random(seed)
+    cues, t = [], 0
+    for _ in range(n):
+        t += rnd.randint(0, 400)
+        slot = rnd.randint(500, 1000)
+        cues.append((t, t + slot, _tone(rnd.randint(300, 1300))))
+        t += slot
+    return cues
+
+# ---------------- Timeline assembly ----------------
+def _legacy_assemble(cues, overflow_mode):
+    """The old conversion_job loop: `final += ...` for every gap and cue."""
+    final = AudioSegment.silent(duration=0)
+    current_pos = 0
+    for start_ms, end_ms, seg_all in cues:
+        slot_dur = max(0, end_ms - start_ms)
+        if start_ms > current_pos:
+            gap = start_ms - current_pos
+            final += AudioSegment.silent(duration=gap)
+            current_pos += gap
+        placed, pad, current_pos = fit_to_slot(seg_all, start_ms, slot_dur, overflow_mode)
+        final += placed
+        if pad > 0:
+            final += AudioSegment.silent(duration=pad)
+    return final
+
+
+def _assemble(cues, overflow_mode):
+    tl = TimelineAssembler(overflow_mode)
+    for start_ms, end_ms, seg_all in cues:
+        tl.add_cue(start_ms, end_ms, seg_all)
+    return tl.render()
+
+
+def bench_assembly(counts=(100, 200, 400, 800, 1600, 3200), legacy_max=800):
+    print("== Timeline assembly (legacy += vs TimelineAssembler) ==")
+    print(f"{'cues':>6} {'audio s':>8} {'legacy s':>9} {'engine s':>9} {'len diff ms':>11}")
+    for n in counts:
+        cues = _fake_cues(n)
+        for mode in ("cut", "overflow"):
+            new, t_new = _timed(_assemble, cues, mode)
+            if n <= legacy_max:
+                old, t_old = _timed(_legacy_assemble, cues, mode)
+                diff = abs(len(old) - len(new))
+                legacy = f"{t_old:9.3f}"
+            else:
+                diff, legacy = "-", f"{'skip':>9}"
+            print(f"{n:>6} {len(new) / 1000:8.1f} {legacy} {t_new:9.3f} {diff:>11}  ({mode})")
+
+
+# ---------------- Time-stretch ----------------
+def bench_stretch(durations_ms=(1000, 5000, 30000), ratios=(1.1, 1.5, 2.0)):
+    """change_speed (resample, pitch shifts) vs time_stretch (phase vocoder, pitch kept).
+    Also checks that the stretched length always equals the slot."""
+    print("== Overflow speed-up: change_speed vs time_stretch ==")
+    print(f"{'seg ms':>7} {'ratio':>6} {'change_speed Msamp/s':>21} {'time_stretch Msamp/s':>21} {'len ok':>7}")
+    for dur in durations_ms:
+        seg = _tone(dur)
+        n = int(seg.frame_count())
+        for ratio in ratios:
+            slot_dur = int(dur / ratio)
+            _, t_old = _timed(change_speed, seg, ratio)
+            out, t_new = _timed(time_stretch, seg, slot_dur)
+            placed, pad, _ = fit_to_slot(seg, 0, slot_dur, 'stretch')
+            ok = len(out) == slot_dur and len(placed) + pad == slot_dur
+            print(f"{dur:>7} {ratio:>6.2f} {n / t_old / 1e6:21.2f} {n / t_new / 1e6:21.2f} {str(ok):>7}")
+
+
+# ---------------- SRT parsing ----------------
+def _legacy_parse_tts(srt_path):
+    """Old srt_to_mp3_tts.parse_srt + srt_time_to_ms (DOTALL regex, strptime per timestamp)."""
+    with open(srt_path, 'r', encoding='utf-8', errors='ignore') as f:
+        content = f.read()
+    pattern = re.compile(
+        r'(\d+)\s*\n\s*(\d{2}:\d{2}:\d{2},\d{3})\s*-->\s*(\d{2}:\d{2}:\d{2},\d{3})\s*\n(.*?)(?=\n\s*\n|\n\s*\d+\s*\n|\Z)',
+        re.DOTALL
+    )
+    def to_ms(t):
+        dt = datetime.strptime(t, "%H:%M:%S,%f")
+        return dt.hour*3600000 + dt.minute*60000 + dt.second*1000 + int(dt.microsecond/1000)
+    out = []
+    for match in pattern.finditer(content):
+        text = match.group(4).strip().replace('\r', '').replace('\n', ' ')
+        if ":" in text and not text.startswith("http") and len(text.split(":",1)[0]) <= 30:
+            spk, dialog = text.split(":", 1)
+            speaker, dialog = spk.strip(), dialog.strip()
+        else:
+            speaker, dialog = "Narrator", text
+        out.append((match.group(1), to_ms(match.group(2)), to_ms(match.group(3)), speaker, dialog))
+    return out
+
+
+def _legacy_parse_transdub(srt_path):
+    """Old transdub.parse_srt (different regex, string timestamps)."""
+    with open(srt_path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    pattern = re.compile(
+        r'(\d+)\s+(\d{2}:\d{2}:\d{2},\d{3})\s*-->\s*(\d{2}:\d{2}:\d{2},\d{3})\s+(.*?)\s*(?=\n\d+\n|\Z)',
+        re.DOTALL
+    )
+    out = []
+    for match in pattern.finditer(content):
+        text = match.group(4).replace('\n', ' ').strip()
+        if ":" in text:
+            spk, dialog = text.split(":",1)
+            speaker, dialog = spk.strip(), dialog.strip()
+        else:
+            speaker, dialog = "Narrator", text
+        out.append((match.group(1), match.group(2), match.group(3), speaker, dialog))
+    return out
+
+
+def _write_fake_srt(path, n, newline="\n"):
+    def ts(ms):
+        return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d},{ms % 1000:03d}"
+    rnd = random.Random(1)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        t = 0
+        for i in range(1, n + 1):
+            t += rnd.randint(100, 1400)  # stays < 24h: the old parser used strptime
+            spk = rnd.choice(("Anna: ", "Bob: ", ""))
+            f.write(f"{i}{newline}{ts(t)} --> {ts(t + 1800)}{newline}{spk}câu thoại số {i}{newline}"
+                    f"dòng thứ hai{newline}{newline}")
+
+
+def bench_parse(n=100_000):
+    print(f"== SRT parsing, {n} cues ==")
+    fd, path = tempfile.mkstemp(suffix=".srt")
+    os.close(fd)
+    try:
+        for newline in ("\n", "\r\n"):
+            _write_fake_srt(path, n, newline)
+            label = "CRLF" if newline == "\r\n" else "LF"
+            for name, fn in (("srt_parser", parse_srt), ("legacy tts", _legacy_parse_tts),
+                             ("legacy transdub", _legacy_parse_transdub)):
+                cues, t = _timed(fn, path)
+                print(f"{label:>4} {name:>16}: {t:7.3f}s  {len(cues):>7} cues  {n / t / 1000:8.1f}k cues/s")
+    finally:
+        os.remove(path)
+
+
+# ---------------- Translation ----------------
+class _FakeTranslator:
+    """Stand-in for googletrans: fixed latency per request, tags every line, counts requests."""
+
+    def __init__(self, latency=0.02):
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def translate(self, text, dest="en"):
+        with self._lock:
+            self.requests += 1
+        time.sleep(self.latency)
+        out = "\n".join(f"[{dest}] {line}" for line in text.split("\n"))
+        return type("Translated", (), {"text": out})()
+
+
+def bench_translate(n=1000, dup_ratio=0.3):
+    """Per-segment serial translation (old segments_to_srt) vs batched translate_texts."""
+    import transdub
+    rnd = random.Random(2)
+    texts = []
+    for i in range(n):
+        if texts and rnd.random() < dup_ratio:
+            texts.append(rnd.choice(texts))  # Whisper repeats short lines ("Yeah.", "Thank you.")
+        else:
+            texts.append(f"This is spoken line number {i} of the video, more or less.")
+    print(f"== Translation, {n} segments ({dup_ratio:.0%} duplicates), 20 ms per request ==")
+    fake = _FakeTranslator()
+    transdub._translator = fake
+    t0 = time.perf_counter()
+    legacy = [transdub.translate_text_with_context(t, "vi") for t in texts]
+    t_old, old_requests = time.perf_counter() - t0, fake.requests
+    fake = _FakeTranslator()
+    (out, requests_made), t_new = _timed(transdub.translate_texts, texts, "vi", ["cổ", "trang"], translator=fake)
+    ok = all(o == f"[vi] {t}" for o, t in zip(out, texts)) and out == legacy
+    print(f"  per segment: {old_requests:5d} requests {t_old:7.2f}s")
+    print(f"  batched:     {fake.requests:5d} requests {t_new:7.2f}s  (mapping ok: {ok})")
+
+
+# ---------------- Cue coalescing ----------------
+def bench_coalesce(n=400, latency=0.15, concurrency=4):
+    """One TTS request per cue vs coalesced runs of cues (fake TTS with fixed latency)."""
+    import io
+    from srt_to_mp3_tts import TTSPool, plan_coalesced
+    buf = io.BytesIO()
+    _tone(10000).export(buf, format="mp3")
+    mp3 = buf.getvalue()
+    requests = [0]
+
+    async def fake(text, voice, rate="+0%"):
+        requests[0] += 1
+        await asyncio.sleep(latency)
+        return mp3
+
+    async def fake_words(text, voice, rate="+0%"):
+        requests[0] += 1
+        await asyncio.sleep(latency)
+        return mp3, [(150 * k, 120, w.strip(".")) for k, w in enumerate(text.split())]
+
+    fd, path = tempfile.mkstemp(suffix=".srt")
+    os.close(fd)
+    try:
+        _write_fake_srt(path, n)
+        subs = parse_srt(path)
+    finally:
+        os.remove(path)
+    jobs = [([cue.text], cue.speaker, "+0%") for cue in subs]
+    print(f"== TTS requests, {n} cues, {latency * 1000:.0f} ms per request, {concurrency} in flight ==")
+    for name, groups in (("per cue", [[i] for i in range(len(jobs))]),
+                         ("coalesced", plan_coalesced(subs, jobs, range(len(jobs)), 240))):
+        requests[0] = 0
+        with TTSPool(concurrency, synth=fake, synth_words=fake_words) as pool:
+            out, t = _timed(lambda: list(pool.map_grouped(jobs, groups)))
+        print(f"  {name:>9}: {requests[0]:5d} requests {t:7.2f}s  ({len(out)} cues, {pool.saved_requests} saved)")
+
+
+# ---------------- TTS retries under throttling ----------------
+def bench_retry(n=200, concurrency=16, capacity=4, latency=0.1, error_rate=0.05, drop_rate=0.02):
+    """Fixed concurrency without retries (old behaviour) vs RetryPolicy + AIMD, against a
+    fake_tts_server that answers 429 above `capacity` concurrent requests and fails some others."""
+    from srt_to_mp3_tts import TTSPool, RetryPolicy
+    from fake_tts_server import FakeTTSServer, http_synth
+    jobs = [([f"câu thoại số {i}, dòng thứ hai."], "vi-VN-HoaiMyNeural", "+0%") for i in range(n)]
+    print(f"== TTS under throttling: {n} cues, {concurrency} in flight, server capacity {capacity}, "
+          f"{error_rate:.0%} 503, {drop_rate:.0%} dropped ==")
+    print(f"{'':>10} {'time s':>7} {'degraded':>9} {'requests':>9} {'429s':>5} {'final limit':>12}")
+    for name, options in (("no retry", dict(retry=RetryPolicy(1), adaptive=False)), ("AIMD", {})):
+        with FakeTTSServer(latency=latency, capacity=capacity, error_rate=error_rate, drop_rate=drop_rate,
+                           retry_after=0.2, seed=1) as server:
+            synth, synth_words = http_synth(server.url)
+            with TTSPool(concurrency, synth=synth, synth_words=synth_words, **options) as pool:
+                results, t = _timed(lambda: list(pool.map_ordered(jobs)))
+            degraded = sum(1 for _, (_, errors) in results if errors)
+            print(f"{name:>10} {t:7.1f} {degraded:9d} {server.stats['requests']:9d} {server.stats['429']:5d} "
+                  f"{int(pool.limit.limit):12d}")
+
+
+# ---------------- Stem mixing ----------------
+def _legacy_merge_ffmpeg(tracks, out_file):
+    """The old karaoke_maker.merge_music_tracks (since removed): ffmpeg amix (decode + re-encode, 1/n input scaling)."""
+    inputs = []
+    for path in tracks:
+        inputs += ["-i", path]
+    cmd = ["ffmpeg", "-y", "-v", "error"] + inputs + [
+        "-filter_complex", f"amix=inputs={len(tracks)}:duration=longest", out_file]
+    subprocess.run(cmd, check=True)
+
+
+def bench_mix(seconds=(60, 600)):
+    """ffmpeg amix vs karaoke_maker.mix_stems (memory-mapped numpy sum) on 44.1 kHz stereo stems."""
+    from karaoke_maker import mix_stems, write_wav, wav_memmap
+    print("== Stem mixing: ffmpeg amix vs mix_stems ==")
+    print(f"{'audio s':>8} {'amix s':>8} {'mix_stems s':>12} {'exact sum':>10}")
+    rnd = np.random.default_rng(3)
+    with tempfile.TemporaryDirectory() as d:
+        for sec in seconds:
+            n = 44100 * sec
+            tracks = []
+            for i, name in enumerate(("drums", "bass", "other")):
+                t = np.arange(n, dtype=np.float32) / 44100
+                audio = 0.2 * np.sin(2 * np.pi * (80 + 150 * i) * t) + 0.02 * rnd.standard_normal(n).astype(np.float32)
+                path = os.path.join(d, f"{name}.wav")
+                write_wav(path, np.stack((audio, audio)), 44100)
+                tracks.append(path)
+            _, t_old = _timed(_legacy_merge_ffmpeg, tracks, os.path.join(d, "amix.wav"))
+            out = os.path.join(d, "music.wav")
+            _, t_new = _timed(mix_stems, tracks, out)
+            mixed, _ = wav_memmap(out)
+            expected = sum(wav_memmap(p)[0].astype(np.int32) for p in tracks)
+            exact = bool(np.array_equal(mixed, np.clip(expected, -32768, 32767)))
+            del mixed
+            print(f"{sec:>8} {t_old:8.2f} {t_new:12.2f} {str(exact):>10}")
+
+
+# ---------------- Dubbed mix ----------------
+def _legacy_duck_mix(cues, music_path, out_file, duck_db, d):
+    """The manual route: export the dialogue MP3, then an ffmpeg volume/amix pass over the music
+    (two encodes, the dialogue decoded back from MP3)."""
+    dialogue = os.path.join(d, "dialogue.mp3")
+    _assemble(cues, "cut").export(dialogue, format="mp3")
+    ducked = "+".join(f"between(t,{s / 1000:.3f},{e / 1000:.3f})" for s, e, _ in cues)
+    expr = f"if({ducked},{10 ** (duck_db / 20):.4f},1)"
+    cmd = ["ffmpeg", "-y", "-v", "error", "-i", music_path, "-i", dialogue, "-filter_complex",
+           f"[0:a]volume='{expr}':eval=frame[m];[m][1:a]amix=inputs=2:duration=first:normalize=0", out_file]
+    subprocess.run(cmd, check=True)
+
+
+def _duck_mix(cues, music_path, out_file, duck_db):
+    from srt_to_mp3_tts import DuckedMixWriter
+    tl = DuckedMixWriter(out_file, music_path, "cut", duck_db=duck_db)
+    try:
+        for start_ms, end_ms, seg_all in cues:
+            tl.add_cue(start_ms, end_ms, seg_all)
+        tl.close()
+    except BaseException:
+        tl.abort()
+        raise
+
+
+def bench_duck(counts=(100, 500, 2000), duck_db=-12.0):
+    """Dialogue over music: dialogue MP3 + ffmpeg volume/amix vs DuckedMixWriter (one streaming pass)."""
+    from karaoke_maker import write_wav
+    print("== Dubbed mix: dialogue mp3 + ffmpeg duck/amix vs DuckedMixWriter ==")
+    print(f"{'cues':>6} {'audio s':>8} {'2-pass s':>9} {'1-pass s':>9}")
+    rnd = np.random.default_rng(5)
+    with tempfile.TemporaryDirectory() as d:
+        for n in counts:
+            cues = _fake_cues(n)
+            sec = cues[-1][1] / 1000 + 2
+            frames = int(44100 * sec)
+            t = np.arange(frames, dtype=np.float32) / 44100
+            music = 0.3 * np.sin(2 * np.pi * 110 * t) + 0.02 * rnd.standard_normal(frames).astype(np.float32)
+            music_path = os.path.join(d, "music.wav")
+            write_wav(music_path, np.stack((music, music)), 44100)
+            _, t_old = _timed(_legacy_duck_mix, cues, music_path, os.path.join(d, "old.mp3"), duck_db, d)
+            _, t_new = _timed(_duck_mix, cues, music_path, os.path.join(d, "new.mp3"), duck_db)
+            print(f"{n:>6} {sec:8.0f} {t_old:9.2f} {t_new:9.2f}")
+
+
+# ---------------- Startup / import cost ----------------
+STARTUP_MODULES = ("tkinter", "numpy", "pydub", "edge_tts", "srt", "googletrans", "torch", "whisper",
+                   "srt_parser", "tts_cache", "transdub", "srt_to_mp3_tts")
+
+
+def _import_cost(module):
+    """(cumulative import µs from -X importtime, wall seconds) in a fresh interpreter, or None."""
+    t0 = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    wall = time.perf_counter() - t0
+    if proc.returncode != 0:
+        return None
+    for line in proc.stderr.splitlines():
+        parts = line.split("|")
+        if line.startswith("import time:") and len(parts) == 3 and parts[2].strip() == module:
+            return int(parts[1]), wall
+    return None
+
+
+def bench_startup(modules=STARTUP_MODULES):
+    """Import cost per module, each in a fresh interpreter (python -X importtime)."""
+    print("== Startup: import time per module (fresh interpreter) ==")
+    print(f"{'module':>16} {'import ms':>10} {'process s':>10}")
+    for module in modules:
+        cost = _import_cost(module)
+        if cost is None:
+            print(f"{module:>16} {'not installed / failed':>22}")
+            continue
+        us, wall = cost
+        print(f"{module:>16} {us / 1000:10.1f} {wall:10.2f}")
+
+
+BENCHMARKS = {
+    "assembly": bench_assembly,
+    "stretch": bench_stretch,
+    "parse": bench_parse,
+    "translate": bench_translate,
+    "coalesce": bench_coalesce,
+    "retry": bench_retry,
+    "mix": bench_mix,
+    "duck": bench_duck,
+    "startup": bench_startup,
+}
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or list(BENCHMARKS):
+        BENCHMARKS[name]()
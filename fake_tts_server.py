@@ -0,0 +1,203 @@
+"""
+Server TTS giả lập để thử srt_to_mp3_tts.py khi mạng chậm / bị giới hạn, không gọi edge-tts.
+Trả về mp3 (tiếng bíp, dài theo số chữ) kèm mốc thời gian từng từ, và cố ý gây lỗi:
+- độ trễ ngẫu nhiên (--latency, --jitter)
+- quá --capacity request cùng lúc -> 429 kèm Retry-After, như khi bị giới hạn tốc độ
+- 429 / 503 ngẫu nhiên (--throttle-rate, --error-rate), mất kết nối (--drop-rate)
+- giọng không đúng dạng xx-YY-TenNeural -> 400 (lỗi vĩnh viễn, không nên thử lại)
+Chạy:
+    python fake_tts_server.py --port 8765 --latency 0.2 --capacity 6 --error-rate 0.05
+    python srt_to_mp3_tts.py phim.srt --tts-server http://127.0.0.1:8765
+Thống kê: GET http://127.0.0.1:8765/stats
+"""
+import io
+import re
+import sys
+import json
+import random
+import asyncio
+import argparse
+import threading
+import numpy as np
+from aiohttp import web, ClientSession, ClientTimeout
+from pydub import AudioSegment
+
+VOICE_RE = re.compile(r"^[a-z]{2,3}-[A-Z]{2}-\w+Neural$")
+MS_PER_CHAR = 60
+WORD_GAP_MS = 50
+SENTENCE_GAP_MS = 300
+
+
+def _rate_factor(rate):
+    """'+25%' -> 1.25 (faster), '-10%' -> 0.9."""
+    try:
+        return max(0.1, 1 + int(rate.rstrip("%")) / 100)
+    except (ValueError, AttributeError):
+        return 1.0
+
+
+def render(text, rate="+0%"):
+    """Fake speech for `text`: (mp3 bytes, [(offset_ms, duration_ms, word)])."""
+    speed = _rate_factor(rate)
+    pcm, words, pos = [], [], 0
+    for tok in text.split():
+        word = tok.strip(".,!?;:…")
+        ms = int(MS_PER_CHAR * max(1, len(word)) / speed)
+        gap = int((SENTENCE_GAP_MS if tok[-1] in ".!?…" else WORD_GAP_MS) / speed)
+        n = 24 * ms
+        t = np.arange(n) / 24000
+        pcm.append((4000 * np.sin(2 * np.pi * 220 * t)).astype(np.int16))
+        pcm.append(np.zeros(24 * gap, np.int16))
+        if word:
+            words.append((pos, ms, word))
+        pos += ms + gap
+    data = np.concatenate(pcm) if pcm else np.zeros(2400, np.int16)
+    buf = io.BytesIO()
+    AudioSegment(data.tobytes(), sample_width=2, frame_rate=24000, channels=1).export(buf, format="mp3")
+    return buf.getvalue(), words
+
+
+class FakeTTSServer:
+    """aiohttp app with injectable latency and failures. start() runs it on a background thread."""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.1, jitter=0.05, capacity=None,
+                 throttle_rate=0.0, error_rate=0.0, drop_rate=0.0, retry_after=1.0, seed=None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.capacity = capacity
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.retry_after = retry_after
+        self.rnd = random.Random(seed)
+        self.active = 0
+        self.stats = {"requests": 0, "ok": 0, "429": 0, "503": 0, "400": 0, "dropped": 0, "peak_active": 0}
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/synth", self.handle_synth)
+        app.router.add_get("/stats", self.handle_stats)
+        return app
+
+    async def handle_stats(self, request):
+        return web.json_response(dict(self.stats, active=self.active))
+
+    async def handle_synth(self, request):
+        self.stats["requests"] += 1
+        req = await request.json()
+        if not VOICE_RE.match(req.get("voice", "")):
+            self.stats["400"] += 1
+            raise web.HTTPBadRequest(text=f"unknown voice: {req.get('voice')}")
+        if (self.capacity and self.active >= self.capacity) or self.rnd.random() < self.throttle_rate:
+            self.stats["429"] += 1
+            raise web.HTTPTooManyRequests(headers={"Retry-After": f"{self.retry_after:g}"})
+        self.active += 1
+        self.stats["peak_active"] = max(self.stats["peak_active"], self.active)
+        try:
+            await asyncio.sleep(max(0.0, self.latency + self.rnd.uniform(-self.jitter, self.jitter)))
+            roll = self.rnd.random()
+            if roll < self.error_rate:
+                self.stats["503"] += 1
+                raise web.HTTPServiceUnavailable()
+            if roll < self.error_rate + self.drop_rate:
+                self.stats["dropped"] += 1
+                request.transport.close()  # connection reset mid-request
+                raise web.HTTPServiceUnavailable()
+            data, words = await asyncio.to_thread(render, req.get("text", ""), req.get("rate", "+0%"))
+        finally:
+            self.active -= 1
+        self.stats["ok"] += 1
+        if req.get("words"):
+            return web.json_response({"audio": data.hex(), "words": words})
+        return web.Response(body=data, content_type="audio/mpeg")
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        """Serve on a daemon thread; returns the base URL (port 0 picks a free port)."""
+        async def _serve():
+            self._runner = web.AppRunner(self.app(), access_log=None)
+            await self._runner.setup()
+            site = web.TCPSite(self._runner, self.host, self.port)
+            await site.start()
+            self.port = self._runner.addresses[0][1]
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(_serve(), self._loop).result()
+        return self.url
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# ---------------- Client ----------------
+def http_synth(url, timeout=30):
+    """(synth, synth_words) coroutines for srt_to_mp3_tts.TTSPool that call a FakeTTSServer.
+    HTTP errors surface as aiohttp.ClientResponseError (status + headers), like edge-tts' handshake errors."""
+    url = url.rstrip("/") + "/synth"
+
+    async def _post(payload):
+        async with ClientSession(timeout=ClientTimeout(total=timeout)) as session:
+            async with session.post(url, json=payload) as resp:
+                resp.raise_for_status()
+                return await (resp.json() if payload["words"] else resp.read())
+
+    async def synth(text, voice, rate="+0%"):
+        return await _post({"text": text, "voice": voice, "rate": rate, "words": False})
+
+    async def synth_words(text, voice, rate="+0%"):
+        reply = await _post({"text": text, "voice": voice, "rate": rate, "words": True})
+        return bytes.fromhex(reply["audio"]), [tuple(w) for w in reply["words"]]
+
+    return synth, synth_words
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Server TTS giả lập (độ trễ + lỗi) cho srt_to_mp3_tts.py")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency", type=float, default=0.2, help="giây mỗi request")
+    ap.add_argument("--jitter", type=float, default=0.1)
+    ap.add_argument("--capacity", type=int, default=None, help="số request cùng lúc trước khi trả 429")
+    ap.add_argument("--throttle-rate", type=float, default=0.0, help="tỉ lệ 429 ngẫu nhiên")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="tỉ lệ 503")
+    ap.add_argument("--drop-rate", type=float, default=0.0, help="tỉ lệ mất kết nối")
+    ap.add_argument("--retry-after", type=float, default=1.0)
+    args = ap.parse_args(argv)
+    server = FakeTTSServer(args.host, args.port, args.latency, args.jitter, args.capacity,
+                           args.throttle_rate, args.error_rate, args.drop_rate, args.retry_after)
+    print(f"Fake TTS server on {server.start()}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(server.stats))
+        server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,55 +1,397 @@
 """
-Ý tưởng: Tách audio từ video (mp4,mkv,avi) thành các track: vocals.wav và music.wav (gộp drums+bass+other)
-file vocals.wav là giọng hát, music.wav là nhạc nền (không có giọng hát).
+Ý tưởng: Tách audio từ video (mp4,mkv,avi) thành các track: vocals.wav và music-<gain>.wav (gộp drums+bass+other,
+<gain> = unity / average / peak theo --gain); vocals.wav là giọng hát, music-<gain>.wav là nhạc nền (không có giọng hát).
 Yêu cầu:
-    pip install demucs
+    pip install demucs numpy
     ffmpeg cần có trong PATH để gộp audio.
+Chạy hàng loạt không giao diện (model chỉ tải một lần):
+    python karaoke_maker.py video1.mp4 thu_muc_video/ -o output --threads 4
 """
-import os, subprocess, threading
+import os, re, sys, json, time, wave, shutil, struct, argparse, tempfile, subprocess, threading
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
+import numpy as np
+from audio_pipe import read_pcm, iter_pcm_blocks
 
-# --- Hàm tách audio bằng Demucs ---
-def separate_audio(input_path, output_dir):
-    subprocess.run(["demucs", "-o", output_dir, input_path], check=True)
+VIDEO_EXTS = (".mp4", ".mkv", ".avi", ".mov", ".webm")
+DEFAULT_MODEL = "htdemucs"
+DEFAULT_WINDOW_S = 60.0   # segmented mode: window length (0 = whole file at once)
+DEFAULT_OVERLAP_S = 5.0   # crossfade between neighbouring windows
+
+# --- Demucs chạy trong cùng tiến trình (torch/demucs chỉ import khi cần) ---
+_DEMUCS_MODELS = {}
+_demucs_lock = threading.Lock()
+
+def load_demucs_model(name=DEFAULT_MODEL, threads=None):
+    """Load a pretrained Demucs model once per process. threads -> torch.set_num_threads."""
+    import torch
+    if threads:
+        torch.set_num_threads(threads)
+    with _demucs_lock:
+        if name not in _DEMUCS_MODELS:
+            from demucs.pretrained import get_model
+            model = get_model(name)
+            model.eval()
+            _DEMUCS_MODELS[name] = model
+    return _DEMUCS_MODELS[name]
+
+def decode_audio(input_path, samplerate, channels=2):
+    """Decode the audio track through an ffmpeg pipe -> float32 array (channels, samples)."""
+    return read_pcm(input_path, samplerate, channels, np.float32).T
+
+def iter_audio_blocks(input_path, samplerate, channels, block_frames):
+    """Yield float32 (channels, <=block_frames) blocks while ffmpeg decodes; raises if ffmpeg fails."""
+    for block in iter_pcm_blocks(input_path, samplerate, channels, block_frames, np.float32):
+        yield block.T
+
+def probe_duration(input_path):
+    """Duration in seconds from ffmpeg's banner (ffprobe is not always installed), or None."""
+    proc = subprocess.run(["ffmpeg", "-nostdin", "-i", input_path], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    m = re.search(rb"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", proc.stderr)
+    if not m:
+        return None
+    h, mi, sec = m.groups()
+    return int(h) * 3600 + int(mi) * 60 + float(sec)
+
+def _to_pcm16(audio):
+    return (np.clip(audio, -1.0, 1.0 - 1 / 32768) * 32768).astype(np.int16).T.tobytes()
+
+def open_wav_writer(path, channels, samplerate):
+    w = wave.open(path, "wb")
+    w.setnchannels(channels)
+    w.setsampwidth(2)
+    w.setframerate(samplerate)
+    return w
+
+def write_wav(path, audio, samplerate):
+    """(channels, samples) float32 -> 16-bit PCM WAV."""
+    with open_wav_writer(path, audio.shape[0], samplerate) as w:
+        w.writeframes(_to_pcm16(audio))
+
+# --- Cache theo nội dung audio ---
+STEMS_MANIFEST = "stems.json"
+
+def _ffmpeg_checked(cmd, input_path):
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        err = proc.stderr.decode("utf-8", "ignore").strip().splitlines()
+        raise RuntimeError(f"ffmpeg lỗi khi đọc {input_path}: {err[-1] if err else proc.returncode}")
+    return proc.stdout
+
+def audio_content_hash(input_path):
+    """sha256 of the first audio stream's packets (ffmpeg hash muxer, stream copy: no decoding).
+    The same audio remuxed into another container (mp4 -> mkv) hashes the same."""
+    out = _ffmpeg_checked(["ffmpeg", "-nostdin", "-v", "error", "-i", input_path, "-map", "0:a:0", "-c", "copy",
+                           "-f", "hash", "-hash", "sha256", "-"], input_path)
+    m = re.search(rb"SHA256=([0-9a-f]{64})", out)
+    if not m:
+        raise RuntimeError(f"Không tính được hash audio của {input_path}")
+    return m.group(1).decode("ascii")
+
+def extract_audio_only(input_path, out_path):
+    """Copy the first audio stream into an audio-only Matroska file (-vn, no re-encode)."""
+    _ffmpeg_checked(["ffmpeg", "-nostdin", "-v", "error", "-y", "-i", input_path, "-map", "0:a:0", "-vn",
+                     "-c:a", "copy", out_path], input_path)
+    return out_path
+
+def stems_dir(output_dir, model_name, audio_hash):
+    """<output_dir>/<model>/<audio hash>/: the raw stems, plus one music-<gain policy>.wav per policy used."""
+    return os.path.join(output_dir, model_name, audio_hash[:24])
+
+def load_cached_stems(out_dir, source=None):
+    """{stem: path} if out_dir holds a finished separation (manifest + every wav), else None.
+    `source` is added to the manifest's list of files that had this audio."""
+    try:
+        with open(os.path.join(out_dir, STEMS_MANIFEST), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        tracks = {name: os.path.join(out_dir, fn) for name, fn in manifest["stems"].items()}
+    except Exception:
+        return None
+    if not all(os.path.exists(p) for p in tracks.values()):
+        return None
+    if source and os.path.abspath(source) not in manifest.get("sources", []):
+        manifest.setdefault("sources", []).append(os.path.abspath(source))
+        try:
+            _write_manifest(out_dir, manifest)
+        except OSError:
+            pass
+    return tracks
+
+def _write_manifest(out_dir, manifest):
+    tmp = os.path.join(out_dir, f"{STEMS_MANIFEST}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, os.path.join(out_dir, STEMS_MANIFEST))
+
+def _separate_array(model, audio, jobs=0):
+    """(channels, samples) float32 -> (sources, channels, samples) numpy, demucs CLI normalisation."""
+    import torch
+    from demucs.apply import apply_model
+    wav = torch.from_numpy(np.ascontiguousarray(audio))
+    ref = wav.mean(0)
+    mean, std = ref.mean(), ref.std() + 1e-8
+    with torch.no_grad():
+        sources = apply_model(model, ((wav - mean) / std)[None], split=True, overlap=0.25,
+                              progress=False, num_workers=jobs)[0]
+    return (sources * std + mean).numpy()
+
+def separate_file(model, input_path, out_dir, jobs=0, window_s=DEFAULT_WINDOW_S, overlap_s=DEFAULT_OVERLAP_S,
+                  progress=None):
+    """Separate one file with an already loaded model. Returns {stem: wav path} for this file only.
+    window_s > 0 uses separate_file_segmented (memory bounded by the window, progress per window)."""
+    if window_s:
+        return separate_file_segmented(model, input_path, out_dir, window_s, overlap_s, jobs, progress)
+    sources = _separate_array(model, decode_audio(input_path, model.samplerate, model.audio_channels), jobs)
+    os.makedirs(out_dir, exist_ok=True)
     tracks = {}
-    for root, _, files in os.walk(output_dir):
-        for file in files:
-            if file.endswith(".wav"):
-                key = file.replace(".wav","")
-                tracks[key] = os.path.join(root, file)
+    for name, src in zip(model.sources, sources):
+        path = os.path.join(out_dir, f"{name}.wav")
+        write_wav(path, src, model.samplerate)
+        tracks[name] = path
+    if progress:
+        progress(1.0)
     return tracks
 
-# --- Hàm gộp bass+drums+other thành music.wav ---
-# --- Hàm gộp bass+drums+other thành music.wav ---
-def merge_music_tracks(folder, delete_original=True):
-    out_file = os.path.join(folder, "music.wav")
-    inputs, tracks = [], []
-    for name in ["drums.wav", "bass.wav", "other.wav"]:
-        path = os.path.join(folder, name)
-        if os.path.exists(path):
-            inputs.append("-i")
-            inputs.append(path)
-            tracks.append(path)
-
-    if not tracks:
+def separate_file_segmented(model, input_path, out_dir, window_s=DEFAULT_WINDOW_S, overlap_s=DEFAULT_OVERLAP_S,
+                            jobs=0, progress=None):
+    """Separate in overlapping windows while ffmpeg decodes, crossfade neighbouring windows
+    (linear overlap-add) and append to the stem WAVs as we go.
+    Peak memory ~ window size, not video length. progress(fraction) is called after each window."""
+    sr, channels = model.samplerate, model.audio_channels
+    win = int(window_s * sr)
+    ovl = min(int(overlap_s * sr), win // 2)
+    hop = win - ovl
+    fade_in = np.linspace(0.0, 1.0, ovl, endpoint=False, dtype=np.float32)
+    fade_out = 1.0 - fade_in
+    duration = probe_duration(input_path) if progress else None
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {name: os.path.join(out_dir, f"{name}.wav") for name in model.sources}
+    writers = {name: open_wav_writer(p, channels, sr) for name, p in paths.items()}
+    try:
+        buf = np.zeros((channels, 0), dtype=np.float32)
+        tail = None    # last `ovl` samples of the previous window, not yet written
+        written = 0
+        blocks = iter_audio_blocks(input_path, sr, channels, hop)
+        eof = False
+        while True:
+            while not eof and buf.shape[1] < win:
+                block = next(blocks, None)
+                if block is None:
+                    eof = True
+                else:
+                    buf = np.concatenate((buf, block), axis=1)
+            if buf.shape[1] == 0 or (tail is not None and buf.shape[1] <= ovl):
+                break  # nothing beyond what the previous window already covered
+            last = eof and buf.shape[1] <= win
+            out = _separate_array(model, buf[:, :win], jobs)
+            if tail is not None:
+                out[:, :, :ovl] = tail * fade_out + out[:, :, :ovl] * fade_in
+            keep = out.shape[2] if last else hop
+            for name, src in zip(model.sources, out):
+                writers[name].writeframes(_to_pcm16(src[:, :keep]))
+            written += keep
+            if progress:
+                progress(min(1.0, written / (duration * sr)) if duration else 0.0)
+            if last:
+                break
+            tail = out[:, :, hop:win]
+            buf = buf[:, hop:]
+        if tail is not None and not last:
+            for name, src in zip(model.sources, tail):
+                writers[name].writeframes(_to_pcm16(src[:, :buf.shape[1]]))
+    finally:
+        for w in writers.values():
+            w.close()
+    if progress:
+        progress(1.0)
+    return paths
+
+def collect_videos(inputs):
+    """Files and folders (non-recursive) -> sorted list of video paths."""
+    out = []
+    for p in inputs:
+        if os.path.isdir(p):
+            out.extend(sorted(os.path.join(p, f) for f in os.listdir(p) if f.lower().endswith(VIDEO_EXTS)))
+        else:
+            out.append(p)
+    return out
+
+def _separate_into(model, video, out_dir, audio_hash, model_name, jobs, window_s, overlap_s, progress):
+    """Extract the audio stream (-vn), separate it into a private temp dir, then move the
+    finished dir into place so readers never see half-written stems."""
+    parent = os.path.dirname(out_dir)
+    os.makedirs(parent, exist_ok=True)
+    work = tempfile.mkdtemp(dir=parent, prefix=".partial-")
+    try:
+        audio = extract_audio_only(video, os.path.join(work, "audio.mka"))
+        tracks = separate_file(model, audio, work, jobs=jobs, window_s=window_s, overlap_s=overlap_s,
+                               progress=progress)
+        os.remove(audio)
+        _write_manifest(work, {"audio_sha256": audio_hash, "model": model_name,
+                               "stems": {name: os.path.basename(p) for name, p in tracks.items()},
+                               "sources": [os.path.abspath(video)], "created": time.time()})
+        try:
+            os.replace(work, out_dir)
+        except OSError:
+            # another run finished the same audio first (or a stale dir is in the way)
+            if load_cached_stems(out_dir) is None:
+                shutil.rmtree(out_dir, ignore_errors=True)
+                os.replace(work, out_dir)
+        return {name: os.path.join(out_dir, os.path.basename(p)) for name, p in tracks.items()}
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+def music_track(out_dir, tracks, gain_policy="unity", log=print):
+    """music-<gain policy>.wav (drums+bass+other) next to the cached stems, mixed on first use.
+    Returns its path, or None if there is nothing to mix."""
+    path = os.path.join(out_dir, f"music-{gain_policy}.wav")
+    if os.path.exists(path):
+        return path
+    parts = [tracks[name] for name in ("drums", "bass", "other") if name in tracks]
+    if not parts:
         return None
-    
-    cmd = ["ffmpeg", "-y"] + inputs + [
-        "-filter_complex", f"amix=inputs={len(tracks)}:duration=longest",
-        out_file
-    ]
-    subprocess.run(cmd, check=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        _, gain, clipped = mix_stems(parts, tmp, gain_policy)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    if clipped:
+        log(f"  Cảnh báo: {clipped} mẫu bị cắt khi gộp nhạc (gain {gain:.3f}); thử gain_policy='peak'")
+    return path
+
+def separate_batch(inputs, output_dir="output", model_name=DEFAULT_MODEL, threads=None, jobs=0,
+                   merge_music=True, log=print, progress=None, window_s=DEFAULT_WINDOW_S, overlap_s=DEFAULT_OVERLAP_S,
+                   gain_policy="unity"):
+    """Separate many videos with one model load. Returns (results, errors):
+    results[video] = {stem: path}, or {"vocals", "music"} when merge_music; errors[video] = message.
+    The stems are cached by a hash of the audio stream + model, so re-runs and duplicate files
+    cost one hash; the model is only loaded on the first cache miss. Each gain policy's music
+    is mixed from the cached stems (music_track), never by separating again."""
+    videos = collect_videos(inputs)
+    results, errors = {}, {}
+    if not videos:
+        return results, errors
+    model = None
+    for i, video in enumerate(videos, 1):
+        log(f"[{i}/{len(videos)}] {os.path.basename(video)}")
+        try:
+            audio_hash = audio_content_hash(video)
+            out_dir = stems_dir(output_dir, model_name, audio_hash)
+            tracks = load_cached_stems(out_dir, source=video)
+            if tracks is not None:
+                log(f"  Dùng lại kết quả đã tách: {out_dir}")
+            else:
+                if model is None:
+                    model = load_demucs_model(model_name, threads)
+                def file_progress(frac, i=i):
+                    if progress:
+                        progress(int((i - 1 + frac) / len(videos) * 100))
+                tracks = _separate_into(model, video, out_dir, audio_hash, model_name, jobs, window_s, overlap_s,
+                                        file_progress)
+            if merge_music:
+                music = music_track(out_dir, tracks, gain_policy, log)
+                if music:
+                    tracks = {name: p for name, p in tracks.items() if name not in ("drums", "bass", "other")}
+                    tracks["music"] = music
+            results[video] = tracks
+        except Exception as e:
+            errors[video] = str(e)
+            log(f"  Lỗi: {e}")
+        if progress:
+            progress(int(i / len(videos) * 100))
+    return results, errors
 
-    # ✅ Xóa 3 file gốc sau khi gộp thành công
-    if delete_original:
-        for f in tracks:
-            try:
-                os.remove(f)
-            except Exception as e:
-                print(f"Không thể xóa {f}: {e}")
+# --- Hàm tách audio bằng Demucs ---
+def separate_audio(input_path, output_dir, model_name=DEFAULT_MODEL, threads=None):
+    """One video -> {stem: path} of this video only (model loaded once per process, cached by audio hash)."""
+    results, errors = separate_batch([input_path], output_dir, model_name, threads, merge_music=False)
+    if errors:
+        raise RuntimeError(errors[input_path])
+    return results[input_path]
+
+# --- Hàm gộp bass+drums+other thành music-<gain>.wav ---
+GAIN_POLICIES = ("unity", "average", "peak")
+MIX_CHUNK_FRAMES = 1 << 18   # ~6 s at 44.1 kHz per step
+PEAK_CEILING = 10 ** (-1 / 20)  # -1 dBFS for the "peak" policy
+
+def wav_memmap(path):
+    """Memory-map the sample data of a 16-bit PCM WAV -> int16 array (frames, channels), samplerate."""
+    with open(path, "rb") as f:
+        riff, _, fmt = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or fmt != b"WAVE":
+            raise ValueError(f"Không phải file WAV: {path}")
+        channels = samplerate = bits = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"WAV không có chunk data: {path}")
+            cid, size = struct.unpack("<4sI", header)
+            if cid == b"fmt ":
+                audio_format, channels, samplerate, _, _, bits = struct.unpack("<HHIIHH", f.read(16))
+                if audio_format not in (1, 0xFFFE) or bits != 16:
+                    raise ValueError(f"Chỉ hỗ trợ WAV PCM 16-bit: {path}")
+                f.seek(size - 16 + (size & 1), 1)
+            elif cid == b"data":
+                offset = f.tell()
+                break
+            else:
+                f.seek(size + (size & 1), 1)
+    frames = min(size, os.path.getsize(path) - offset) // (2 * channels)
+    if frames == 0:
+        return np.zeros((0, channels), dtype=np.int16), samplerate
+    return np.memmap(path, dtype=np.int16, mode="r", offset=offset, shape=(frames, channels)), samplerate
+
+def mix_stems(paths, out_path, gain_policy="unity", chunk_frames=MIX_CHUNK_FRAMES):
+    """Sum 16-bit WAV stems chunk by chunk from memory maps and write out_path as it goes.
+
+    gain_policy: "unity"   plain sum (Demucs stems add back up to the original mix);
+                 "average" divide by the number of stems (what ffmpeg amix does);
+                 "peak"    plain sum, scaled down only if it would exceed -1 dBFS (extra read pass).
+    Shorter stems are padded with silence. Samples that still exceed int16 are clipped and counted.
+    Returns (out_path, gain, clipped_samples)."""
+    if gain_policy not in GAIN_POLICIES:
+        raise ValueError(f"gain_policy phải là một trong {GAIN_POLICIES}")
+    maps = [wav_memmap(p) for p in paths]
+    try:
+        rates = {sr for _, sr in maps}
+        chans = {m.shape[1] for m, _ in maps}
+        if len(rates) != 1 or len(chans) != 1:
+            raise ValueError("Các stem phải cùng sample rate và số kênh")
+        samplerate, channels = rates.pop(), chans.pop()
+        total = max(m.shape[0] for m, _ in maps)
 
-    return out_file
+        def chunk_sum(start):
+            end = min(total, start + chunk_frames)
+            acc = np.zeros((end - start, channels), dtype=np.int32)
+            for m, _ in maps:
+                if start < m.shape[0]:
+                    part = m[start:min(end, m.shape[0])]
+                    acc[:len(part)] += part
+            return acc
+
+        gain = 1.0
+        if gain_policy == "average":
+            gain = 1.0 / len(maps)
+        elif gain_policy == "peak":
+            peak = max((int(np.abs(chunk_sum(i)).max(initial=0)) for i in range(0, total, chunk_frames)), default=0)
+            if peak > PEAK_CEILING * 32767:
+                gain = PEAK_CEILING * 32767 / peak
+        clipped = 0
+        with open_wav_writer(out_path, channels, samplerate) as w:
+            for start in range(0, total, chunk_frames):
+                acc = chunk_sum(start)
+                if gain != 1.0:
+                    acc = np.rint(acc * gain).astype(np.int32)
+                over = np.abs(acc) > 32767
+                if over.any():
+                    clipped += int(over.sum())
+                    np.clip(acc, -32768, 32767, out=acc)
+                w.writeframes(acc.astype(np.int16).tobytes())
+    finally:
+        del maps  # release the mappings before the stems can be deleted (Windows)
+    return out_path, gain, clipped
 
 
 # --- GUI ---
@@ -60,15 +402,24 @@ class AudioExtractorApp:
         self.root.geometry("550x350")
         self.root.configure(bg="#2c2f33")
 
-        self.file_path = ""
+        self.file_paths = []
 
         # Label
         self.video_label = tk.Label(root, text="Chưa chọn video", fg="white", bg="#2c2f33")
         self.video_label.pack(pady=5)
 
         # Buttons
-        tk.Button(root, text="Chọn Video", command=self.load_video,
-                  font=("Arial", 12), bg="#7289da", fg="white", relief="flat").pack(pady=15, ipadx=10, ipady=5)
+        frm = tk.Frame(root, bg="#2c2f33")
+        frm.pack(pady=15)
+        tk.Button(frm, text="Chọn Video", command=self.load_video,
+                  font=("Arial", 12), bg="#7289da", fg="white", relief="flat").pack(side="left", padx=6, ipadx=10, ipady=5)
+        tk.Button(frm, text="Chọn thư mục", command=self.load_folder,
+                  font=("Arial", 12), bg="#7289da", fg="white", relief="flat").pack(side="left", padx=6, ipadx=10, ipady=5)
+        tk.Label(frm, text="Số luồng CPU:", fg="white", bg="#2c2f33").pack(side="left", padx=6)
+        self.threads_spin = tk.Spinbox(frm, from_=1, to=max(1, os.cpu_count() or 1), width=4)
+        self.threads_spin.delete(0, "end")
+        self.threads_spin.insert(0, str(os.cpu_count() or 1))
+        self.threads_spin.pack(side="left")
         tk.Button(root, text=" Bắt đầu tách âm thanh", command=self.start_process,
                   font=("Arial", 13, "bold"), bg="#faa61a", fg="black", relief="flat").pack(pady=15, ipadx=15, ipady=8)
 
@@ -85,16 +436,23 @@ class AudioExtractorApp:
         self.log_box.see("end")
 
     def load_video(self):
-        path = filedialog.askopenfilename(filetypes=[("Video files","*.mp4;*.mkv;*.avi")])
+        paths = filedialog.askopenfilenames(filetypes=[("Video files","*.mp4;*.mkv;*.avi")])
+        if paths:
+            self.file_paths = list(paths)
+            names = ", ".join(os.path.basename(p) for p in paths[:3])
+            self.video_label.config(text=f"🎥 {names}" + (f" (+{len(paths) - 3})" if len(paths) > 3 else ""))
+
+    def load_folder(self):
+        path = filedialog.askdirectory()
         if path:
-            self.file_path = path
-            self.video_label.config(text=f"🎥 {os.path.basename(path)}")
+            self.file_paths = collect_videos([path])
+            self.video_label.config(text=f"📁 {path} ({len(self.file_paths)} video)")
 
     def start_process(self):
         threading.Thread(target=self.full_process).start()
 
     def full_process(self):
-        if not self.file_path:
+        if not self.file_paths:
             return messagebox.showerror("Lỗi","Cần chọn video trước")
         outdir = "output"
         os.makedirs(outdir, exist_ok=True)
@@ -103,21 +461,19 @@ class AudioExtractorApp:
             self.progress["value"] = 0
             self.log(" Đang tách audio bằng Demucs...")
 
-            tracks = separate_audio(self.file_path, outdir)
-            self.progress["value"] = 70
-
-            # Lấy folder chứa file demucs tạo ra
-            track_folder = os.path.dirname(list(tracks.values())[0])
-
-            # Gộp music
-            music_file = merge_music_tracks(track_folder)
+            def set_progress(v):
+                self.progress["value"] = v
+            results, errors = separate_batch(self.file_paths, outdir, threads=int(self.threads_spin.get()),
+                                             log=self.log, progress=set_progress)
             self.progress["value"] = 100
 
             msg = " Hoàn tất!\nCác file đã tách:"
-            for name, path in tracks.items():
-                msg += f"\n- {name}: {path}"
-            if music_file:
-                msg += f"\n- music: {music_file} (gộp drums+bass+other)"
+            for video, tracks in results.items():
+                msg += f"\n{os.path.basename(video)}:"
+                for name, path in tracks.items():
+                    msg += f"\n- {name}: {path}" + (" (gộp drums+bass+other)" if name == "music" else "")
+            for video, err in errors.items():
+                msg += f"\n{os.path.basename(video)}: lỗi - {err}"
             messagebox.showinfo("Xong", msg)
             self.log(msg)
 
@@ -125,7 +481,33 @@ class AudioExtractorApp:
             messagebox.showerror(" Lỗi", str(e))
             self.log(f"Error: {e}")
 
+# --- Chạy hàng loạt (không giao diện) ---
+def main_cli(argv=None):
+    ap = argparse.ArgumentParser(description="Tách vocals/music cho nhiều video, model Demucs chỉ tải một lần")
+    ap.add_argument("inputs", nargs="+", help="file video hoặc thư mục chứa video")
+    ap.add_argument("-o", "--output-dir", default="output")
+    ap.add_argument("-n", "--model", default=DEFAULT_MODEL)
+    ap.add_argument("--threads", type=int, default=None, help="số luồng CPU cho torch (mặc định: tất cả)")
+    ap.add_argument("-j", "--jobs", type=int, default=0, help="số worker song song trong mỗi file (apply_model)")
+    ap.add_argument("--window", type=float, default=DEFAULT_WINDOW_S,
+                    help="tách theo cửa sổ N giây để giới hạn RAM (0 = cả file một lần)")
+    ap.add_argument("--overlap", type=float, default=DEFAULT_OVERLAP_S, help="độ dài crossfade giữa hai cửa sổ (giây)")
+    ap.add_argument("--gain", choices=GAIN_POLICIES, default="unity",
+                    help="gộp music-<gain>.wav: unity = cộng nguyên, average = chia đều như ffmpeg amix, peak = giảm nếu vượt -1 dBFS")
+    ap.add_argument("--keep-stems", action="store_true", help="trả về drums/bass/other, không gộp thành music")
+    args = ap.parse_args(argv)
+    results, errors = separate_batch(args.inputs, args.output_dir, args.model, args.threads, args.jobs,
+                                     merge_music=not args.keep_stems, window_s=args.window, overlap_s=args.overlap,
+                                     gain_policy=args.gain)
+    for video, tracks in results.items():
+        print(f"OK   {video}: " + ", ".join(f"{k}={v}" for k, v in tracks.items()))
+    for video, err in errors.items():
+        print(f"FAIL {video}: {err}", file=sys.stderr)
+    return 1 if errors or not results else 0
+
 if __name__=="__main__":
+    if len(sys.argv) > 1:
+        sys.exit(main_cli())
     root = tk.Tk()
     AudioExtractorApp(root)
     root.mainloop()
@@ -0,0 +1,121 @@
+"""
+Bộ đọc SRT dùng chung cho srt_to_mp3_tts.py và transdub.py.
+Đọc một lượt theo dòng (không regex DOTALL, không strptime), trả về các Cue gọn nhẹ
+với thời gian là số nguyên mili-giây.
+- Chấp nhận CRLF, BOM UTF-8, mili-giây ngăn bằng ',' hoặc '.', giờ > 99.
+- Cue thiếu số thứ tự hoặc thiếu dòng trống phân cách vẫn đọc được.
+- Cue có dòng thời gian hỏng hoặc không có chữ thì bỏ qua (giống nhau ở cả hai công cụ).
+"""
+import re
+
+_TIMING = re.compile(
+    r'\s*(\d+):(\d{1,2}):(\d{1,2})[,.](\d{1,3})\s*-->\s*(\d+):(\d{1,2}):(\d{1,2})[,.](\d{1,3})')
+
+
+class Cue:
+    __slots__ = ("index", "start_ms", "end_ms", "speaker", "text")
+
+    def __init__(self, index, start_ms, end_ms, speaker, text):
+        self.index = index
+        self.start_ms = start_ms
+        self.end_ms = end_ms
+        self.speaker = speaker
+        self.text = text
+
+    def __repr__(self):
+        return f"Cue({self.index}, {self.start_ms}, {self.end_ms}, {self.speaker!r}, {self.text!r})"
+
+
+# "5" -> 500 ms, "05" -> 50 ms, "005" -> 5 ms
+_FRAC_SCALE = (0, 100, 10, 1)
+
+
+def _ms(h, m, s, frac):
+    return ((int(h) * 60 + int(m)) * 60 + int(s)) * 1000 + int(frac) * _FRAC_SCALE[len(frac)]
+
+
+def timestamp_to_ms(t):
+    """'HH:MM:SS,mmm' (or with '.') -> int milliseconds."""
+    hms, _, frac = t.strip().replace(".", ",").partition(",")
+    h, m, s = hms.split(":")
+    return _ms(h, m, s, frac or "0")
+
+
+def split_speaker(text):
+    """'Anna: hello' -> ('Anna', 'hello'); lines without a short 'name:' prefix go to Narrator."""
+    if ":" in text and not text.startswith("http"):
+        spk, dialog = text.split(":", 1)
+        if len(spk) <= 30:
+            return spk.strip(), dialog.strip()
+    return "Narrator", text
+
+
+def _make_cue(index, timing, text):
+    body = " ".join(text)
+    if not body:
+        return None
+    speaker, dialog = split_speaker(body)
+    return Cue(index, timing[0], timing[1], speaker, dialog)
+
+
+def iter_cues(lines):
+    """Yield Cue objects from an iterable of text lines (single pass)."""
+    cue_no = 0
+    index = None       # index line seen before the next timing line
+    cue_index = None
+    timing = None      # (start_ms, end_ms) while inside a cue
+    pending = None     # digits-only line inside a cue: next index, or part of the text
+    text = []
+
+    first = True
+    for line in lines:
+        line = line.strip()
+        if first:
+            line = line.lstrip("\ufeff")
+            first = False
+        if "-->" in line:
+            if timing is not None:
+                # no blank line before this cue: a trailing digits line was its index
+                cue = _make_cue(cue_index, timing, text)
+                if cue is not None:
+                    yield cue
+                index = int(pending) if pending is not None else None
+            m = _TIMING.match(line)
+            cue_no += 1
+            cue_index = index if index is not None else cue_no
+            if m is None:
+                timing = None  # malformed timing: skip this cue's text
+            else:
+                h1, m1, s1, f1, h2, m2, s2, f2 = m.groups()
+                timing = (_ms(h1, m1, s1, f1), _ms(h2, m2, s2, f2))
+            index, pending, text = None, None, []
+        elif not line:
+            if timing is not None:
+                if pending is not None:
+                    text.append(pending)
+                cue = _make_cue(cue_index, timing, text)
+                if cue is not None:
+                    yield cue
+            index, timing, pending, text = None, None, None, []
+        elif timing is None:
+            index = int(line) if line.isdecimal() else None
+        else:
+            if pending is not None:
+                text.append(pending)
+                pending = None
+            if line.isdecimal():
+                pending = line
+            else:
+                text.append(line)
+    if timing is not None:
+        if pending is not None:
+            text.append(pending)
+        cue = _make_cue(cue_index, timing, text)
+        if cue is not None:
+            yield cue
+
+
+def parse_srt(srt_path):
+    """Read an .srt file into a list of Cue (UTF-8, BOM optional, CRLF or LF)."""
+    with open(srt_path, "r", encoding="utf-8-sig", errors="ignore") as f:
+        return list(iter_cues(f))
@@ -1,47 +1,35 @@
 """
 Ý tưởng: Chuyển file SRT sang file audio MP3 sử dụng edge-tts. Vì edge-tts có nhiều giọng, nên có thể chọn giọng cho từng nhân vật.
 Yêu cầu cài đặt:
-    pip install edge-tts pydub
+    pip install edge-tts pydub numpy
     ffmpeg cần có trong PATH để pydub export/play được.
 """
-import re
 import os
 import io
+import math
+import sys
+import glob
+import random
 import json
+import time
+import hashlib
+import argparse
 import asyncio
 import tempfile
+import subprocess
 import threading
+import multiprocessing
+import concurrent.futures
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 from pydub import AudioSegment
 import edge_tts
-from datetime import datetime
+import numpy as np
+from tts_cache import TTSCache, cache_key
+from srt_parser import parse_srt
+from voice_catalog import VoiceCatalog
 
 # ---------------- SRT utils ----------------
-def parse_srt(srt_path):
-    
-    with open(srt_path, 'r', encoding='utf-8', errors='ignore') as f:
-        content = f.read()
-    pattern = re.compile(
-        r'(\d+)\s*\n\s*(\d{2}:\d{2}:\d{2},\d{3})\s*-->\s*(\d{2}:\d{2}:\d{2},\d{3})\s*\n(.*?)(?=\n\s*\n|\n\s*\d+\s*\n|\Z)',
-        re.DOTALL
-    )
-    out = []
-    for match in pattern.finditer(content):
-        idx = match.group(1).strip()
-        start = match.group(2).strip()
-        end = match.group(3).strip()
-        text = match.group(4).strip().replace('\r', '').replace('\n', ' ')
-        if ":" in text and not text.startswith("http") and len(text.split(":",1)[0]) <= 30:
-            spk, dialog = text.split(":", 1)
-            speaker = spk.strip()
-            dialog = dialog.strip()
-        else:
-            speaker = "Narrator"
-            dialog = text
-        out.append((idx, start, end, speaker, dialog))
-    return out
-
 def split_text(text, max_length=200):
   
     words = text.split()
@@ -59,59 +47,480 @@ def split_text(text, max_length=200):
         chunks.append(chunk)
     return chunks
 
-def srt_time_to_ms(t):
-    
-    # Using datetime to parse; handle cases >24h not expected in subtitles
-    dt = datetime.strptime(t, "%H:%M:%S,%f")
-    return dt.hour*3600000 + dt.minute*60000 + dt.second*1000 + int(dt.microsecond/1000)
-
 # ---------------- edge-tts helpers ----------------
-async def _list_voices_async():
-    return await edge_tts.list_voices()
-
-def fetch_all_voices():
-    """Return list of (short, label)"""
-    try:
-        voices = asyncio.run(_list_voices_async())
-        voice_items = []
-        for v in voices:
-            short = v.get("ShortName")
-            locale = v.get("Locale", "")
-            gender = v.get("Gender", "")
-            display = v.get("DisplayName") or short
-            label = f"{short} — {locale} — {gender} — {display}"
-            voice_items.append((short, label))
-        voice_items.sort(key=lambda x: x[0].lower())
-        return voice_items
-    except Exception as e:
-        print("Warning: cannot fetch edge-tts voices:", e)
-        # fallback
-        fallback = [
-            ("vi-VN-HoaiMyNeural", "vi-VN-HoaiMyNeural — vi-VN — Female — HoaiMy"),
-            ("vi-VN-NamMinhNeural", "vi-VN-NamMinhNeural — vi-VN — Male — NamMinh"),
-            ("en-US-JennyNeural", "en-US-JennyNeural — en-US — Female — Jenny"),
-            ("en-US-GuyNeural", "en-US-GuyNeural — en-US — Male — Guy"),
-        ]
-        return fallback
 
 async def _tts_save_async(text, voice, filepath):
     comm = edge_tts.Communicate(text, voice=voice)
     await comm.save(filepath)
 
-def tts_save_tempfile(text, voice):
-    """Generate mp3 to a tempfile and return path (synchronous wrapper)."""
+async def _tts_bytes_async(text, voice, rate="+0%"):
+    """Collect the mp3 bytes from Communicate.stream() in memory."""
+    comm = edge_tts.Communicate(text, voice=voice, rate=rate)
+    audio = bytearray()
+    async for chunk in comm.stream():
+        if chunk["type"] == "audio":
+            audio += chunk["data"]
+    return bytes(audio)
+
+async def _tts_words_async(text, voice, rate="+0%"):
+    """Like _tts_bytes_async, plus the WordBoundary events as [(offset_ms, duration_ms, word)]."""
+    comm = edge_tts.Communicate(text, voice=voice, rate=rate, boundary="WordBoundary")
+    audio = bytearray()
+    words = []
+    async for chunk in comm.stream():
+        if chunk["type"] == "audio":
+            audio += chunk["data"]
+        elif chunk["type"] == "WordBoundary":
+            # offsets come in 100 ns ticks
+            words.append((chunk["offset"] / 10000, chunk["duration"] / 10000, chunk["text"]))
+    return bytes(audio), words
+
+# edge-tts always answers with 24 kHz mono mp3
+TTS_FRAME_RATE = 24000
+TTS_CHANNELS = 1
+
+def _decode_mp3_tempfile(data):
+    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
+    try:
+        tmp.write(data)
+        tmp.close()
+        return AudioSegment.from_file(tmp.name, format="mp3")
+    finally:
+        tmp.close()
+        try:
+            os.remove(tmp.name)
+        except OSError:
+            pass
+
+def decode_mp3_bytes(data, frame_rate=TTS_FRAME_RATE, channels=TTS_CHANNELS):
+    """Decode mp3 bytes to an AudioSegment through an ffmpeg pipe (no temp files).
+    Falls back to the on-disk path if the pipe decode fails."""
+    cmd = [AudioSegment.converter, "-hide_banner", "-loglevel", "error",
+           "-f", "mp3", "-i", "pipe:0",
+           "-f", "s16le", "-ac", str(channels), "-ar", str(frame_rate), "pipe:1"]
+    try:
+        proc = subprocess.run(cmd, input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+        if proc.stdout:
+            return AudioSegment(data=proc.stdout, sample_width=2, frame_rate=frame_rate, channels=channels)
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return _decode_mp3_tempfile(data)
+
+# ---------------- Retries / adaptive concurrency ----------------
+TRANSIENT, THROTTLED, PERMANENT = "transient", "throttled", "permanent"
+DEFAULT_TTS_ATTEMPTS = 5
+
+def classify_tts_error(exc):
+    """TRANSIENT (retry), THROTTLED (retry, and back off the concurrency) or PERMANENT."""
+    status = getattr(exc, "status", None)  # aiohttp ClientResponseError / WSServerHandshakeError
+    if isinstance(status, int):
+        if status in (403, 429):
+            # edge-tts has already retried a 403 with a fresh clock skew; what is left is rate limiting
+            return THROTTLED
+        if status in (408, 425) or status >= 500:
+            return TRANSIENT
+        return PERMANENT
+    if isinstance(exc, edge_tts.exceptions.NoAudioReceived):
+        # raised for text with nothing to speak (e.g. only symbols): asking again gives the same answer
+        return PERMANENT
+    if isinstance(exc, (ValueError, TypeError)):
+        return PERMANENT  # bad voice / rate string
+    return TRANSIENT  # timeouts, dropped connections, websocket errors...
+
+def retry_after_s(exc):
+    """Seconds from a Retry-After header on the error, or None."""
+    headers = getattr(exc, "headers", None)
+    try:
+        return float(headers.get("Retry-After")) if headers else None
+    except (TypeError, ValueError):
+        return None
+
+class RetryPolicy:
+    """Capped exponential backoff with full jitter; a Retry-After from the server is a floor."""
+
+    def __init__(self, attempts=DEFAULT_TTS_ATTEMPTS, base_delay=0.5, max_delay=30.0):
+        self.attempts = max(1, int(attempts))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt, exc=None):
+        """Sleep before retry number `attempt` (1-based)."""
+        d = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        floor = retry_after_s(exc)
+        return max(d, min(floor, self.max_delay)) if floor else d
+
+class AdaptiveLimit:
+    """Concurrency limit driven by AIMD, for use on one asyncio loop.
+
+    Every success adds 1/limit (about +1 slot per round of requests);
+    a throttling signal halves the limit. Only requests started after
+    the last cut can cut again, so one burst of 429s from the same
+    round counts as a single signal. With adaptive=False the limit
+    stays at `initial`.
+    """
+
+    def __init__(self, initial, minimum=1, maximum=None, decrease=0.5, adaptive=True):
+        self.maximum = max(1, maximum or initial)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.lowest = self.limit
+        self.decrease = decrease
+        self.adaptive = adaptive
+        self.in_flight = 0
+        self.cuts = 0
+        self._last_cut = 0.0
+        self._waiters = []
+
+    async def acquire(self):
+        """Wait for a slot; returns the start time to hand back to release()."""
+        while self.in_flight >= int(self.limit):
+            fut = asyncio.get_running_loop().create_future()
+            self._waiters.append(fut)
+            try:
+                await fut
+            finally:
+                if fut in self._waiters:
+                    self._waiters.remove(fut)
+        self.in_flight += 1
+        return time.monotonic()
+
+    def release(self, started, outcome=None):
+        """outcome: "ok", THROTTLED, or anything else (no adjustment)."""
+        self.in_flight -= 1
+        if self.adaptive and outcome == "ok":
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+        elif self.adaptive and outcome == THROTTLED:
+            if started >= self._last_cut:
+                self._last_cut = time.monotonic()
+                self.limit = max(self.minimum, self.limit * self.decrease)
+                self.lowest = min(self.lowest, self.limit)
+                self.cuts += 1
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            fut = self._waiters.pop(0)
+            if not fut.done():
+                fut.set_result(None)
+                free -= 1
+
+def tts_save_tempfile(text, voice, cache=None):
+    """Generate mp3 to a tempfile and return path (synchronous wrapper).
+    If a TTSCache is given, a cached copy is reused and fresh audio is stored."""
     tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
     tmp.close()
+    key = cache_key(text, voice)
     try:
-        asyncio.run(_tts_save_async(text, voice, tmp.name))
+        cached = cache.get(key) if cache is not None else None
+        if cached is not None:
+            with open(tmp.name, "wb") as f:
+                f.write(cached)
+            return tmp.name
+        policy = RetryPolicy()
+        for attempt in range(1, policy.attempts + 1):
+            try:
+                asyncio.run(_tts_save_async(text, voice, tmp.name))
+                break
+            except Exception as e:
+                if attempt == policy.attempts or classify_tts_error(e) == PERMANENT:
+                    raise
+                time.sleep(policy.delay(attempt, e))
+        if cache is not None:
+            cache.put_file(key, tmp.name)
         return tmp.name
-    except Exception as e:
+    except Exception:
         try:
             os.remove(tmp.name)
         except:
             pass
         raise
 
+# ---------------- Cue coalescing ----------------
+COALESCE_MAX_GAP_MS = 1500
+COALESCE_MAX_CUES = 8
+WORDS_SIDECAR = ".words.json"  # WordBoundary timings next to a group's cached audio
+SENTENCE_END = ".!?…,;:。！？"
+
+def join_cue_texts(texts):
+    """Join cue lines into one request text. Returns (text, [(start, end) char span per cue]).
+    Lines without closing punctuation get a '.', so the voice still pauses between cues."""
+    parts, spans, pos = [], [], 0
+    for t in texts:
+        t = t.strip()
+        spans.append((pos, pos + len(t)))
+        if t and t[-1] not in SENTENCE_END:
+            t += "."
+        parts.append(t)
+        pos += len(t) + 1
+    return " ".join(parts), spans
+
+def split_by_words(seg, text, spans, words):
+    """Cut `seg` (the audio of `text`) into one segment per char span, using the
+    WordBoundary timings [(offset_ms, duration_ms, word)]. Each cut sits halfway
+    through the pause between two cues. Returns None if some cue got no word."""
+    first, last = [None] * len(spans), [None] * len(spans)
+    lowered = text.lower()
+    cursor, k = 0, 0
+    for offset, duration, word in words:
+        at = lowered.find(word.lower(), cursor)
+        if at < 0:
+            continue  # the service normalized this word (numbers, symbols...): skip it
+        cursor = at + len(word)
+        while k < len(spans) - 1 and at >= spans[k][1]:
+            k += 1
+        if first[k] is None:
+            first[k] = offset
+        last[k] = offset + duration
+    if any(f is None for f in first):
+        return None
+    cuts = [0]
+    for k in range(len(spans) - 1):
+        cut = int((last[k] + first[k + 1]) / 2)
+        cuts.append(min(max(cut, cuts[-1]), len(seg)))
+    cuts.append(len(seg))
+    return [seg[cuts[k]:cuts[k + 1]] for k in range(len(spans))]
+
+def plan_coalesced(subs, jobs, indices, max_chars, max_gap_ms=COALESCE_MAX_GAP_MS,
+                   max_cues=COALESCE_MAX_CUES, skip=None):
+    """Partition `indices` (cues to synthesize, in order) into runs that go out as one request:
+    consecutive cues with the same voice and rate, each a single chunk, at most max_gap_ms apart
+    and max_chars long together. skip(i) -> True keeps a cue on its own (e.g. already cached).
+    Returns a list of index lists."""
+    groups = []
+    length = 0
+    for i in indices:
+        chunks, voice, rate = jobs[i][:3]
+        single = len(chunks) == 1 and not (skip and skip(i))
+        g = groups[-1] if groups else None
+        if (single and g is not None and g[-1] == i - 1 and len(g) < max_cues
+                and length + 1 + len(chunks[0]) + 1 <= max_chars
+                and subs[i].start_ms - subs[i - 1].end_ms <= max_gap_ms):
+            _, prev_voice, prev_rate = jobs[g[-1]][:3]
+            if prev_voice == voice and prev_rate == rate:
+                g.append(i)
+                length += 1 + len(chunks[0]) + 1
+                continue
+        groups.append([i])
+        length = len(chunks[0]) + 1 if single else max_chars  # a multi-chunk / skipped cue stays alone
+    return groups
+
+# ---------------- TTS worker pool ----------------
+DEFAULT_TTS_CONCURRENCY = 8
+
+class TTSPool:
+    """Long-lived asyncio loop (own thread) that fans out edge-tts requests.
+
+    At most `concurrency` requests are in flight at once. `synth` is the
+    coroutine returning one chunk's mp3 bytes: synth(text, voice, rate=...).
+    It defaults to edge-tts and can be swapped for a local fake TTS server.
+    Audio never touches disk (unless the pipe decode has to fall back);
+    with a TTSCache, cached chunks skip the network entirely.
+    `budget` is an optional multiprocessing semaphore that caps requests
+    across several processes (batch mode) on top of the local limit.
+    `synth_words` is the same with WordBoundary timings, returning
+    (mp3 bytes, words); it serves coalesced groups of cues (map_grouped).
+    Failed requests are classified (classify_tts_error) and retried with
+    jittered backoff (`retry`, a RetryPolicy); with adaptive=True the
+    number in flight follows AIMD between 1 and `concurrency`, shrinking
+    when the service throttles and creeping back up as requests succeed.
+    """
+
+    def __init__(self, concurrency=DEFAULT_TTS_CONCURRENCY, synth=None, cache=None, budget=None,
+                 synth_words=None, retry=None, adaptive=True):
+        self.concurrency = max(1, int(concurrency))
+        self.retry = retry or RetryPolicy()
+        self.adaptive = adaptive
+        self.synth = synth or _tts_bytes_async
+        self.synth_words = synth_words or _tts_words_async
+        self.cache = cache
+        self.budget = budget
+        self.saved_requests = 0   # cue requests avoided by coalescing
+        self.group_fallbacks = 0  # groups that had to be re-synthesized cue by cue
+        self.requests = 0         # requests sent, retries included
+        self.retries = 0
+        self.throttled = 0        # failures classified THROTTLED
+        self.gave_up = 0          # requests that failed for good (permanent or out of attempts)
+        self.limit = AdaptiveLimit(self.concurrency, adaptive=adaptive)
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.run_until_complete(self.loop.shutdown_default_executor())
+        self.loop.close()
+
+    async def _call(self, synth, text, voice, rate):
+        if self.budget is None:
+            return await synth(text, voice, rate=rate)
+        # shared across processes: poll instead of blocking the loop
+        while not self.budget.acquire(False):
+            await asyncio.sleep(0.02)
+        try:
+            return await synth(text, voice, rate=rate)
+        finally:
+            self.budget.release()
+
+    async def _limited(self, synth, text, voice, rate="+0%"):
+        """One service request under the adaptive (and the cross-process) concurrency limit,
+        retried per self.retry until it succeeds or fails for good."""
+        attempt = 0
+        while True:
+            attempt += 1
+            started = await self.limit.acquire()
+            outcome = None
+            self.requests += 1
+            try:
+                result = await self._call(synth, text, voice, rate)
+                outcome = "ok"
+                return result
+            except Exception as e:
+                outcome = classify_tts_error(e)
+                if outcome == THROTTLED:
+                    self.throttled += 1
+                if outcome == PERMANENT or attempt >= self.retry.attempts:
+                    self.gave_up += 1
+                    raise
+                error = e
+            finally:
+                self.limit.release(started, outcome)
+            self.retries += 1
+            await asyncio.sleep(self.retry.delay(attempt, error))
+
+    def stats_line(self):
+        return (f"TTS: {self.requests} request, {self.retries} lần thử lại ({self.throttled} lần bị giới hạn tốc độ), "
+                f"{self.gave_up} request hỏng hẳn; song song {int(self.limit.limit)}/{self.concurrency} "
+                f"(thấp nhất {int(self.limit.lowest)})")
+
+    async def _synth_chunk(self, text, voice, rate="+0%"):
+        key = cache_key(text, voice, rate)
+        data = self.cache.get(key) if self.cache is not None else None
+        if data is None:
+            data = await self._limited(self.synth, text, voice, rate)
+            if self.cache is not None:
+                await asyncio.to_thread(self.cache.put, key, data)
+        # decoding spawns ffmpeg; keep it off the loop thread
+        return await asyncio.to_thread(decode_mp3_bytes, data)
+
+    async def _synth_cue(self, chunks, voice, rate="+0%"):
+        results = await asyncio.gather(*(self._synth_chunk(ch, voice, rate) for ch in chunks),
+                                       return_exceptions=True)
+        seg_all = AudioSegment.silent(duration=0)
+        errors = []
+        for res in results:
+            if isinstance(res, Exception):
+                # On TTS failure keep timing with a short silence
+                errors.append(res)
+                res = AudioSegment.silent(duration=500)
+            seg_all += res
+        return seg_all, errors
+
+    async def _synth_group(self, texts, voice, rate="+0%"):
+        text, spans = join_cue_texts(texts)
+        key = cache_key(text, voice, rate)
+        try:
+            data = words = None
+            # the words live in a sidecar of the audio entry, so they are evicted together
+            raw = self.cache.get_sidecar(key, WORDS_SIDECAR) if self.cache is not None else None
+            if raw is not None:
+                data = self.cache.get(key)
+                if data is not None:
+                    words = json.loads(raw)
+            if words is None:
+                data, words = await self._limited(self.synth_words, text, voice, rate)
+                if self.cache is not None:
+                    await asyncio.to_thread(self.cache.put, key, data)
+                    await asyncio.to_thread(self.cache.put_sidecar, key, WORDS_SIDECAR,
+                                            json.dumps(words).encode("utf-8"))
+            seg = await asyncio.to_thread(decode_mp3_bytes, data)
+            parts = split_by_words(seg, text, spans, words)
+        except Exception:
+            parts = None
+        if parts is None:
+            # request failed or its words could not be matched to the cues: one request per cue
+            self.group_fallbacks += 1
+            return await asyncio.gather(*(self._synth_cue([t], voice, rate) for t in texts))
+        self.saved_requests += len(texts) - 1
+        return [(part, []) for part in parts]
+
+    def submit(self, chunks, voice, rate="+0%"):
+        """Schedule one cue (list of text chunks). Returns a concurrent.futures.Future
+        resolving to (AudioSegment, [errors])."""
+        return asyncio.run_coroutine_threadsafe(self._synth_cue(chunks, voice, rate), self.loop)
+
+    def submit_group(self, texts, voice, rate="+0%"):
+        """Schedule several short cues as one request, split back per cue with the
+        WordBoundary timings. The Future resolves to [(AudioSegment, [errors])] per cue."""
+        return asyncio.run_coroutine_threadsafe(self._synth_group(texts, voice, rate), self.loop)
+
+    def map_grouped(self, jobs, groups, window=None, on_done=None):
+        """map_ordered where each of `groups` (lists of job indices, see plan_coalesced)
+        goes out as one request. Yields (i, (segment, errors)) per job index in order;
+        on_done(i, result) per job as well."""
+        def _submit(g):
+            if len(g) == 1:
+                return self.submit(*jobs[g[0]])
+            return self.submit_group([jobs[i][0][0] for i in g], *jobs[g[0]][1:])
+
+        def _done(k, result):
+            for i, r in zip(groups[k], result if len(groups[k]) > 1 else [result]):
+                on_done(i, r)
+
+        for k, result in self.map_ordered(groups, window, _done if on_done else None, submit=_submit):
+            if len(groups[k]) == 1:
+                yield groups[k][0], result
+            else:
+                yield from zip(groups[k], result)
+
+    def map_ordered(self, jobs, window=None, on_done=None, submit=None):
+        """Yield (i, (segment, errors)) for each (chunks, voice[, rate]) job, in job order.
+
+        Only `window` cues are scheduled ahead of the consumer so memory stays
+        bounded. on_done(i, result) fires as soon as any cue finishes, in
+        completion order. submit(job) -> Future replaces self.submit(*job).
+        """
+        window = max(1, window or self.concurrency * 4)
+        jobs = iter(jobs)
+        pending = {}
+        next_submit = 0
+
+        def _submit_next():
+            nonlocal next_submit
+            try:
+                job = next(jobs)
+            except StopIteration:
+                return False
+            fut = submit(job) if submit is not None else self.submit(*job)
+            if on_done is not None:
+                def _report(f, i=next_submit):
+                    if not f.cancelled() and f.exception() is None:
+                        on_done(i, f.result())
+                fut.add_done_callback(_report)
+            pending[next_submit] = fut
+            next_submit += 1
+            return True
+
+        while len(pending) < window and _submit_next():
+            pass
+        i = 0
+        try:
+            while i in pending:
+                result = pending.pop(i).result()
+                _submit_next()
+                yield i, result
+                i += 1
+        finally:
+            # consumer stopped early: drop whatever is still queued
+            for fut in pending.values():
+                fut.cancel()
+
 # ---------------- Config save/load ----------------
 def mapping_config_path_for_srt(srt_path):
     base = os.path.splitext(os.path.basename(srt_path))[0]
@@ -136,6 +545,128 @@ def load_voice_map(srt_path):
             print("Could not load voice map:", e)
     return {}
 
+# ---------------- Speaking-rate planner ----------------
+def rate_config_path_for_srt(srt_path):
+    # shared by every SRT in the folder, next to their .voice_map.json files
+    dirn = os.path.dirname(srt_path) or "."
+    return os.path.join(dirn, "voice_rates.json")
+
+class _LockFile:
+    """Cross-process lock: an O_EXCL lock file next to `path`. A lock older than
+    `stale_s` is assumed to belong to a crashed process and is broken."""
+
+    def __init__(self, path, timeout=10.0, stale_s=60.0):
+        self.lock_path = path + ".lock"
+        self.timeout = timeout
+        self.stale_s = stale_s
+
+    def __enter__(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                os.close(os.open(self.lock_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL))
+                return self
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.lock_path) > self.stale_s:
+                        os.remove(self.lock_path)
+                        continue
+                except OSError:
+                    continue  # released in the meantime
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"{self.lock_path} is held by another process")
+                time.sleep(0.05)
+
+    def __exit__(self, *exc):
+        try:
+            os.remove(self.lock_path)
+        except OSError:
+            pass
+
+class SpeakingRatePlanner:
+    """Predicts how long a voice takes to say a line (characters per second,
+    learned per voice from past runs) and picks an edge-tts `rate` up front
+    for lines that would not fit their slot.
+    save() merges this run's observations into the file as it is now, so
+    renders running in parallel on the same folder keep each other's."""
+
+    DEFAULT_CPS = 15.0     # used until a voice has been observed
+    OVERFLOW_TOLERANCE = 1.05
+    MAX_RATE_PCT = 60      # beyond this the fit is left to cut/speed/stretch
+    ALPHA = 0.2            # EMA weight of a new observation
+
+    def __init__(self, path=None):
+        self.path = path
+        self.rates = {}    # voice -> {"cps": float, "n": int}
+        self._new = []     # (voice, cps) observed since the last save
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            try:
+                self.rates = self._load()
+            except Exception as e:
+                print("Could not load voice rates:", e)
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _apply(self, rates, voice, cps):
+        entry = rates.get(voice)
+        if entry is None:
+            rates[voice] = {"cps": cps, "n": 1}
+        else:
+            entry["cps"] += self.ALPHA * (cps - entry["cps"])
+            entry["n"] += 1
+
+    def cps(self, voice):
+        entry = self.rates.get(voice)
+        return entry["cps"] if entry else self.DEFAULT_CPS
+
+    def predict_ms(self, text, voice, rate_pct=0):
+        return len(text) / self.cps(voice) * 1000 / (1 + rate_pct / 100)
+
+    def plan(self, text, voice, slot_dur):
+        """Return the rate percentage (0..MAX_RATE_PCT) to request for this line."""
+        if slot_dur <= 0:
+            return 0
+        ratio = self.predict_ms(text, voice) / slot_dur
+        if ratio <= self.OVERFLOW_TOLERANCE:
+            return 0
+        return min(self.MAX_RATE_PCT, int(math.ceil((ratio - 1) * 100)))
+
+    def observe(self, text, voice, rate_pct, actual_ms):
+        if actual_ms <= 0 or not text:
+            return
+        # normalize back to the voice's natural (+0%) speed
+        cps = len(text) / (actual_ms / 1000) / (1 + rate_pct / 100)
+        with self._lock:
+            self._apply(self.rates, voice, cps)
+            self._new.append((voice, cps))
+
+    def save(self):
+        if not self.path:
+            return
+        try:
+            with self._lock, _LockFile(self.path):
+                # several batch processes may share the folder: replay this run's
+                # observations on top of what the others saved since we loaded
+                rates = self._load()
+                for voice, cps in self._new:
+                    self._apply(rates, voice, cps)
+                tmp = self.path + f".{os.getpid()}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(rates, f, ensure_ascii=False, indent=2)
+                os.replace(tmp, self.path)
+                self.rates, self._new = rates, []
+        except Exception as e:
+            print("Could not save voice rates:", e)
+
+def format_rate(rate_pct):
+    return f"{int(rate_pct):+d}%"
+
 # ---------------- Audio utils ----------------
 def change_speed(sound, speed=1.0):
    
@@ -146,10 +677,639 @@ def change_speed(sound, speed=1.0):
     # set frame rate back to original so playback sample rate is consistent
     return sped_up.set_frame_rate(sound.frame_rate)
 
+def _phase_vocoder(x, rate, n_fft=1024, hop=256):
+    """Time-stretch a float mono signal by `rate` (>1 = shorter) keeping pitch.
+    Whole signal in one pass: strided STFT, vectorized phase advance, overlap-add."""
+    window = np.hanning(n_fft + 1)[:-1]
+    pad = n_fft // 2
+    xp = np.pad(x, (pad, pad + n_fft))
+    frames = np.lib.stride_tricks.sliding_window_view(xp, n_fft)[::hop] * window
+    spec = np.fft.rfft(frames, axis=1)
+
+    # fractional analysis positions, one per output frame
+    steps = np.arange(0, len(spec) - 1, rate)
+    i0 = steps.astype(np.int64)
+    frac = (steps - i0)[:, None]
+    s0, s1 = spec[i0], spec[i0 + 1]
+    mag = (1 - frac) * np.abs(s0) + frac * np.abs(s1)
+
+    # true per-bin phase advance = expected advance + wrapped deviation
+    omega = 2 * np.pi * hop * np.arange(spec.shape[1]) / n_fft
+    dphi = np.angle(s1) - np.angle(s0) - omega
+    dphi -= 2 * np.pi * np.round(dphi / (2 * np.pi))
+    phase = np.empty_like(mag)
+    phase[0] = np.angle(spec[0])
+    phase[1:] = phase[0] + np.cumsum(omega + dphi, axis=0)[:-1]
+    out_frames = np.fft.irfft(mag * np.exp(1j * phase), n=n_fft, axis=1) * window
+
+    # overlap-add: hop divides n_fft, so sum n_fft/hop shifted block planes
+    n_out = len(out_frames)
+    y = np.zeros((n_out - 1) * hop + n_fft)
+    wsum = np.zeros_like(y)
+    wsq = np.broadcast_to(window ** 2, out_frames.shape)
+    for k in range(n_fft // hop):
+        sl = slice(k * hop, k * hop + n_out * hop)
+        y[sl] += out_frames[:, k * hop:(k + 1) * hop].reshape(-1)
+        wsum[sl] += wsq[:, k * hop:(k + 1) * hop].reshape(-1)
+    y /= np.maximum(wsum, 1e-3)
+    return y[pad:]
+
+def time_stretch(sound, target_ms):
+    """Pitch-preserving stretch of an AudioSegment to exactly target_ms."""
+    target_frames = int(sound.frame_rate * target_ms / 1000.0)
+    if target_frames <= 0:
+        return sound[:0]
+    seg = sound.set_sample_width(2)
+    pcm = np.frombuffer(seg.raw_data, dtype=np.int16).reshape(-1, seg.channels).astype(np.float64)
+    if len(pcm) == 0:
+        return AudioSegment.silent(duration=target_ms, frame_rate=sound.frame_rate)
+    rate = len(pcm) / target_frames
+    out = np.zeros((target_frames, seg.channels))
+    for ch in range(seg.channels):
+        y = _phase_vocoder(pcm[:, ch], rate)[:target_frames]
+        out[:len(y), ch] = y
+    out = np.clip(np.rint(out), -32768, 32767).astype(np.int16)
+    return seg._spawn(out.tobytes())
+
+# ---------------- Timeline assembly ----------------
+def fit_to_slot(seg_all, start_ms, slot_dur, overflow_mode='cut'):
+    """Fit one cue's audio into its slot.
+    Returns (segment_to_place, trailing_silence_ms, new_current_pos)."""
+    seg_len = len(seg_all)
+    if seg_len < slot_dur:
+        # shorter -> pad end with silence
+        return seg_all, slot_dur - seg_len, start_ms + slot_dur
+    # seg_len >= slot_dur
+    if overflow_mode == 'speed':
+        if slot_dur <= 0:
+            # if slot_dur==0 fallback to cut first ms
+            return seg_all[:1], 0, start_ms + 1
+        # speed = seg_len / slot_dur -> we need to shrink duration by speed
+        seg_sped = change_speed(seg_all, speed=seg_len / slot_dur)
+        # after speed change, length should be approximately slot_dur; adjust by slicing/padding
+        if len(seg_sped) > slot_dur:
+            seg_sped = seg_sped[:slot_dur]
+        return seg_sped, slot_dur - len(seg_sped), start_ms + slot_dur
+    if overflow_mode == 'stretch':
+        if slot_dur <= 0:
+            return seg_all[:1], 0, start_ms + 1
+        # same duration as 'speed', but pitch-preserving
+        return time_stretch(seg_all, slot_dur), 0, start_ms + slot_dur
+    if overflow_mode == 'overflow':
+        # allow it to overflow: keep full seg_all; this will push timeline forward
+        return seg_all, 0, start_ms + seg_len
+    # 'cut' (and unknown modes)
+    return seg_all[:slot_dur], 0, start_ms + slot_dur
+
+class TimelineAssembler:
+    """Places cues on the output timeline, then renders them in one pass.
+
+    add_cue() only records where each segment goes (same rules as the old
+    `final += ...` loop, including how overflow pushes later cues back).
+    render() preallocates a single int16 PCM buffer and copies every segment
+    to its sample offset, so the cost is linear in the total audio length.
+    """
+
+    def __init__(self, overflow_mode='cut'):
+        self.overflow_mode = overflow_mode
+        self.items = []       # AudioSegment, or int = silence in ms
+        self.current_pos = 0  # timeline position in ms (as seen by the SRT timing)
+        self.overflowed = 0   # cues longer than their slot
+
+    def add_cue(self, start_ms, end_ms, seg_all):
+        gap, placed, pad = self._place(start_ms, end_ms, seg_all)
+        if gap > 0:
+            self._emit(gap)
+        self._emit(placed)
+        if pad > 0:
+            self._emit(pad)
+
+    def _place(self, start_ms, end_ms, seg_all):
+        """Advance current_pos past one cue. Returns (silence_before_ms, segment, silence_after_ms)."""
+        slot_dur = max(0, end_ms - start_ms)
+        if len(seg_all) > slot_dur:
+            self.overflowed += 1
+        # if there's gap between current_pos and start_ms -> insert silence
+        gap = max(0, start_ms - self.current_pos)
+        placed, pad, self.current_pos = fit_to_slot(seg_all, start_ms, slot_dur, self.overflow_mode)
+        return gap, placed, pad
+
+    def _emit(self, item):
+        self.items.append(item)
+
+    def abort(self):
+        self.items.clear()
+
+    def output_format(self):
+        """(frame_rate, channels) the render will use: the widest of all segments."""
+        segs = [it for it in self.items if not isinstance(it, int)]
+        if not segs:
+            return 24000, 1
+        return max(s.frame_rate for s in segs), max(s.channels for s in segs)
+
+    def render(self):
+        frame_rate, channels = self.output_format()
+        parts = []
+        total = 0
+        for it in self.items:
+            if isinstance(it, int):
+                n = int(frame_rate * it / 1000.0)
+                parts.append(n)
+            else:
+                seg = it.set_frame_rate(frame_rate).set_channels(channels).set_sample_width(2)
+                pcm = np.frombuffer(seg.raw_data, dtype=np.int16).reshape(-1, channels)
+                parts.append(pcm)
+                n = len(pcm)
+            total += n
+        buf = np.zeros((total, channels), dtype=np.int16)
+        pos = 0
+        for part in parts:
+            if isinstance(part, int):
+                pos += part  # silence: buffer is already zeroed
+            else:
+                buf[pos:pos + len(part)] = part
+                pos += len(part)
+        return AudioSegment(data=buf.tobytes(), sample_width=2, frame_rate=frame_rate, channels=channels)
+
+class StreamingTimelineWriter(TimelineAssembler):
+    """Same placement rules as TimelineAssembler, but every gap and cue is
+    piped to a long-lived ffmpeg encoder as soon as it is placed.
+
+    Memory stays flat whatever the SRT length, and the output file is
+    playable while the job is still running. The PCM format is fixed up
+    front (edge-tts' 24 kHz mono); other segments are converted to it.
+    """
+
+    SILENCE_BLOCK_MS = 1000
+
+    def __init__(self, out_path, overflow_mode='cut', frame_rate=TTS_FRAME_RATE, channels=TTS_CHANNELS):
+        super().__init__(overflow_mode)
+        self.out_path = out_path
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.frames_written = 0
+        cmd = [AudioSegment.converter, "-y", "-hide_banner", "-loglevel", "error",
+               "-f", "s16le", "-ar", str(frame_rate), "-ac", str(channels), "-i", "pipe:0"]
+        if out_path.lower().endswith(".mp3"):
+            # no Xing header to patch at the end -> the file is valid while it grows
+            cmd += ["-write_xing", "0"]
+        cmd.append(out_path)
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def output_format(self):
+        return self.frame_rate, self.channels
+
+    def _write(self, data):
+        try:
+            self.proc.stdin.write(data)
+        except (BrokenPipeError, OSError):
+            self.proc.wait()
+            raise RuntimeError("ffmpeg encoder stopped: " + self.proc.stderr.read().decode(errors="ignore"))
+
+    def _emit(self, item):
+        if isinstance(item, int):
+            frames = int(self.frame_rate * item / 1000.0)
+            block = self.frame_rate * self.SILENCE_BLOCK_MS // 1000
+            zeros = bytes(block * self.channels * 2)
+            while frames > 0:
+                n = min(frames, block)
+                self._write(zeros[:n * self.channels * 2])
+                frames -= n
+                self.frames_written += n
+        else:
+            seg = item.set_frame_rate(self.frame_rate).set_channels(self.channels).set_sample_width(2)
+            self._write(seg.raw_data)
+            self.frames_written += int(seg.frame_count())
+
+    def render(self):
+        raise RuntimeError("StreamingTimelineWriter writes as it goes; call close()")
+
+    def close(self):
+        """Flush and wait for the encoder. Returns the output path."""
+        if self.proc.stdin and not self.proc.stdin.closed:
+            self.proc.stdin.close()
+        err = self.proc.stderr.read().decode(errors="ignore")
+        if self.proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg encoder failed ({self.proc.returncode}): {err}")
+        return self.out_path
+
+    def abort(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+            self.proc.wait()
+
+# ---------------- Dubbed mix (dialogue over music) ----------------
+DEFAULT_DUCK_DB = -12.0
+DEFAULT_DUCK_ATTACK_MS = 150
+DEFAULT_DUCK_RELEASE_MS = 400
+MIX_FRAME_RATE = 44100
+MIX_CHANNELS = 2
+
+def duck_envelope(frames, intervals, duck_db=DEFAULT_DUCK_DB, attack=1, release=1):
+    """Music gain (float32) at each frame index of `frames` (increasing int array).
+
+    Every (start, end) interval in `intervals` pulls the gain down to duck_db,
+    ramping linearly over `attack` frames before start and `release` frames
+    after end; overlapping ramps keep the deepest duck.
+    """
+    depth = np.zeros(len(frames), dtype=np.float32)
+    if len(frames) == 0:
+        return depth + 1.0
+    first, last = frames[0], frames[-1]
+    attack, release = max(1, attack), max(1, release)
+    for s, e in intervals:
+        if e + release <= first or s - attack >= last:
+            continue
+        np.maximum(depth, np.interp(frames, (s - attack, s, e, e + release), (0.0, 1.0, 1.0, 0.0)), out=depth)
+    floor = 10 ** (duck_db / 20.0)
+    return 1.0 - (1.0 - floor) * depth
+
+class DuckedMixWriter(StreamingTimelineWriter):
+    """StreamingTimelineWriter that lays the dialogue over a music track.
+
+    The music (e.g. karaoke_maker's music-unity.wav) is decoded through an ffmpeg
+    pipe alongside the timeline; every cue ducks it over the cue's time range
+    (see duck_envelope), the two are summed in numpy and the result goes to
+    the one encoder at the end. The duck interval is registered before the gap
+    leading up to the cue is written, so the attack ramp lands ahead of the line.
+    With music_tail=True the music keeps playing after the last cue.
+    """
+
+    def __init__(self, out_path, music_path, overflow_mode='cut', duck_db=DEFAULT_DUCK_DB,
+                 attack_ms=DEFAULT_DUCK_ATTACK_MS, release_ms=DEFAULT_DUCK_RELEASE_MS, music_tail=True,
+                 frame_rate=MIX_FRAME_RATE, channels=MIX_CHANNELS):
+        self.music_path = music_path
+        self.duck_db = duck_db
+        self.attack = frame_rate * attack_ms // 1000
+        self.release = frame_rate * release_ms // 1000
+        self.music_tail = music_tail
+        self.intervals = []   # (start_frame, end_frame) of cues not yet fully written
+        self.clipped = 0      # output samples that hit full scale
+        self.music_eof = False
+        self.music_frames = 0  # frames decoded from the music so far
+        self._music_err = tempfile.TemporaryFile()
+        self.music = subprocess.Popen(
+            [AudioSegment.converter, "-hide_banner", "-loglevel", "error", "-i", music_path,
+             "-f", "s16le", "-ar", str(frame_rate), "-ac", str(channels), "pipe:1"],
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=self._music_err)
+        try:
+            super().__init__(out_path, overflow_mode, frame_rate, channels)
+        except Exception:
+            self._stop_music()
+            raise
+
+    def add_cue(self, start_ms, end_ms, seg_all):
+        gap, placed, pad = self._place(start_ms, end_ms, seg_all)
+        placed = placed.set_frame_rate(self.frame_rate).set_channels(self.channels).set_sample_width(2)
+        # frames actually written, not the SRT times: overflow, rounding and sped-up
+        # segments make the two drift apart over a long file
+        start = self.frames_written + int(self.frame_rate * gap / 1000.0)
+        if len(seg_all) > 0 and placed.frame_count() > 0:
+            self.intervals.append((start, start + int(placed.frame_count())))
+        if gap > 0:
+            self._emit(gap)
+        self._emit(placed)
+        if pad > 0:
+            self._emit(pad)
+
+    def _read_music(self, n):
+        """Next n frames of music as int16 (n, channels); zeros once the music has ended."""
+        want = n * self.channels * 2
+        data = b""
+        while not self.music_eof and len(data) < want:
+            chunk = self.music.stdout.read(want - len(data))
+            if not chunk:
+                self.music_eof = True
+                if self.music.wait() != 0:
+                    self._music_err.seek(0)
+                    raise RuntimeError(f"ffmpeg cannot decode music {self.music_path}: "
+                                       + self._music_err.read().decode(errors="ignore"))
+                break
+            data += chunk
+        pcm = np.zeros((n, self.channels), dtype=np.int16)
+        got = len(data) // (self.channels * 2)
+        self.music_frames += got
+        if got:
+            pcm[:got] = np.frombuffer(data[:got * self.channels * 2], dtype=np.int16).reshape(-1, self.channels)
+        return pcm
+
+    def _mix_write(self, voice, n, tail=False):
+        pos = self.frames_written
+        mix = self._read_music(n).astype(np.float32)
+        if tail:
+            # after the last cue: stop where the music stops
+            n = max(0, min(n, self.music_frames - pos))
+            mix = mix[:n]
+        self.intervals = [iv for iv in self.intervals if iv[1] + self.release > pos]
+        gain = duck_envelope(np.arange(pos, pos + n), self.intervals, self.duck_db, self.attack, self.release)
+        mix *= gain[:, None]
+        if voice is not None:
+            mix += voice
+        over = np.abs(mix) > 32767
+        if over.any():
+            self.clipped += int(over.sum())
+            np.clip(mix, -32768, 32767, out=mix)
+        self._write(np.rint(mix).astype(np.int16).tobytes())
+        self.frames_written += n
+
+    def _emit(self, item):
+        block = self.frame_rate * self.SILENCE_BLOCK_MS // 1000
+        if isinstance(item, int):
+            frames = int(self.frame_rate * item / 1000.0)
+            while frames > 0:
+                n = min(frames, block)
+                self._mix_write(None, n)
+                frames -= n
+        else:
+            seg = item.set_frame_rate(self.frame_rate).set_channels(self.channels).set_sample_width(2)
+            voice = np.frombuffer(seg.raw_data, dtype=np.int16).reshape(-1, self.channels)
+            for i in range(0, len(voice), block):
+                self._mix_write(voice[i:i + block], len(voice[i:i + block]))
+
+    def _stop_music(self):
+        if self.music.poll() is None:
+            self.music.kill()
+        self.music.wait()
+        self.music.stdout.close()
+        self._music_err.close()
+
+    def close(self):
+        try:
+            block = self.frame_rate * self.SILENCE_BLOCK_MS // 1000
+            while self.music_tail and not self.music_eof:
+                self._mix_write(None, block, tail=True)
+        finally:
+            self._stop_music()
+        return super().close()
+
+    def abort(self):
+        self._stop_music()
+        super().abort()
+
+# ---------------- Incremental re-render ----------------
+MANIFEST_VERSION = 1
+
+def manifest_path_for_output(out_path):
+    return out_path + ".manifest.json"
+
+def cue_audio_dir_for_output(out_path):
+    return out_path + ".cues"
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+class RenderManifest:
+    """Per-cue record of the last render of an output file (<out>.manifest.json),
+    plus the synthesized audio of every cue (<out>.cues/<key>.wav).
+
+    A cue is reused when its text, voice and timing match an entry of the
+    previous run; its stored rate is kept too, so the learned speaking-rate
+    model drifting between runs does not invalidate untouched lines.
+    """
+
+    def __init__(self, out_path):
+        self.path = manifest_path_for_output(out_path)
+        self.audio_dir = cue_audio_dir_for_output(out_path)
+        self.previous = {}  # (text_hash, voice, start_ms, end_ms) -> entry
+        self.entries = []
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") == MANIFEST_VERSION:
+                    for e in data.get("cues", []):
+                        self.previous[(e["text_hash"], e["voice"], e["start_ms"], e["end_ms"])] = e
+            except Exception as e:
+                print("Could not load render manifest:", e)
+
+    @staticmethod
+    def audio_key(dialog, voice, rate, max_chunk_len):
+        return text_hash(json.dumps([dialog, voice, rate, max_chunk_len], ensure_ascii=False))
+
+    def lookup(self, dialog, voice, start_ms, end_ms):
+        return self.previous.get((text_hash(dialog), voice, start_ms, end_ms))
+
+    def audio_path(self, key):
+        return os.path.join(self.audio_dir, key + ".wav")
+
+    def has_audio(self, key):
+        return os.path.exists(self.audio_path(key))
+
+    def load_audio(self, key):
+        return AudioSegment.from_wav(self.audio_path(key))
+
+    def store_audio(self, key, seg):
+        os.makedirs(self.audio_dir, exist_ok=True)
+        path = self.audio_path(key)
+        tmp = path + ".part"
+        seg.export(tmp, format="wav")
+        os.replace(tmp, path)
+
+    def record(self, index, dialog, voice, rate, start_ms, end_ms, key):
+        self.entries.append({"index": index, "text_hash": text_hash(dialog), "voice": voice, "rate": rate,
+                             "start_ms": start_ms, "end_ms": end_ms, "audio": key})
+
+    def save(self):
+        tmp = self.path + ".part"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "cues": self.entries}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.path)
+        # drop audio of cues that are no longer in the file
+        keep = {e["audio"] + ".wav" for e in self.entries}
+        if os.path.isdir(self.audio_dir):
+            for name in os.listdir(self.audio_dir):
+                if name not in keep:
+                    try:
+                        os.remove(os.path.join(self.audio_dir, name))
+                    except OSError:
+                        pass
+
 # ---------------- Conversion job ----------------
+# output extension -> ffmpeg muxer (pydub's export format)
+EXPORT_FORMATS = {"mp3": "mp3", "wav": "wav", "flac": "flac", "ogg": "ogg", "opus": "opus",
+                  "m4a": "ipod", "aac": "adts"}
+
+def export_format(out_path):
+    """ffmpeg format for an output file, from its extension."""
+    ext = os.path.splitext(out_path)[1].lower().lstrip(".")
+    if ext not in EXPORT_FORMATS:
+        raise ValueError(f"Không hỗ trợ định dạng đầu ra '.{ext}' (dùng: {', '.join(EXPORT_FORMATS)}).")
+    return EXPORT_FORMATS[ext]
+
+def render_srt(srt_path, out_mp3, voice_map, overflow_mode='cut', max_chunk_len=240,
+               tts_concurrency=DEFAULT_TTS_CONCURRENCY, use_cache=True, streaming=False, plan_rate=True,
+               log=print, progress=None, subs=None, tts_budget=None, incremental=True,
+               music_path=None, duck_db=DEFAULT_DUCK_DB, coalesce=False, tts_attempts=DEFAULT_TTS_ATTEMPTS,
+               tts_server=None):
+    """Headless render of one SRT to audio. Used by the GUI and the CLI.
+
+    streaming=True pipes PCM to the encoder cue by cue (bounded memory for very long SRTs).
+    music_path mixes the dialogue over that music track (ducked by duck_db dB under
+    every cue) in the same streaming pass, see DuckedMixWriter.
+    coalesce=True sends runs of short back-to-back cues of one voice as a single TTS
+    request and cuts the audio back per cue (see plan_coalesced / split_by_words).
+    plan_rate=True requests a faster edge-tts rate up front for lines predicted to overflow.
+    incremental=True reuses the per-cue audio of the previous render of out_mp3 for
+    unchanged cues (see RenderManifest) and only synthesizes edited/retimed ones.
+    tts_budget is an optional semaphore shared with other processes (batch mode).
+    tts_attempts caps the tries per TTS request (see RetryPolicy); a chunk that still
+    fails becomes 500 ms of silence and its cue is counted in stats['degraded_cues'].
+    tts_server is the URL of a fake_tts_server.py to use instead of edge-tts (load tests).
+    The output format follows the extension of out_mp3 (see EXPORT_FORMATS).
+    Returns a dict of stats for the run.
+    """
+    t0 = time.perf_counter()
+    out_format = export_format(out_mp3)
+    if subs is None:
+        subs = parse_srt(srt_path)
+    total = len(subs)
+    if total == 0:
+        raise ValueError("Không tìm thấy subtitle hợp lệ trong SRT.")
+    default_voice = voice_map.get("Narrator", list(voice_map.values())[0])
+    # plan_rate does not apply to 'overflow': there the line is allowed to run long
+    planner = SpeakingRatePlanner(rate_config_path_for_srt(srt_path)) if plan_rate and overflow_mode != 'overflow' else None
+    manifest = RenderManifest(out_mp3) if incremental else None
+    jobs, plans, audio_keys, reused = [], [], [], set()
+    for i, cue in enumerate(subs):
+        speaker, dialog, start_ms, end_ms = cue.speaker, cue.text, cue.start_ms, cue.end_ms
+        voice = voice_map.get(speaker, default_voice)
+        prev = manifest.lookup(dialog, voice, start_ms, end_ms) if manifest is not None else None
+        rate_pct = 0
+        if prev is not None:
+            rate_pct = int(prev["rate"].rstrip("%"))
+        elif planner is not None:
+            rate_pct = planner.plan(dialog, voice, end_ms - start_ms)
+        if planner is not None:
+            plans.append((rate_pct, planner.predict_ms(dialog, voice, rate_pct)))
+        rate = format_rate(rate_pct)
+        jobs.append((split_text(dialog, max_length=max_chunk_len), voice, rate))
+        if manifest is not None:
+            key = RenderManifest.audio_key(dialog, voice, rate, max_chunk_len)
+            audio_keys.append(key)
+            manifest.record(i + 1, dialog, voice, rate, start_ms, end_ms, key)
+            if manifest.has_audio(key):
+                reused.add(i)
+    if planner is not None:
+        n_planned = sum(1 for r, _ in plans if r)
+        log(f"Dự đoán tốc độ: {n_planned}/{total} câu được đọc nhanh hơn ngay từ đầu.\n")
+    if manifest is not None:
+        log(f"Render lại: dùng lại {len(reused)}/{total} câu, tổng hợp {total - len(reused)} câu.\n")
+
+    done_count = len(reused)
+    failed_chunks = 0
+    degraded = 0
+    done_lock = threading.Lock()
+    def _on_cue_done(i, result):
+        # progress only: this runs on the pool's thread and may still be running after the
+        # consumer below has taken the last result, so nothing counted in the summary goes here
+        nonlocal done_count
+        with done_lock:
+            done_count += 1
+            n = done_count
+        log(f"[{n}/{total}] #{i+1} {subs[i].speaker}: {subs[i].text[:120]}...\n")
+        if progress is not None:
+            progress(int(n/total*100))
+
+    pool = None
+    timeline = None
+    try:
+        if music_path:
+            timeline = DuckedMixWriter(out_mp3, music_path, overflow_mode, duck_db=duck_db)
+        elif streaming:
+            timeline = StreamingTimelineWriter(out_mp3, overflow_mode)
+        else:
+            timeline = TimelineAssembler(overflow_mode)
+        cache = TTSCache() if use_cache else None
+        synth = synth_words = None
+        if tts_server:
+            from fake_tts_server import http_synth
+            synth, synth_words = http_synth(tts_server)
+        pool = TTSPool(concurrency=tts_concurrency, synth=synth, cache=cache, budget=tts_budget,
+                       synth_words=synth_words, retry=RetryPolicy(tts_attempts))
+        to_synth = [i for i in range(total) if i not in reused]
+        if coalesce:
+            # a cue whose own audio is already cached is cheaper alone
+            skip = (lambda i: cache.contains(cache_key(jobs[i][0][0], jobs[i][1], jobs[i][2]))) if cache is not None else None
+            groups = plan_coalesced(subs, jobs, to_synth, max_chunk_len, skip=skip)
+            merged = sum(len(g) for g in groups if len(g) > 1)
+            log(f"Gộp câu: {merged} câu vào {sum(1 for g in groups if len(g) > 1)} nhóm, "
+                f"{len(groups)} lượt tổng hợp cho {len(to_synth)} câu.\n")
+        else:
+            groups = [[i] for i in to_synth]
+        synthesized = pool.map_grouped(jobs, groups, on_done=_on_cue_done)
+        for i in range(total):
+            if i in reused:
+                seg_all = manifest.load_audio(audio_keys[i])
+            else:
+                _, (seg_all, errors) = next(synthesized)
+                failed_chunks += len(errors)
+                degraded += 1 if errors else 0
+                for e in errors:
+                    log(f"  [WARN] TTS failed for chunk (cue #{i+1}): {e}\n")
+                if planner is not None and not errors:
+                    rate_pct, predicted = plans[i]
+                    actual = len(seg_all)
+                    planner.observe(subs[i].text, jobs[i][1], rate_pct, actual)
+                    if abs(actual - predicted) > 0.25 * max(predicted, 1):
+                        log(f"  [PLAN] cue #{i+1}: dự đoán {predicted:.0f} ms, thực tế {actual} ms\n")
+                if manifest is not None and not errors:
+                    manifest.store_audio(audio_keys[i], seg_all)
+            timeline.add_cue(subs[i].start_ms, subs[i].end_ms, seg_all)
+
+        if cache is not None:
+            log(cache.stats_line() + "\n")
+        log(pool.stats_line() + "\n")
+        if degraded:
+            log(f"[WARN] {degraded}/{total} câu bị thay bằng khoảng lặng vì TTS lỗi.\n")
+        if coalesce:
+            log(f"Gộp câu: tiết kiệm {pool.saved_requests} request TTS"
+                + (f", {pool.group_fallbacks} nhóm phải đọc lại từng câu" if pool.group_fallbacks else "") + ".\n")
+        if planner is not None:
+            planner.save()
+            log(f"Vẫn phải xử lý sau khi tổng hợp (cắt/tăng tốc): {timeline.overflowed} câu.\n")
+
+        # Export final audio
+        if music_path:
+            timeline.close()
+            audio_ms = timeline.frames_written * 1000 // timeline.frame_rate
+            log(f"Trộn nhạc nền: {len(subs)} đoạn hạ {duck_db:g} dB, {timeline.clipped} mẫu bị clip.\n")
+        elif streaming:
+            timeline.close()
+            audio_ms = timeline.frames_written * 1000 // timeline.frame_rate
+        else:
+            final = timeline.render()
+            audio_ms = len(final)
+            final.export(out_mp3, format=out_format)
+        timeline = None
+        if manifest is not None:
+            manifest.save()
+    finally:
+        if pool is not None:
+            pool.close()
+        if timeline is not None:
+            timeline.abort()
+    if progress is not None:
+        progress(100)
+    return {
+        "srt": srt_path,
+        "out": out_mp3,
+        "cues": total,
+        "audio_ms": audio_ms,
+        "elapsed": time.perf_counter() - t0,
+        "failed_chunks": failed_chunks,
+        "degraded_cues": degraded,
+        "tts_retries": pool.retries if pool is not None else 0,
+        "cache_hits": cache.hits if cache is not None else 0,
+        "cache_misses": cache.misses if cache is not None else 0,
+        "reused_cues": len(reused),
+        "saved_requests": pool.saved_requests if pool is not None else 0,
+    }
+
 def conversion_job(srt_path, out_mp3, speaker_widgets_map, voices_list, log_widget, progress_bar, btn_start,
-                   overflow_mode='cut', max_chunk_len=240):
-   
+                   overflow_mode='cut', max_chunk_len=240, tts_concurrency=DEFAULT_TTS_CONCURRENCY, use_cache=True,
+                   streaming=False, plan_rate=True, incremental=True, music_path="", duck_db=DEFAULT_DUCK_DB,
+                   coalesce=False):
+    """GUI wrapper around render_srt (see there for the options)."""
     try:
         def _disable(state=True):
             try:
@@ -187,85 +1347,11 @@ def conversion_job(srt_path, out_mp3, speaker_widgets_map, voices_list, log_widg
 
         save_voice_map(srt_path, voice_map)
 
-        final = AudioSegment.silent(duration=0)
-        current_pos = 0  # timeline position in ms
-        for idx, (num, start, end, speaker, dialog) in enumerate(subs, 1):
-            log_widget_insert(log_widget, f"[{idx}/{total}] {speaker}: {dialog[:120]}...\n")
-            set_progress(progress_bar, int(idx/total*100))
-
-            start_ms = srt_time_to_ms(start)
-            end_ms = srt_time_to_ms(end)
-            slot_dur = max(0, end_ms - start_ms)
-
-            # if there's gap between current_pos and start_ms -> insert silence
-            if start_ms > current_pos:
-                gap = start_ms - current_pos
-                final += AudioSegment.silent(duration=gap)
-                current_pos += gap
-
-            # generate TTS audio (may be longer/shorter than slot)
-            chunks = split_text(dialog, max_length=max_chunk_len)
-            seg_all = AudioSegment.silent(duration=0)
-            for ch in chunks:
-                try:
-                    mp3tmp = tts_save_tempfile(ch, voice_map.get(speaker, voice_map.get("Narrator", list(voice_map.values())[0])))
-                    seg = AudioSegment.from_file(mp3tmp, format="mp3")
-                except Exception as e:
-                    # On TTS failure, put a short beep or silence to keep timing (silence chosen)
-                    log_widget_insert(log_widget, f"  [WARN] TTS failed for chunk: {e}\n")
-                    seg = AudioSegment.silent(duration=500)
-                finally:
-                    try:
-                        os.remove(mp3tmp)
-                    except:
-                        pass
-                seg_all += seg
-
-            seg_len = len(seg_all)
-
-            # Fit seg_all into [start_ms, end_ms] based on overflow_mode
-            if seg_len < slot_dur:
-                # shorter -> pad end with silence
-                pad = slot_dur - seg_len
-                seg_all += AudioSegment.silent(duration=pad)
-                final += seg_all
-                current_pos = start_ms + slot_dur
-            else:
-                # seg_len >= slot_dur
-                if overflow_mode == 'cut':
-                    seg_cut = seg_all[:slot_dur]
-                    final += seg_cut
-                    current_pos = start_ms + slot_dur
-                elif overflow_mode == 'speed':
-                    # compute required speed factor
-                    # speed = seg_len / slot_dur -> we need to shrink duration by speed
-                    if slot_dur > 0:
-                        speed_factor = seg_len / slot_dur
-                        # apply speed change (note: change_speed expects >0)
-                        seg_sped = change_speed(seg_all, speed=speed_factor)
-                        # after speed change, length should be approximately slot_dur; adjust by slicing/padding
-                        if len(seg_sped) > slot_dur:
-                            seg_sped = seg_sped[:slot_dur]
-                        elif len(seg_sped) < slot_dur:
-                            seg_sped += AudioSegment.silent(duration=(slot_dur - len(seg_sped)))
-                        final += seg_sped
-                        current_pos = start_ms + slot_dur
-                    else:
-                        # if slot_dur==0 fallback to cut first ms
-                        final += seg_all[:1]
-                        current_pos = start_ms + 1
-                elif overflow_mode == 'overflow':
-                    # allow it to overflow: append full seg_all; this will push timeline forward
-                    final += seg_all
-                    current_pos = start_ms + seg_len
-                else:
-                    # unknown mode: default to cut
-                    final += seg_all[:slot_dur]
-                    current_pos = start_ms + slot_dur
-
-        # Export final MP3
-        final.export(out_mp3, format="mp3")
-        set_progress(progress_bar, 100)
+        render_srt(srt_path, out_mp3, voice_map, overflow_mode=overflow_mode, max_chunk_len=max_chunk_len,
+                   tts_concurrency=tts_concurrency, use_cache=use_cache, streaming=streaming, plan_rate=plan_rate,
+                   incremental=incremental, music_path=music_path or None, duck_db=duck_db, coalesce=coalesce,
+                   log=lambda text: log_widget_insert(log_widget, text),
+                   progress=lambda val: set_progress(progress_bar, val), subs=subs)
         messagebox.showinfo("Hoàn tất", f"Đã tạo file: {out_mp3}")
     except Exception as e:
         messagebox.showerror("Lỗi", str(e))
@@ -290,12 +1376,9 @@ def start_gui():
     root.title("Chuyển file SRT sang Audio")
     root.geometry("980x760")
 
-    lbl_fetch = tk.Label(root, text="Đang tải danh sách giọng từ edge-tts (mất vài giây)...")
-    lbl_fetch.pack(anchor="w", padx=10, pady=6)
-    root.update()
-
-    voices_list = fetch_all_voices()
-    lbl_fetch.destroy()
+    # saved catalog (or voices.txt) loads instantly; edge-tts refresh runs in the background
+    catalog = VoiceCatalog()
+    voices_list = catalog.items()
 
     srt_var = tk.StringVar()
     out_var = tk.StringVar()
@@ -321,6 +1404,16 @@ def start_gui():
             out_var.set(p)
     tk.Button(frm_top, text="Chọn", command=choose_out).grid(row=1, column=2, padx=6)
 
+    music_var = tk.StringVar()
+    tk.Label(frm_top, text="Nhạc nền (tùy chọn):").grid(row=2, column=0, sticky="w")
+    tk.Entry(frm_top, textvariable=music_var, width=95).grid(row=2, column=1, padx=6)
+    def choose_music():
+        p = filedialog.askopenfilename(title="Chọn nhạc nền (vd. music-unity.wav từ karaoke_maker)",
+                                       filetypes=[("Audio files", "*.wav *.mp3 *.flac *.m4a"), ("All files", "*.*")])
+        if p:
+            music_var.set(p)
+    tk.Button(frm_top, text="Chọn", command=choose_music).grid(row=2, column=2, padx=6)
+
     # overflow mode controls
     frm_mode = tk.Frame(root)
     frm_mode.pack(fill="x", padx=10, pady=2)
@@ -328,12 +1421,84 @@ def start_gui():
     overflow_var = tk.StringVar(value="cut")
     tk.Radiobutton(frm_mode, text="Cắt", variable=overflow_var, value="cut").pack(side="left", padx=6)
     tk.Radiobutton(frm_mode, text="Tăng tốc (có thể đổi pitch)", variable=overflow_var, value="speed").pack(side="left", padx=6)
+    tk.Radiobutton(frm_mode, text="Tăng tốc (giữ pitch)", variable=overflow_var, value="stretch").pack(side="left", padx=6)
     tk.Radiobutton(frm_mode, text="Cho phép tràn (không cắt)", variable=overflow_var, value="overflow").pack(side="left", padx=6)
     tk.Label(frm_mode, text="Max chunk text length:").pack(side="left", padx=12)
     max_chunk_spin = tk.Spinbox(frm_mode, from_=80, to=1000, increment=10, width=6)
     max_chunk_spin.delete(0, "end")
     max_chunk_spin.insert(0, "240")
     max_chunk_spin.pack(side="left", padx=6)
+    tk.Label(frm_mode, text="Số luồng TTS:").pack(side="left", padx=12)
+    concurrency_spin = tk.Spinbox(frm_mode, from_=1, to=32, increment=1, width=4)
+    concurrency_spin.delete(0, "end")
+    concurrency_spin.insert(0, str(DEFAULT_TTS_CONCURRENCY))
+    concurrency_spin.pack(side="left", padx=6)
+
+    frm_opts = tk.Frame(root)
+    frm_opts.pack(fill="x", padx=10, pady=2)
+    streaming_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(frm_opts, text="Ghi trực tiếp (ít RAM, cho SRT rất dài)", variable=streaming_var).pack(side="left", padx=6)
+    plan_rate_var = tk.BooleanVar(value=True)
+    tk.Checkbutton(frm_opts, text="Dự đoán tốc độ đọc", variable=plan_rate_var).pack(side="left", padx=6)
+    incremental_var = tk.BooleanVar(value=True)
+    tk.Checkbutton(frm_opts, text="Chỉ tổng hợp lại câu đã sửa", variable=incremental_var).pack(side="left", padx=6)
+    coalesce_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(frm_opts, text="Gộp câu ngắn liền nhau (ít request)", variable=coalesce_var).pack(side="left", padx=6)
+    tk.Label(frm_opts, text="Hạ nhạc khi có thoại (dB):").pack(side="left", padx=12)
+    duck_spin = tk.Spinbox(frm_opts, from_=-40, to=0, increment=1, width=4)
+    duck_spin.delete(0, "end")
+    duck_spin.insert(0, str(int(DEFAULT_DUCK_DB)))
+    duck_spin.pack(side="left", padx=6)
+
+    frm_filter = tk.Frame(root)
+    frm_filter.pack(fill="x", padx=10, pady=2)
+    tk.Label(frm_filter, text="Lọc giọng - ngôn ngữ:").pack(side="left", padx=6)
+    filter_locale_var = tk.StringVar()
+    cb_filter_locale = ttk.Combobox(frm_filter, textvariable=filter_locale_var, width=16)
+    cb_filter_locale.pack(side="left", padx=4)
+    tk.Label(frm_filter, text="giới tính:").pack(side="left", padx=6)
+    filter_gender_var = tk.StringVar()
+    cb_filter_gender = ttk.Combobox(frm_filter, textvariable=filter_gender_var, width=8, state="readonly")
+    cb_filter_gender.pack(side="left", padx=4)
+    tk.Label(frm_filter, text="phong cách:").pack(side="left", padx=6)
+    filter_personality_var = tk.StringVar()
+    cb_filter_personality = ttk.Combobox(frm_filter, textvariable=filter_personality_var, width=14, state="readonly")
+    cb_filter_personality.pack(side="left", padx=4)
+    lbl_catalog = tk.Label(frm_filter, text="", fg="gray")
+    lbl_catalog.pack(side="left", padx=12)
+
+    def filtered_labels():
+        allowed = set(catalog.filter(filter_locale_var.get().strip(), filter_gender_var.get(), filter_personality_var.get()))
+        return [lab for (s, lab) in voices_list if s in allowed]
+
+    def apply_voice_filter(*_):
+        labels = filtered_labels()
+        for cb in speaker_widgets.values():
+            cb["values"] = labels
+
+    def update_catalog_widgets():
+        languages = sorted(catalog.by_language)
+        cb_filter_locale["values"] = [""] + languages + catalog.locales()
+        cb_filter_gender["values"] = [""] + catalog.genders()
+        cb_filter_personality["values"] = [""] + catalog.personalities()
+        lbl_catalog.config(text=f"{len(voices_list)} giọng ({catalog.source})")
+
+    for var in (filter_locale_var, filter_gender_var, filter_personality_var):
+        var.trace_add("write", apply_voice_filter)
+    update_catalog_widgets()
+
+    def poll_catalog_refresh(th):
+        if th.is_alive():
+            root.after(500, poll_catalog_refresh, th)
+            return
+        voices_list[:] = catalog.items()
+        update_catalog_widgets()
+        apply_voice_filter()
+
+    refresh_thread = catalog.refresh_in_background()
+    if refresh_thread is not None:
+        lbl_catalog.config(text=f"{len(voices_list)} giọng ({catalog.source}, đang cập nhật...)")
+        root.after(500, poll_catalog_refresh, refresh_thread)
 
     tk.Label(root, text="Danh sách nhân vật (chọn giọng cho từng nhân vật):").pack(anchor="w", padx=10, pady=6)
     frame_speakers = tk.Frame(root, relief=tk.RIDGE, bd=1)
@@ -357,7 +1522,7 @@ def start_gui():
         speaker_widgets.clear()
 
         subs = parse_srt(path)
-        speakers = sorted(set([s for (_,_,_,s,_) in subs]))
+        speakers = sorted(set([cue.speaker for cue in subs]))
         if not speakers:
             tk.Label(scrollable_frame, text="Không tìm thấy nhân vật / subtitle").pack(anchor="w", padx=6, pady=4)
             return
@@ -372,7 +1537,7 @@ def start_gui():
 
             # combobox values are full label strings
             cb_var = tk.StringVar()
-            cb = ttk.Combobox(row, textvariable=cb_var, values=[lab for (_,lab) in voices_list], width=68)
+            cb = ttk.Combobox(row, textvariable=cb_var, values=filtered_labels(), width=68)
             # default selection
             default_voice = saved_map.get(spk)
             if default_voice:
@@ -395,7 +1560,7 @@ def start_gui():
                     preview_text = f"Đây là giọng của {speaker_name}."
                     def _run_preview():
                         try:
-                            tmpmp3 = tts_save_tempfile(preview_text, short)
+                            tmpmp3 = tts_save_tempfile(preview_text, short, cache=TTSCache())
                             seg = AudioSegment.from_file(tmpmp3, format="mp3")
                             play_tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
                             play_tmp.close()
@@ -427,7 +1592,7 @@ def start_gui():
     frame_bottom = tk.Frame(root)
     frame_bottom.pack(fill="x", padx=10, pady=6)
     btn_start = tk.Button(frame_bottom, text="Bắt đầu chuyển đổi", bg="green", fg="white",
-                          command=lambda: start_conversion_thread(srt_var, out_var, speaker_widgets, voices_list, log, progress, btn_start, overflow_var.get(), int(max_chunk_spin.get())))
+                          command=lambda: start_conversion_thread(srt_var, out_var, speaker_widgets, voices_list, log, progress, btn_start, overflow_var.get(), int(max_chunk_spin.get()), int(concurrency_spin.get()), streaming_var.get(), plan_rate_var.get(), incremental_var.get(), music_var.get().strip(), float(duck_spin.get()), coalesce_var.get()))
     btn_start.pack(side="left", padx=6)
 
     def save_mapping_now():
@@ -447,7 +1612,7 @@ def start_gui():
     btn_savecfg = tk.Button(frame_bottom, text="Lưu cấu hình giọng", command=save_mapping_now)
     btn_savecfg.pack(side="left", padx=6)
 
-    def start_conversion_thread(srt_var, out_var, speaker_widgets_map, voices_list_local, log_widget, progress_bar_widget, btn_start_widget, overflow_mode_local, max_chunk_len_local):
+    def start_conversion_thread(srt_var, out_var, speaker_widgets_map, voices_list_local, log_widget, progress_bar_widget, btn_start_widget, overflow_mode_local, max_chunk_len_local, tts_concurrency_local, streaming_local, plan_rate_local, incremental_local, music_local="", duck_local=DEFAULT_DUCK_DB, coalesce_local=False):
         if not srt_var.get():
             messagebox.showwarning("Cảnh báo", "Chưa chọn file SRT.")
             return
@@ -466,10 +1631,153 @@ def start_gui():
                 def get(self): return self._v
             widget_map_for_job[spk] = SimpleCB(chosen_short)
 
-        th = threading.Thread(target=conversion_job, args=(srt_var.get(), out_var.get(), widget_map_for_job, voices_list_local, log_widget, progress_bar_widget, btn_start_widget, overflow_mode_local, max_chunk_len_local), daemon=True)
+        th = threading.Thread(target=conversion_job, args=(srt_var.get(), out_var.get(), widget_map_for_job, voices_list_local, log_widget, progress_bar_widget, btn_start_widget, overflow_mode_local, max_chunk_len_local, tts_concurrency_local, True, streaming_local, plan_rate_local, incremental_local, music_local, duck_local, coalesce_local), daemon=True)
         th.start()
 
     root.mainloop()
 
+# ---------------- Command line / batch ----------------
+VOICE_MAP_POLICIES = ("file", "require", "default")
+
+def resolve_voice_map(srt_path, speakers, policy="file", default_voice="vi-VN-HoaiMyNeural"):
+    """Voice map for a headless render.
+    file: use <srt>.voice_map.json when present, default_voice for anyone missing.
+    require: the .voice_map.json must exist and cover every speaker.
+    default: ignore saved maps, everyone gets default_voice."""
+    saved = load_voice_map(srt_path) if policy != "default" else {}
+    if policy == "require":
+        if not saved:
+            raise ValueError(f"Thiếu file {mapping_config_path_for_srt(srt_path)}")
+        missing = [spk for spk in speakers if spk not in saved]
+        if missing:
+            raise ValueError("Chưa chọn giọng cho: " + ", ".join(missing))
+    return {spk: saved.get(spk, default_voice) for spk in speakers}
+
+def collect_srt_files(inputs):
+    """Expand folders (*.srt inside) and glob patterns, keeping order and dropping duplicates."""
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = sorted(glob.glob(os.path.join(item, "*.srt")))
+        else:
+            matches = sorted(glob.glob(item)) or ([item] if os.path.exists(item) else [])
+        for path in matches:
+            if path not in files:
+                files.append(path)
+    return files
+
+_batch_budget = None
+
+def _init_batch_worker(budget):
+    global _batch_budget
+    _batch_budget = budget
+
+def _render_one(srt_path, out_path, options, verbose=False):
+    """Process-pool worker: render one file. Never raises; failures go into stats['error']."""
+    tag = os.path.basename(srt_path)
+    log = (lambda text: print(f"[{tag}] {text}", end="", flush=True)) if verbose else (lambda text: None)
+    t0 = time.perf_counter()
+    try:
+        subs = parse_srt(srt_path)
+        speakers = sorted(set(cue.speaker for cue in subs))
+        voice_map = resolve_voice_map(srt_path, speakers, options["voice_map_policy"], options["default_voice"])
+        stats = render_srt(srt_path, out_path, voice_map, subs=subs, log=log, tts_budget=_batch_budget,
+                           **options["render"])
+        stats["error"] = None
+    except Exception as e:
+        stats = {"srt": srt_path, "out": out_path, "cues": 0, "audio_ms": 0,
+                 "elapsed": time.perf_counter() - t0, "failed_chunks": 0,
+                 "cache_hits": 0, "cache_misses": 0, "reused_cues": 0, "saved_requests": 0,
+                 "degraded_cues": 0, "tts_retries": 0, "error": f"{type(e).__name__}: {e}"}
+    return stats
+
+def _format_stats(stats):
+    name = os.path.basename(stats["srt"])
+    if stats["error"]:
+        return f"FAIL {name}: {stats['error']}"
+    audio_s = stats["audio_ms"] / 1000
+    speedup = audio_s / stats["elapsed"] if stats["elapsed"] > 0 else 0.0
+    return (f"OK   {name}: {stats['cues']} cues, {audio_s:.1f}s audio in {stats['elapsed']:.1f}s "
+            f"({speedup:.1f}x realtime, {stats['cues'] / max(stats['elapsed'], 1e-9):.1f} cues/s), "
+            f"{stats['reused_cues']} cues reused, {stats['saved_requests']} requests saved, cache {stats['cache_hits']}/{stats['cache_hits'] + stats['cache_misses']}, "
+            f"{stats['tts_retries']} retries, {stats['degraded_cues']} câu thành khoảng lặng -> {stats['out']}")
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(prog="srt_to_mp3_tts.py",
+                                     description="Render SRT files to audio without the GUI (batch, in parallel).")
+    parser.add_argument("inputs", nargs="+", help="SRT files, folders or glob patterns")
+    parser.add_argument("-o", "--out-dir", help="output folder (default: next to each SRT)")
+    parser.add_argument("--format", default="mp3",
+                        help=f"output extension: {', '.join(EXPORT_FORMATS)} (default: mp3)")
+    parser.add_argument("--voice-map-policy", choices=VOICE_MAP_POLICIES, default="file")
+    parser.add_argument("--default-voice", default="vi-VN-HoaiMyNeural")
+    parser.add_argument("--overflow", choices=("cut", "speed", "stretch", "overflow"), default="cut")
+    parser.add_argument("--max-chunk", type=int, default=240)
+    parser.add_argument("-j", "--jobs", type=int, default=min(4, os.cpu_count() or 1),
+                        help="files rendered in parallel (processes)")
+    parser.add_argument("--tts-concurrency", type=int, default=DEFAULT_TTS_CONCURRENCY * 2,
+                        help="TTS requests in flight, shared by all processes")
+    parser.add_argument("--streaming", action="store_true", help="pipe audio to the encoder cue by cue")
+    parser.add_argument("--music", help="music track to mix the dialogue over (one SRT only), e.g. karaoke_maker's music-unity.wav")
+    parser.add_argument("--duck-db", type=float, default=DEFAULT_DUCK_DB,
+                        help=f"music gain under dialogue with --music (default: {DEFAULT_DUCK_DB:g})")
+    parser.add_argument("--tts-attempts", type=int, default=DEFAULT_TTS_ATTEMPTS,
+                        help="tries per TTS request before the chunk becomes silence")
+    parser.add_argument("--tts-server", help="URL of a fake_tts_server.py to use instead of edge-tts")
+    parser.add_argument("--coalesce", action="store_true",
+                        help="send short back-to-back cues of one voice as one TTS request")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--no-plan-rate", action="store_true")
+    parser.add_argument("--no-incremental", action="store_true",
+                        help="re-synthesize every cue instead of reusing <out>.cues/ from the last run")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print per-cue progress")
+    args = parser.parse_args(argv)
+
+    args.format = args.format.lower().lstrip(".")
+    if args.format not in EXPORT_FORMATS:
+        print(f"--format {args.format}: không hỗ trợ, dùng một trong {', '.join(EXPORT_FORMATS)}.", file=sys.stderr)
+        return 2
+    files = collect_srt_files(args.inputs)
+    if not files:
+        print("Không tìm thấy file SRT nào.", file=sys.stderr)
+        return 2
+    if args.music and len(files) > 1:
+        print("--music chỉ dùng được với một file SRT.", file=sys.stderr)
+        return 2
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+    options = {
+        "voice_map_policy": args.voice_map_policy,
+        "default_voice": args.default_voice,
+        "render": dict(overflow_mode=args.overflow, max_chunk_len=args.max_chunk,
+                       tts_concurrency=args.tts_concurrency, use_cache=not args.no_cache,
+                       streaming=args.streaming, plan_rate=not args.no_plan_rate,
+                       incremental=not args.no_incremental, music_path=args.music, duck_db=args.duck_db,
+                       coalesce=args.coalesce, tts_attempts=args.tts_attempts, tts_server=args.tts_server),
+    }
+    t0 = time.perf_counter()
+    budget = multiprocessing.BoundedSemaphore(max(1, args.tts_concurrency))
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max(1, min(args.jobs, len(files))),
+                                                initializer=_init_batch_worker, initargs=(budget,)) as ex:
+        futures = []
+        for srt_path in files:
+            base = os.path.splitext(os.path.basename(srt_path))[0] + "." + args.format
+            out_path = os.path.join(args.out_dir or os.path.dirname(srt_path) or ".", base)
+            futures.append(ex.submit(_render_one, srt_path, out_path, options, args.verbose))
+        for fut in concurrent.futures.as_completed(futures):
+            stats = fut.result()
+            results.append(stats)
+            print(_format_stats(stats), flush=True)
+
+    failed = [r for r in results if r["error"]]
+    wall = time.perf_counter() - t0
+    audio_s = sum(r["audio_ms"] for r in results) / 1000
+    print(f"\n{len(results) - len(failed)}/{len(results)} file OK, {audio_s:.1f}s audio in {wall:.1f}s "
+          f"({audio_s / wall if wall > 0 else 0:.1f}x realtime)")
+    return 1 if failed else 0
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(main_cli())
     start_gui()
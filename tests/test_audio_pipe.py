@@ -0,0 +1,30 @@
+import subprocess
+
+import numpy as np
+import pytest
+
+from audio_pipe import read_pcm, iter_pcm_blocks
+
+
+@pytest.fixture
+def media(tmp_path):
+    path = str(tmp_path / "tone.wav")
+    subprocess.run(["ffmpeg", "-nostdin", "-v", "error", "-f", "lavfi", "-i", "sine=f=300:r=16000:d=3", "-ac", "2", path],
+                   check=True)
+    return path
+
+
+@pytest.mark.parametrize("dtype, channels", [(np.int16, 1), (np.float32, 2)])
+def test_blocks_add_up_to_the_whole_decode(media, dtype, channels):
+    whole = read_pcm(media, 16000, channels, dtype)
+    blocks = list(iter_pcm_blocks(media, 16000, channels, 10000, dtype))
+    assert whole.shape == (48000, channels) and whole.dtype == dtype
+    assert [len(b) for b in blocks] == [10000] * 4 + [8000]
+    assert np.array_equal(np.concatenate(blocks), whole)
+
+
+def test_ffmpeg_failure_is_raised(tmp_path):
+    with pytest.raises(RuntimeError, match="ffmpeg"):
+        list(iter_pcm_blocks(str(tmp_path / "missing.mkv"), 16000, 1, 1000))
+    with pytest.raises(RuntimeError, match="ffmpeg"):
+        read_pcm(str(tmp_path / "missing.mkv"), 16000)
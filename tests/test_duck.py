@@ -0,0 +1,49 @@
+import numpy as np
+from pydub import AudioSegment
+
+import srt_to_mp3_tts as m
+
+RATE = m.MIX_FRAME_RATE
+
+
+def _voice(ms, level=8000):
+    """Constant-level mono 24 kHz 'speech', so its first sample is easy to find."""
+    n = m.TTS_FRAME_RATE * ms // 1000
+    return AudioSegment(np.full(n, level, np.int16).tobytes(), sample_width=2,
+                        frame_rate=m.TTS_FRAME_RATE, channels=1)
+
+
+def _run(tmp_path, overflow_mode, cues):
+    music = tmp_path / "music.wav"
+    AudioSegment.silent(duration=10000, frame_rate=RATE).set_channels(2).export(str(music), format="wav")
+    out = tmp_path / "out.wav"
+    writer = m.DuckedMixWriter(str(out), str(music), overflow_mode, music_tail=False)
+    intervals = []
+    for start_ms, end_ms, seg in cues:
+        writer.add_cue(start_ms, end_ms, seg)
+        intervals.append(writer.intervals[-1])
+    writer.close()
+    pcm = np.frombuffer(AudioSegment.from_file(str(out)).raw_data, np.int16).reshape(-1, 2)[:, 0]
+    return intervals, pcm
+
+
+def _voiced_runs(pcm):
+    on = np.concatenate(([0], (pcm != 0).astype(np.int8), [0]))
+    edges = np.flatnonzero(np.diff(on))
+    return list(zip(edges[::2], edges[1::2]))
+
+
+def test_intervals_follow_written_audio_when_cues_overflow(tmp_path):
+    # each line runs 500 ms past its slot, so the SRT times fall behind the audio
+    cues = [(0, 1000, _voice(1500, 8000)), (1200, 2000, _voice(1300, 9000)),
+            (2100, 3000, _voice(1400, 10000)), (3600, 4000, _voice(300, 11000))]
+    intervals, pcm = _run(tmp_path, "overflow", cues)
+    starts = [int(np.argmax(pcm == level)) for level in (8000, 9000, 10000, 11000)]
+    assert [s for s, _ in intervals] == starts
+    assert intervals[-1][0] > RATE * 4  # the last line really plays after 4 s, not at 3.6 s
+
+
+def test_intervals_match_voice_in_cut_mode(tmp_path):
+    cues = [(1001, 2337, _voice(900)), (2500, 2900, _voice(700)), (4321, 5000, _voice(200))]
+    intervals, pcm = _run(tmp_path, "cut", cues)
+    assert [(int(s), int(e)) for s, e in _voiced_runs(pcm)] == intervals
@@ -0,0 +1,40 @@
+import os
+
+import numpy as np
+
+import karaoke_maker as k
+
+
+def _stems(folder, level=0.25):
+    tracks = {}
+    for name in ("vocals", "drums", "bass", "other"):
+        tracks[name] = os.path.join(folder, f"{name}.wav")
+        k.write_wav(tracks[name], np.full((2, 4410), level, np.float32), 44100)
+    return tracks
+
+
+def _level(path):
+    pcm, _ = k.wav_memmap(path)
+    return int(pcm[0, 0])
+
+
+def test_music_for_each_gain_policy_is_mixed_from_the_same_stems(tmp_path):
+    tracks = _stems(str(tmp_path))
+    unity = k.music_track(str(tmp_path), tracks, "unity")
+    average = k.music_track(str(tmp_path), tracks, "average")
+    assert os.path.basename(unity) == "music-unity.wav"
+    assert os.path.basename(average) == "music-average.wav"
+    assert abs(_level(unity) - 3 * _level(average)) <= 3
+    assert all(os.path.exists(p) for p in tracks.values())  # the stems stay cached
+
+
+def test_existing_music_is_reused(tmp_path):
+    tracks = _stems(str(tmp_path))
+    first = k.music_track(str(tmp_path), tracks, "peak")
+    os.remove(tracks["drums"])
+    assert k.music_track(str(tmp_path), tracks, "peak") == first
+
+
+def test_no_accompaniment_stems_gives_no_music(tmp_path):
+    tracks = {"vocals": _stems(str(tmp_path))["vocals"]}
+    assert k.music_track(str(tmp_path), tracks) is None
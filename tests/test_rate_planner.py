@@ -0,0 +1,52 @@
+import json
+import multiprocessing
+
+import srt_to_mp3_tts as m
+
+
+def _learn(path, voice, n):
+    planner = m.SpeakingRatePlanner(path)
+    for _ in range(n):
+        planner.observe("x" * 20, voice, 0, 1000)  # 20 characters per second
+    planner.save()
+
+
+def test_observations_move_the_prediction(tmp_path):
+    path = str(tmp_path / "voice_rates.json")
+    planner = m.SpeakingRatePlanner(path)
+    assert planner.cps("v") == m.SpeakingRatePlanner.DEFAULT_CPS
+    planner.observe("x" * 30, "v", 50, 1000)  # read at +50%: 20 cps at the natural speed
+    assert planner.cps("v") == 20.0
+    assert planner.plan("x" * 20, "v", 2000) == 0
+    assert planner.plan("x" * 40, "v", 1000) == m.SpeakingRatePlanner.MAX_RATE_PCT
+    planner.save()
+    assert m.SpeakingRatePlanner(path).cps("v") == 20.0
+
+
+def test_parallel_saves_keep_each_others_voices(tmp_path):
+    path = str(tmp_path / "voice_rates.json")
+    stale = m.SpeakingRatePlanner(path)  # loaded before the others save
+    stale.observe("x" * 10, "late", 0, 1000)
+    procs = [multiprocessing.Process(target=_learn, args=(path, f"voice-{i}", 50)) for i in range(6)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    stale.save()
+    with open(path, encoding="utf-8") as f:
+        rates = json.load(f)
+    assert sorted(rates) == ["late"] + [f"voice-{i}" for i in range(6)]
+    assert all(rates[f"voice-{i}"]["n"] == 50 for i in range(6))
+    assert not (tmp_path / "voice_rates.json.lock").exists()
+
+
+def test_same_voice_from_two_runs_counts_both(tmp_path):
+    path = str(tmp_path / "voice_rates.json")
+    a, b = m.SpeakingRatePlanner(path), m.SpeakingRatePlanner(path)
+    a.observe("x" * 20, "v", 0, 1000)
+    b.observe("x" * 10, "v", 0, 1000)
+    a.save()
+    b.save()
+    entry = m.SpeakingRatePlanner(path).rates["v"]
+    assert entry["n"] == 2
+    assert entry["cps"] == 20.0 + m.SpeakingRatePlanner.ALPHA * (10.0 - 20.0)
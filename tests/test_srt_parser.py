@@ -0,0 +1,30 @@
+from srt_parser import iter_cues
+
+
+def _cues(text):
+    return list(iter_cues(text.splitlines(keepends=True)))
+
+
+def test_superscript_digits_are_text_not_an_index():
+    cues = _cues("²\n00:00:01,000 --> 00:00:02,000\nE = mc\n²\n\n"
+                 "3\n00:00:03,000 --> 00:00:04,500\nNext\n")
+    assert [c.text for c in cues] == ["E = mc ²", "Next"]
+    assert [c.index for c in cues] == [1, 3]
+    assert (cues[1].start_ms, cues[1].end_ms) == (3000, 4500)
+
+
+def test_transdub_reads_its_own_srt_with_the_shared_parser(tmp_path):
+    import srt_parser
+    import transdub
+
+    class Tagger:
+        def translate(self, text, dest="en"):
+            return type("Translated", (), {"text": "\n".join(f"Narrator: {t}" for t in text.split("\n"))})()
+
+    segments = [{"start": 0.5, "end": 1.25, "text": "hello"}, {"start": 2.0, "end": 3.0, "text": "12"}]
+    path = tmp_path / "out.srt"
+    path.write_text(transdub.segments_to_srt(segments, "vi", translator=Tagger(), memory=False), encoding="utf-8")
+    assert transdub.parse_srt is srt_parser.parse_srt
+    cues = transdub.parse_srt(str(path))
+    assert [(c.start_ms, c.end_ms, c.speaker, c.text) for c in cues] == [(500, 1250, "Narrator", "hello"),
+                                                                          (2000, 3000, "Narrator", "12")]
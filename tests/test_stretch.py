@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from pydub import AudioSegment
+
+from srt_to_mp3_tts import time_stretch, fit_to_slot
+
+RATE = 24000
+
+
+def _tones(ms, freqs=(220.0,), rate=RATE):
+    """One sine per channel."""
+    t = np.arange(rate * ms // 1000) / rate
+    pcm = np.stack([np.sin(2 * np.pi * f * t) * 8000 for f in freqs], axis=1).astype(np.int16)
+    return AudioSegment(data=pcm.tobytes(), sample_width=2, frame_rate=rate, channels=len(freqs))
+
+
+def _dominant_hz(seg, channel=0):
+    pcm = np.frombuffer(seg.raw_data, dtype=np.int16).reshape(-1, seg.channels)[:, channel]
+    spectrum = np.abs(np.fft.rfft(pcm * np.hanning(len(pcm))))
+    return np.argmax(spectrum) * seg.frame_rate / len(pcm)
+
+
+@pytest.mark.parametrize("channels", [1, 2])
+@pytest.mark.parametrize("src_ms, slot_ms", [(3000, 2000), (3000, 1337), (2500, 2499), (1000, 1500)])
+def test_exact_length(channels, src_ms, slot_ms):
+    seg = _tones(src_ms, (220.0, 330.0)[:channels])
+    out = time_stretch(seg, slot_ms)
+    assert out.channels == channels
+    assert out.frame_count() == RATE * slot_ms // 1000
+    assert len(out) == slot_ms
+
+
+@pytest.mark.parametrize("overflow_mode", ["stretch", "speed", "cut"])
+def test_fit_to_slot_fills_the_slot(overflow_mode):
+    placed, pad, new_pos = fit_to_slot(_tones(3000), 500, 2000, overflow_mode)
+    assert len(placed) + pad == 2000
+    assert new_pos == 2500
+
+
+@pytest.mark.parametrize("ratio", [1.1, 1.5, 2.0])
+def test_pitch_is_preserved(ratio):
+    seg = _tones(4000, (220.0, 330.0))
+    out = time_stretch(seg, int(4000 / ratio))
+    resolution = RATE / out.frame_count()  # one FFT bin
+    assert abs(_dominant_hz(out, 0) - 220.0) <= resolution
+    assert abs(_dominant_hz(out, 1) - 330.0) <= resolution
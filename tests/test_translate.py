@@ -0,0 +1,87 @@
+import threading
+import time
+
+import pytest
+
+import transdub
+from translation_memory import TranslationMemory
+
+
+class _FakeTranslator:
+    """Stand-in for googletrans: tags every line with the destination language, counts requests."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def translate(self, text, dest="en"):
+        with self._lock:
+            self.requests += 1
+        time.sleep(self.latency)
+        out = "\n".join(f"[{dest}] {line}" for line in text.split("\n"))
+        return type("Translated", (), {"text": out})()
+
+
+class _DropsLines(_FakeTranslator):
+    """Batches lose their last line (so the line count no longer matches); single lines are fine."""
+
+    def translate(self, text, dest="en"):
+        out = super().translate(text, dest)
+        if "\n" in text:
+            out.text = "\n".join(out.text.split("\n")[:-1])
+        return out
+
+
+class _Fails(_FakeTranslator):
+    """Every request for a line containing `bad` raises, like googletrans on a network error."""
+
+    def __init__(self, bad):
+        super().__init__(latency=0)
+        self.bad = bad
+
+    def translate(self, text, dest="en"):
+        if self.bad in text:
+            with self._lock:
+                self.requests += 1
+            raise ConnectionError("translate.googleapis.com unreachable")
+        return super().translate(text, dest)
+
+
+@pytest.fixture
+def memory(tmp_path):
+    with TranslationMemory(str(tmp_path / "tm.sqlite")) as tm:
+        yield tm
+
+
+def test_duplicates_are_translated_once():
+    tr = _FakeTranslator(latency=0)
+    texts = ["Yeah.", "Thank you.", "Yeah.", "Yeah.", "Thank you.", "Go  home\nnow"]
+    out, requests = transdub.translate_texts(texts, "vi", translator=tr, concurrency=1)
+    assert out == ["[vi] Yeah.", "[vi] Thank you.", "[vi] Yeah.", "[vi] Yeah.", "[vi] Thank you.",
+                   "[vi] Go home now"]
+    assert requests == tr.requests == 1
+
+
+def test_line_count_mismatch_falls_back_to_one_request_per_line():
+    tr = _DropsLines(latency=0)
+    texts = ["one", "two", "three"]
+    out, requests = transdub.translate_texts(texts, "vi", translator=tr, concurrency=1,
+                                             context_words=["movie"])
+    assert out == ["[vi] one", "[vi] two", "[vi] three"]
+    assert requests == tr.requests == 1 + len(texts)
+
+
+def test_failed_lines_return_source_and_are_not_remembered(memory):
+    texts = ["good line", "bad line", "good line"]
+    out, _ = transdub.translate_texts(texts, "vi", translator=_Fails("bad"), concurrency=1,
+                                      memory=memory)
+    assert out == ["[vi] good line", "bad line", "[vi] good line"]
+    assert memory.get_many(["good line", "bad line"], "vi") == {"good line": "[vi] good line"}
+
+    # the next run only asks for the line that failed
+    tr = _FakeTranslator(latency=0)
+    out, requests = transdub.translate_texts(texts, "vi", translator=tr, memory=memory)
+    assert out == ["[vi] good line", "[vi] bad line", "[vi] good line"]
+    assert requests == tr.requests == 1
+    assert len(memory) == 2
@@ -0,0 +1,57 @@
+import os
+import time
+
+from tts_cache import TTSCache, cache_key
+
+
+def _cache(tmp_path, max_bytes=10_000):
+    return TTSCache(str(tmp_path / "tts"), max_bytes=max_bytes)
+
+
+def test_put_get_and_hit_counts(tmp_path):
+    cache = _cache(tmp_path)
+    key = cache_key("xin chào", "vi-VN-HoaiMyNeural")
+    assert cache.get(key) is None
+    cache.put(key, b"mp3 bytes")
+    assert cache.contains(key)
+    assert cache.get(key) == b"mp3 bytes"
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache_key("xin chào", "vi-VN-NamMinhNeural") != key
+    assert cache_key("xin chào", "vi-VN-HoaiMyNeural", rate="+10%") != key
+
+
+def test_putting_a_key_again_counts_only_the_size_difference(tmp_path):
+    cache = _cache(tmp_path)
+    key = cache_key("a", "v")
+    cache.put(key, b"x" * 1000)
+    for _ in range(20):
+        cache.put(key, b"x" * 1000)
+    cache.put(key, b"x" * 400)
+    assert cache.size() == 400
+    assert cache.size() == TTSCache(cache.cache_dir).size()  # same as a fresh scan
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = _cache(tmp_path, max_bytes=3000)
+    keys = [cache_key(str(i), "v") for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.put(key, b"x" * 1000)
+        os.utime(cache._path(key), (time.time() - 100 + i, time.time() - 100 + i))
+    assert cache.get(keys[0]) is not None  # touch: now the most recently used
+    cache.put(cache_key("3", "v"), b"x" * 1000)  # 4000 > 3000 -> evict down to 2700
+    assert [cache.contains(k) for k in keys] == [True, False, False]
+    assert cache.size() <= 2700
+
+
+def test_sidecar_is_not_an_entry_and_goes_with_its_audio(tmp_path):
+    cache = _cache(tmp_path, max_bytes=3000)
+    old, new = cache_key("old", "v"), cache_key("new", "v")
+    cache.put(old, b"x" * 1000)
+    cache.put_sidecar(old, ".words.json", b"[]" * 2000)
+    assert cache.get_sidecar(old, ".words.json") == b"[]" * 2000
+    assert cache.size() == 1000 == TTSCache(cache.cache_dir).size()
+    os.utime(cache._path(old), (time.time() - 100, time.time() - 100))
+    cache.put(new, b"x" * 2500)
+    assert not cache.contains(old)
+    assert cache.get_sidecar(old, ".words.json") is None
+    assert not os.path.exists(cache._path(old) + ".words.json")
@@ -0,0 +1,167 @@
+import asyncio
+import os
+import random
+
+import aiohttp
+import pytest
+
+import srt_to_mp3_tts as m
+from fake_tts_server import FakeTTSServer, http_synth
+
+VOICE = "vi-VN-HoaiMyNeural"
+FAST_RETRY = dict(base_delay=0.01, max_delay=0.05)
+
+
+def _http_error(status, retry_after=None):
+    headers = {"Retry-After": retry_after} if retry_after is not None else None
+    return aiohttp.ClientResponseError(None, (), status=status, headers=headers)
+
+
+def _jobs(n):
+    # line i has i + 1 words, so the fake server's audio gets longer with i
+    return [([" ".join(["câu"] * (i + 1)) + "."], VOICE, "+0%") for i in range(n)]
+
+
+def _run(server, jobs, concurrency=8, attempts=m.DEFAULT_TTS_ATTEMPTS, adaptive=True, groups=None):
+    synth, synth_words = http_synth(server.url)
+    with m.TTSPool(concurrency, synth=synth, synth_words=synth_words,
+                   retry=m.RetryPolicy(attempts, **FAST_RETRY), adaptive=adaptive) as pool:
+        if groups is None:
+            results = list(pool.map_ordered(jobs))
+        else:
+            results = list(pool.map_grouped(jobs, groups))
+    return pool, results
+
+
+def _assert_in_order(results):
+    assert [i for i, _ in results] == list(range(len(results)))
+    lengths = [len(seg) for _, (seg, _) in results]
+    assert lengths == sorted(lengths)
+
+
+@pytest.mark.parametrize("exc, kind", [
+    (_http_error(429), m.THROTTLED), (_http_error(403), m.THROTTLED),
+    (_http_error(503), m.TRANSIENT), (_http_error(408), m.TRANSIENT),
+    (_http_error(400), m.PERMANENT), (ValueError("bad voice"), m.PERMANENT),
+    (ConnectionResetError(), m.TRANSIENT), (asyncio.TimeoutError(), m.TRANSIENT),
+])
+def test_classify_tts_error(exc, kind):
+    assert m.classify_tts_error(exc) == kind
+
+
+def test_retry_delay_is_capped_jittered_backoff():
+    random.seed(1)
+    policy = m.RetryPolicy(5, base_delay=0.5, max_delay=3.0)
+    for attempt, cap in ((1, 0.5), (2, 1.0), (3, 2.0), (4, 3.0), (8, 3.0)):
+        delays = [policy.delay(attempt) for _ in range(200)]
+        assert 0 <= min(delays) and max(delays) <= cap
+        assert max(delays) > 0.8 * cap  # full jitter: spread over the whole range
+
+
+def test_retry_after_is_a_floor_capped_by_max_delay():
+    policy = m.RetryPolicy(5, base_delay=0.01, max_delay=3.0)
+    assert all(policy.delay(1, _http_error(429, "2")) >= 2.0 for _ in range(50))
+    assert policy.delay(1, _http_error(429, "60")) == 3.0
+    assert policy.delay(1, _http_error(429, "soon")) <= 0.01
+
+
+def test_adaptive_limit_cuts_once_per_round_and_recovers():
+    async def scenario():
+        limit = m.AdaptiveLimit(8)
+        round1 = [await limit.acquire() for _ in range(8)]
+        for started in round1:  # a burst of 429s from one round is one signal
+            limit.release(started, m.THROTTLED)
+        assert (limit.limit, limit.cuts) == (4.0, 1)
+        limit.release(await limit.acquire(), m.THROTTLED)  # started after the cut: cuts again
+        assert (limit.limit, limit.lowest, limit.cuts) == (2.0, 2.0, 2)
+        for _ in range(20):
+            limit.release(await limit.acquire(), "ok")
+        assert 6.0 < limit.limit <= 8.0
+        for _ in range(100):
+            limit.release(await limit.acquire(), "ok")
+        assert limit.limit == 8.0  # never above the configured concurrency
+    asyncio.run(scenario())
+
+
+def test_fixed_limit_when_not_adaptive():
+    async def scenario():
+        limit = m.AdaptiveLimit(8, adaptive=False)
+        limit.release(await limit.acquire(), m.THROTTLED)
+        assert limit.limit == 8.0
+    asyncio.run(scenario())
+
+
+def test_transient_failures_are_retried_and_order_kept():
+    with FakeTTSServer(latency=0.01, jitter=0.01, error_rate=0.2, drop_rate=0.1, seed=4) as server:
+        pool, results = _run(server, _jobs(24), attempts=10)
+        stats = dict(server.stats)
+    _assert_in_order(results)
+    assert all(not errors for _, (_, errors) in results)
+    assert stats["503"] + stats["dropped"] > 0
+    assert pool.requests == stats["requests"]
+    assert pool.retries == stats["503"] + stats["dropped"]
+    assert pool.gave_up == 0
+
+
+def test_throttling_cuts_the_limit_and_every_cue_still_succeeds():
+    with FakeTTSServer(latency=0.05, jitter=0.0, capacity=2, retry_after=0.01, seed=1) as server:
+        pool, results = _run(server, _jobs(30), concurrency=8, attempts=20)
+        stats = dict(server.stats)
+    _assert_in_order(results)
+    assert all(not errors for _, (_, errors) in results)
+    assert stats["429"] > 0 and pool.throttled == stats["429"]
+    assert pool.limit.cuts >= 1 and pool.limit.lowest <= 4
+
+
+def test_failures_past_the_last_attempt_degrade_to_silence():
+    with FakeTTSServer(latency=0.0, error_rate=1.0, seed=2) as server:
+        pool, results = _run(server, _jobs(6), attempts=3)
+        stats = dict(server.stats)
+    assert [i for i, _ in results] == list(range(6))
+    for _, (seg, errors) in results:
+        assert len(errors) == 1 and len(seg) == 500
+    assert stats["requests"] == pool.requests == 6 * 3
+    assert (pool.retries, pool.gave_up) == (6 * 2, 6)
+
+
+def test_permanent_errors_are_not_retried():
+    with FakeTTSServer(latency=0.0, seed=3) as server:
+        pool, results = _run(server, [(["xin chào"], "not-a-voice", "+0%")] * 3, attempts=5)
+        stats = dict(server.stats)
+    assert all(len(errors) == 1 for _, (_, errors) in results)
+    assert stats["400"] == stats["requests"] == 3
+    assert pool.retries == 0
+
+
+def test_grouped_cues_come_back_per_cue_in_order():
+    jobs = _jobs(5)
+    with FakeTTSServer(latency=0.01, error_rate=0.3, seed=5) as server:
+        pool, results = _run(server, jobs, attempts=10, groups=[[0, 1, 2], [3], [4]])
+    _assert_in_order(results)
+    assert all(not errors for _, (_, errors) in results)
+    assert pool.saved_requests == 2 and pool.group_fallbacks == 0
+
+
+def test_render_srt_counts_every_degraded_cue(tmp_path, monkeypatch):
+    monkeypatch.setenv("SUB2VOICE_TTS_CACHE", str(tmp_path / "cache"))
+    srt_path = tmp_path / "a.srt"
+    srt_path.write_text("".join(f"{i}\n00:00:{i:02d},000 --> 00:00:{i:02d},800\nCâu {i}.\n\n" for i in range(1, 13)),
+                        encoding="utf-8")
+    with FakeTTSServer(latency=0.0, error_rate=1.0, seed=6) as server:
+        stats = m.render_srt(str(srt_path), str(tmp_path / "a.mp3"), {"Narrator": VOICE}, tts_attempts=1,
+                             tts_server=server.url, use_cache=False, incremental=False, log=lambda s: None)
+    assert stats["degraded_cues"] == stats["failed_chunks"] == 12
+
+
+def test_grouped_cues_reuse_cached_audio_and_words(tmp_path):
+    from tts_cache import TTSCache
+    cache = TTSCache(str(tmp_path / "tts"))
+    jobs, groups = _jobs(3), [[0, 1, 2]]
+    with FakeTTSServer(latency=0.0, seed=7) as server:
+        synth, synth_words = http_synth(server.url)
+        for _ in range(2):
+            with m.TTSPool(4, synth=synth, synth_words=synth_words, cache=cache) as pool:
+                results = list(pool.map_grouped(jobs, groups))
+            _assert_in_order(results)
+        assert server.stats["requests"] == 1
+    assert all(name.endswith((".mp3", ".words.json")) for _, _, files in os.walk(cache.cache_dir) for name in files)
@@ -0,0 +1,54 @@
+import numpy as np
+
+import transdub
+
+SR = transdub.WHISPER_SR
+
+
+def _tone(seconds, level=0.2, freq=110.0):
+    t = np.arange(int(seconds * SR)) / SR
+    return (level * 32767 * np.sin(2 * np.pi * freq * t)).astype(np.int16)
+
+
+def _blocks(audio, seconds=10):
+    step = seconds * SR
+    return (audio[i:i + step] for i in range(0, len(audio), step))
+
+
+def test_speech_in_silence_is_found():
+    audio = np.zeros(90 * SR, dtype=np.int16)
+    audio[10 * SR:14 * SR] = _tone(4, freq=300)
+    chunks = transdub.speech_chunks(audio)
+    assert len(chunks) == 1
+    start, end = chunks[0]
+    assert start <= 10 * SR and end >= 14 * SR and end - start < 6 * SR
+
+
+def test_constant_level_audio_falls_back_to_fixed_windows():
+    # a steady bed: the relative VAD threshold sits above every frame
+    bed = _tone(90)
+    assert transdub.detect_speech_regions(bed) == []
+    assert transdub.speech_chunks(bed) == transdub.fixed_chunks(len(bed))
+
+
+def test_speech_over_music_bed_is_not_dropped():
+    rnd = np.random.default_rng(0)
+    audio = _tone(150).astype(np.int32)
+    for s in range(5, 145, 10):  # speech-like bursts a few dB over the bed
+        audio[s * SR:(s + 6) * SR] += (3000 * rnd.standard_normal(6 * SR)).astype(np.int32)
+    audio = np.clip(audio, -32768, 32767).astype(np.int16)
+    stats = {}
+    chunks = list(transdub.iter_speech_chunks(_blocks(audio), stats=stats))
+    assert stats["total"] == len(audio)
+    assert stats["kept"] >= 0.8 * len(audio)
+    covered = np.zeros(len(audio), dtype=bool)
+    for start, pcm in chunks:
+        covered[start:start + len(pcm)] = True
+    for s in range(5, 145, 10):
+        assert covered[s * SR:(s + 6) * SR].all()
+
+
+def test_silence_yields_nothing():
+    stats = {}
+    assert list(transdub.iter_speech_chunks(_blocks(np.zeros(70 * SR, dtype=np.int16)), stats=stats)) == []
+    assert stats == {"total": 70 * SR, "kept": 0}
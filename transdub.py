@@ -1,30 +1,36 @@
 """
 Ý tưởng: Dịch phụ đề SRT với bối cảnh và xưng hô tuỳ chỉnh, sau đó chuyển thành giọng nói (Edge-TTS).
 Yêu cầu: 
-    pip install edge-tts pydub whisper googletrans==4.0.0-rc1
+    pip install edge-tts pydub numpy whisper googletrans==4.0.0-rc1
     ffmpeg cần có trong PATH để pydub export/play được.
 """
 
 
 import os
-import re
-import io
-import json
+import time
+import importlib
+import queue
 import asyncio
 import tempfile
 import threading
+import concurrent.futures
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-from pydub import AudioSegment
-import edge_tts
-import whisper
-from googletrans import Translator
 import datetime
+import numpy as np
 import srt
+from tts_cache import TTSCache, cache_key
+from translation_memory import TranslationMemory
+from audio_pipe import read_pcm, iter_pcm_blocks
+from srt_parser import parse_srt  # noqa: F401  (transdub.parse_srt = the shared parser)
+
+# whisper (+ torch), googletrans and edge_tts are imported on first use (or by warm_up()),
+# so the window appears before the heavy modules are loaded.
 
 # ---------------- Config ----------------
-translator = Translator()
 WHISPER_MODELS = {}
+_translator = None
+_lazy_lock = threading.Lock()
 
 LANGUAGES = {
     "Tiếng Việt": "vi",
@@ -37,17 +43,265 @@ LANGUAGES = {
     "Español (Spanish)": "es"
 }
 
+# ---------------- Lazy imports ----------------
+def get_translator():
+    global _translator
+    with _lazy_lock:
+        if _translator is None:
+            from googletrans import Translator
+            _translator = Translator()
+    return _translator
+
+def warm_up(model_size=None):
+    """Import the heavy modules in the background (and optionally load a Whisper model)."""
+    try:
+        get_translator()
+        importlib.import_module("whisper")  # pulls in torch
+        importlib.import_module("edge_tts")
+        if model_size:
+            get_whisper_model(model_size)
+    except Exception as e:
+        print("Warning: warm-up failed:", e)
+
 # ---------------- Whisper utils ----------------
 def get_whisper_model(size="base"):
-    if size not in WHISPER_MODELS:
-        WHISPER_MODELS[size] = whisper.load_model(size)
+    with _lazy_lock:
+        if size not in WHISPER_MODELS:
+            import whisper
+            WHISPER_MODELS[size] = whisper.load_model(size)
     return WHISPER_MODELS[size]
 
-def transcribe_audio(audio_path, model_size="base"):
+def transcribe_audio(media_path, model_size="base", workers=1, progress_callback=None, service_address=None,
+                     log=print):
+    """Transcribe any file ffmpeg can read. Whole file in one call (workers=1), or VAD chunks across
+    a process pool while ffmpeg is still decoding (workers>1).
+    With service_address, the job goes to a running whisper_service (model already loaded);
+    if none is reachable, or it fails mid-job, it falls back to the local model."""
+    if service_address:
+        from whisper_service import transcribe_remote, SERVICE_ERRORS
+        try:
+            segments, language, reply = transcribe_remote(media_path, model_size, address=service_address)
+            log(f"Whisper service: chờ {reply['wait_s']:.1f}s, chạy {reply['run_s']:.1f}s")
+            return segments, language
+        except SERVICE_ERRORS as e:
+            log(f"Whisper service lỗi ({type(e).__name__}: {e}), dùng model trong máy.")
+    if workers > 1:
+        return transcribe_audio_parallel(media_path, model_size, workers, progress_callback=progress_callback)
+    audio = pcm_to_float(extract_audio_16k(media_path))
     model = get_whisper_model(model_size)
-    result = model.transcribe(audio_path)
+    result = model.transcribe(audio)
     return result['segments'], result.get("language", "unknown")
 
+# ---------------- Audio decoding (ffmpeg pipe) ----------------
+WHISPER_SR = 16000
+
+def extract_audio_16k(media_path):
+    """Decode the audio track to 16 kHz mono int16 through a pipe (no temp WAV)."""
+    return read_pcm(media_path, WHISPER_SR).reshape(-1)
+
+def iter_audio_16k(media_path, block_s=10.0):
+    """Yield 16 kHz mono int16 blocks as ffmpeg decodes them; raises if ffmpeg fails."""
+    for block in iter_pcm_blocks(media_path, WHISPER_SR, 1, int(block_s * WHISPER_SR)):
+        yield block.reshape(-1)
+
+def pcm_to_float(pcm):
+    """int16 -> float32 in [-1, 1), the array format model.transcribe() accepts."""
+    return pcm.astype(np.float32) / 32768.0
+
+# ---------------- Speech regions (VAD) ----------------
+def frame_energy_db(audio, frame_len):
+    """RMS level (dBFS) of consecutive frames; computed in blocks to keep memory flat."""
+    n = len(audio) // frame_len
+    out = np.empty(n, dtype=np.float32)
+    block = 4096
+    for i in range(0, n, block):
+        frames = audio[i * frame_len:min(n, i + block) * frame_len].reshape(-1, frame_len).astype(np.float32) / 32768.0
+        out[i:i + len(frames)] = np.sqrt(np.mean(frames * frames, axis=1))
+    return 20 * np.log10(np.maximum(out, 1e-6))
+
+def detect_speech_regions(audio, sr=WHISPER_SR, frame_ms=30, margin_db=12.0, floor_db=-55.0,
+                          min_silence_ms=500, min_speech_ms=250, pad_ms=200):
+    """Energy VAD: frames louder than (noise floor + margin_db) are speech.
+    Gaps shorter than min_silence_ms are bridged, blips shorter than min_speech_ms dropped.
+    Returns [(start_sample, end_sample)]."""
+    frame_len = int(sr * frame_ms / 1000)
+    db = frame_energy_db(audio, frame_len)
+    if not len(db):
+        return []
+    threshold = max(float(np.percentile(db, 10)) + margin_db, floor_db)
+    speech = np.concatenate(([False], db > threshold, [False]))
+    edges = np.flatnonzero(speech[1:] != speech[:-1])
+    runs = edges.reshape(-1, 2)  # [start_frame, end_frame)
+    regions = []
+    for start, end in runs.tolist():
+        if regions and (start - regions[-1][1]) * frame_ms < min_silence_ms:
+            regions[-1][1] = end
+        else:
+            regions.append([start, end])
+    pad = int(sr * pad_ms / 1000)
+    out = []
+    for start, end in regions:
+        if (end - start) * frame_ms < min_speech_ms:
+            continue
+        s0 = max(0, start * frame_len - pad)
+        e0 = min(len(audio), end * frame_len + pad)
+        if out and s0 <= out[-1][1]:
+            out[-1] = (out[-1][0], e0)
+        else:
+            out.append((s0, e0))
+    return out
+
+def plan_chunks(regions, sr=WHISPER_SR, max_chunk_s=30.0, max_gap_s=2.0):
+    """Merge neighbouring speech regions (gap <= max_gap_s) into chunks of up to max_chunk_s
+    (Whisper's window); longer regions are cut into max_chunk_s pieces. Long silences are left
+    out so Whisper does not hallucinate over them."""
+    limit = int(max_chunk_s * sr)
+    max_gap = int(max_gap_s * sr)
+    chunks = []
+    for start, end in regions:
+        while end - start > limit:
+            chunks.append((start, start + limit))
+            start += limit
+        if chunks and end - chunks[-1][0] <= limit and 0 <= start - chunks[-1][1] <= max_gap:
+            chunks[-1] = (chunks[-1][0], end)
+        else:
+            chunks.append((start, end))
+    return chunks
+
+MIN_VAD_COVERAGE = 0.2
+
+def fixed_chunks(n, sr=WHISPER_SR, max_chunk_s=30.0):
+    """[(start, end)] windows of max_chunk_s over n samples."""
+    limit = int(max_chunk_s * sr)
+    return [(i, min(i + limit, n)) for i in range(0, n, limit)]
+
+def speech_chunks(audio, sr=WHISPER_SR, floor_db=-55.0, min_coverage=MIN_VAD_COVERAGE):
+    """plan_chunks(detect_speech_regions(audio)), or fixed 30 s windows over all of `audio` when
+    the VAD keeps less than min_coverage of the non-silent audio. The VAD threshold is relative
+    to the quietest frames, so speech over a steady music/noise bed (or any constant-level
+    signal) can come out as no speech at all."""
+    chunks = plan_chunks(detect_speech_regions(audio, sr, floor_db=floor_db), sr)
+    frame_len = int(sr * 0.03)
+    active = int(np.count_nonzero(frame_energy_db(audio, frame_len) > floor_db)) * frame_len
+    kept = sum(end - start for start, end in chunks)
+    if active and kept < min_coverage * active:
+        return fixed_chunks(len(audio), sr)
+    return chunks
+
+def iter_speech_chunks(blocks, sr=WHISPER_SR, window_s=60.0, guard_s=3.0, stats=None):
+    """Streaming speech_chunks(...) over int16 blocks.
+    Yields (start_sample, pcm) as soon as a chunk can no longer grow: it ends more than guard_s
+    before the decoded audio does (longer than plan_chunks' max gap plus padding).
+    If `stats` is a dict, it gets the "total" and "kept" sample counts."""
+    if stats is None:
+        stats = {}
+    stats["total"] = stats["kept"] = 0
+    buf = np.zeros(0, dtype=np.int16)
+    offset = 0  # global sample index of buf[0]
+    guard = int(guard_s * sr)
+    for block in blocks:
+        stats["total"] += len(block)
+        buf = np.concatenate((buf, block))
+        if len(buf) < window_s * sr:
+            continue
+        chunks = speech_chunks(buf, sr)
+        safe = len(buf) - guard
+        ready = [c for c in chunks if c[1] <= safe]
+        for start, end in ready:
+            stats["kept"] += end - start
+            yield offset + start, buf[start:end].copy()
+        if ready:
+            cut = ready[-1][1]
+        elif not chunks or chunks[0][0] >= safe:
+            cut = safe  # silence so far
+        else:
+            continue
+        buf = buf[cut:]
+        offset += cut
+    for start, end in speech_chunks(buf, sr):
+        stats["kept"] += end - start
+        yield offset + start, buf[start:end].copy()
+
+# ---------------- Parallel transcription ----------------
+_worker_model = None
+
+def _init_whisper_worker(model_size, threads):
+    """Process-pool initializer: load the model once per worker."""
+    global _worker_model
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except Exception:
+        pass
+    import whisper
+    _worker_model = whisper.load_model(model_size)
+
+def _transcribe_chunk(offset_s, pcm, language, model=None):
+    audio = pcm_to_float(pcm)
+    result = (model or _worker_model).transcribe(audio, language=language)
+    end_s = offset_s + len(pcm) / WHISPER_SR
+    segments = []
+    for seg in result["segments"]:
+        seg = dict(seg)
+        seg["start"] = offset_s + seg["start"]
+        seg["end"] = min(offset_s + seg["end"], end_s)
+        segments.append(seg)
+    return segments, result.get("language", "unknown"), len(pcm)
+
+def transcribe_audio_parallel(media_path, model_size="base", workers=2, language=None, progress_callback=None):
+    """Split the decoded audio into speech regions and transcribe them across `workers` processes.
+    Chunks are submitted while ffmpeg is still decoding.
+    Returns (segments, language) in the same shape as model.transcribe()['segments']."""
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    futs = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_whisper_worker,
+                                                initargs=(model_size, threads)) as ex:
+        for start, pcm in iter_speech_chunks(iter_audio_16k(media_path)):
+            futs.append(ex.submit(_transcribe_chunk, start / WHISPER_SR, pcm, language))
+        results = [None] * len(futs)
+        lang_votes = {}
+        index = {f: i for i, f in enumerate(futs)}
+        for done, fut in enumerate(concurrent.futures.as_completed(futs), 1):
+            segs, lang, n = fut.result()
+            results[index[fut]] = segs
+            lang_votes[lang] = lang_votes.get(lang, 0) + n  # weighted by chunk length
+            if progress_callback:
+                progress_callback(5 + int(35 * done / len(futs)))
+    if not futs:
+        return [], language or "unknown"
+    segments = []
+    for segs in results:
+        for seg in segs:
+            seg["id"] = len(segments)
+            segments.append(seg)
+    detected = language or max(lang_votes, key=lang_votes.get)
+    return segments, detected
+
+def iter_transcribe(media_path, model_size="base", workers=1, language=None, stats=None):
+    """Yield (segments, language, n_samples) per speech chunk, in timeline order, while ffmpeg is
+    still decoding. workers>1 transcribes up to 2*workers chunks ahead on a process pool.
+    `stats` is filled like iter_speech_chunks' (total / kept samples)."""
+    chunks = iter_speech_chunks(iter_audio_16k(media_path), stats=stats)
+    if workers <= 1:
+        model = get_whisper_model(model_size)
+        for start, pcm in chunks:
+            yield _transcribe_chunk(start / WHISPER_SR, pcm, language, model)
+        return
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_whisper_worker,
+                                                initargs=(model_size, threads)) as ex:
+        pending = []
+        try:
+            for start, pcm in chunks:
+                pending.append(ex.submit(_transcribe_chunk, start / WHISPER_SR, pcm, language))
+                while len(pending) >= 2 * workers or (pending and pending[0].done()):
+                    yield pending.pop(0).result()
+            while pending:
+                yield pending.pop(0).result()
+        finally:
+            for fut in pending:
+                fut.cancel()
+
 # ---------------- Translation & Context ----------------
 def translate_text_with_context(text, dest_lang="en", context_words=None, honorific_style="modern"):
     """Dịch text, áp dụng bối cảnh và xưng hô"""
@@ -58,44 +312,101 @@ def translate_text_with_context(text, dest_lang="en", context_words=None, honori
     if honorific_style == "ancient":
         text = text.replace("you", "ngươi").replace("I", "ta").replace("my", "của ta")
     try:
-        translated = translator.translate(text, dest=dest_lang)
+        translated = get_translator().translate(text, dest=dest_lang)
         return translated.text
     except Exception:
         return text
 
-# ---------------- Edge-TTS helpers ----------------
-async def _list_voices_async():
-    return await edge_tts.list_voices()
+TRANSLATE_BATCH_CHARS = 4500   # Google web endpoint rejects requests around 5000 chars
+TRANSLATE_CONCURRENCY = 4
+
+def pack_batches(texts, max_chars=TRANSLATE_BATCH_CHARS, reserved=0):
+    """Group texts into lists whose newline-joined size stays under max_chars - reserved."""
+    batches, cur, size = [], [], 0
+    for t in texts:
+        if cur and size + len(t) + 1 > max_chars - reserved:
+            batches.append(cur)
+            cur, size = [], 0
+        cur.append(t)
+        size += len(t) + 1
+    if cur:
+        batches.append(cur)
+    return batches
 
-def fetch_all_voices():
+def _translate_batch(lines, dest_lang, context_line, translator):
+    """One request for many lines (newline-delimited). The context goes once, as the first line,
+    and is dropped from the result. Falls back to one request per line if the line count changes;
+    a line that still fails comes back as None (never cache the source text as its translation)."""
+    payload = "\n".join(([context_line] if context_line else []) + lines)
     try:
-        voices = asyncio.run(_list_voices_async())
-        voice_items = []
-        for v in voices:
-            short = v.get("ShortName")
-            locale = v.get("Locale", "")
-            gender = v.get("Gender", "")
-            label = f"{short} — {locale} — {gender}"
-            voice_items.append((short, label))
-        voice_items.sort(key=lambda x: x[0].lower())
-        return voice_items
-    except:
-        fallback = [
-            ("vi-VN-HoaiMyNeural", "vi-VN-HoaiMyNeural — vi-VN — Female"),
-            ("vi-VN-NamMinhNeural", "vi-VN-NamMinhNeural — vi-VN — Male"),
-            ("en-US-JennyNeural", "en-US-JennyNeural — en-US — Female"),
-        ]
-        return fallback
+        out = translator.translate(payload, dest=dest_lang).text.split("\n")
+        if context_line:
+            out = out[1:]
+        if len(out) == len(lines):
+            return [o.strip() for o in out], 1
+    except Exception:
+        pass
+    results = []
+    for line in lines:
+        try:
+            results.append(translator.translate(line, dest=dest_lang).text)
+        except Exception:
+            results.append(None)
+    return results, 1 + len(lines)
+
+def translate_texts(texts, dest_lang="en", context_words=None, honorific_style="modern", translator=None,
+                    max_chars=TRANSLATE_BATCH_CHARS, concurrency=TRANSLATE_CONCURRENCY, progress_callback=None,
+                    memory=None):
+    """Translate many texts with few requests: duplicates are translated once, texts already in
+    the translation `memory` are not sent at all, the rest are packed into size-limited
+    newline-delimited batches sent `concurrency` at a time.
+    Returns (translations in input order, number of requests made)."""
+    prepared = []
+    for text in texts:
+        text = " ".join(text.split())  # newlines are the batch delimiter
+        if honorific_style == "ancient":
+            text = text.replace("you", "ngươi").replace("I", "ta").replace("my", "của ta")
+        prepared.append(text)
+    unique = list(dict.fromkeys(t for t in prepared if t))
+    context_line = " ".join(context_words) if context_words else ""
+    translated = memory.get_many(unique, dest_lang, context_line, honorific_style) if memory is not None else {}
+    batches = pack_batches([t for t in unique if t not in translated], max_chars, reserved=len(context_line) + 1)
+    requests_made = 0
+    if not batches:
+        return [translated.get(t, t) for t in prepared], 0
+    translator = translator or get_translator()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, concurrency)) as ex:
+        futs = {ex.submit(_translate_batch, b, dest_lang, context_line, translator): b for b in batches}
+        for done, fut in enumerate(concurrent.futures.as_completed(futs), 1):
+            out, n = fut.result()
+            ok = [(src, tgt) for src, tgt in zip(futs[fut], out) if tgt is not None]
+            translated.update(ok)  # failed lines fall back to the source text below
+            requests_made += n
+            if memory is not None and ok:
+                memory.put_many(ok, dest_lang, context_line, honorific_style)
+            if progress_callback:
+                progress_callback(int(done / len(batches) * 100))
+    return [translated.get(t, t) for t in prepared], requests_made
 
+# ---------------- Edge-TTS helpers ----------------
 async def _tts_save_async(text, voice, filepath):
+    import edge_tts
     comm = edge_tts.Communicate(text, voice=voice)
     await comm.save(filepath)
 
-def tts_save_tempfile(text, voice):
+def tts_save_tempfile(text, voice, cache=None):
+    """Tạo mp3 vào file tạm; dùng lại bản trong cache nếu có (cache=None -> cache mặc định)."""
+    cache = cache if cache is not None else TTSCache()
     tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
     tmp.close()
+    key = cache_key(text, voice)
     try:
+        cached = cache.get(key)
+        if cached is not None:
+            with open(tmp.name, "wb") as f: f.write(cached)
+            return tmp.name
         asyncio.run(_tts_save_async(text, voice, tmp.name))
+        cache.put_file(key, tmp.name)
         return tmp.name
     except:
         try: os.remove(tmp.name)
@@ -103,37 +414,26 @@ def tts_save_tempfile(text, voice):
         raise
 
 # ---------------- SRT utils ----------------
-def parse_srt(srt_path):
-    with open(srt_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-    pattern = re.compile(
-        r'(\d+)\s+(\d{2}:\d{2}:\d{2},\d{3})\s*-->\s*(\d{2}:\d{2}:\d{2},\d{3})\s+(.*?)\s*(?=\n\d+\n|\Z)',
-        re.DOTALL
-    )
-    out = []
-    for match in pattern.finditer(content):
-        idx = match.group(1)
-        start = match.group(2)
-        end = match.group(3)
-        text = match.group(4).replace('\n', ' ').strip()
-        if ":" in text:
-            spk, dialog = text.split(":",1)
-            speaker = spk.strip()
-            dialog = dialog.strip()
-        else:
-            speaker = "Narrator"
-            dialog = text
-        out.append((idx, start, end, speaker, dialog))
-    return out
-
-def segments_to_srt(segments, dest_lang="en", context_words=None, honorific_style="modern", progress_callback=None):
+def segments_to_srt(segments, dest_lang="en", context_words=None, honorific_style="modern", progress_callback=None, translator=None,
+                    memory=None, log=print):
+    """memory=None -> default translation memory; pass False to always translate online."""
     subtitles = []
-    total = len(segments)
+    if memory is None:
+        try:
+            memory = TranslationMemory()
+        except Exception as e:
+            log(f"Không mở được bộ nhớ dịch: {e}")
+            memory = False
+    memory = memory if memory is not False else None
+    translations, requests_made = translate_texts([seg['text'].strip() for seg in segments], dest_lang, context_words,
+                                                  honorific_style, translator=translator, progress_callback=progress_callback,
+                                                  memory=memory)
+    if memory is not None:
+        log(f"{memory.stats_line()}, {requests_made} request dịch")
     for i, seg in enumerate(segments):
         start = seg['start']
         end = seg['end']
-        original_text = seg['text'].strip()
-        translated_text = translate_text_with_context(original_text, dest_lang, context_words, honorific_style)
+        translated_text = translations[i]
         subtitle = srt.Subtitle(
             index=i+1,
             start=datetime.timedelta(seconds=start),
@@ -141,24 +441,225 @@ def segments_to_srt(segments, dest_lang="en", context_words=None, honorific_styl
             content=translated_text
         )
         subtitles.append(subtitle)
-        if progress_callback:
-            progress_callback(int((i+1)/total*100))
     return srt.compose(subtitles)
 
 # ---------------- Video -> SRT ----------------
-def process_video(video_path, dest_lang="en", output_srt="output.srt", model_size="base", context_words=None, honorific_style="modern", progress_callback=None):
-    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_audio:
-        temp_audio_path = temp_audio.name
-    os.system(f'ffmpeg -y -i "{video_path}" -ar 16000 -ac 1 -f wav "{temp_audio_path}"')
+def process_video(video_path, dest_lang="en", output_srt="output.srt", model_size="base", context_words=None, honorific_style="modern", progress_callback=None, whisper_workers=1, whisper_service=None, log=print):
+    # audio is decoded through an ffmpeg pipe inside transcribe_audio (no temp WAV)
     if progress_callback: progress_callback(5)
-    segments, detected_lang = transcribe_audio(temp_audio_path, model_size=model_size)
+    segments, detected_lang = transcribe_audio(video_path, model_size=model_size, workers=whisper_workers,
+                                               progress_callback=progress_callback, service_address=whisper_service,
+                                               log=log)
     if progress_callback: progress_callback(40)
-    srt_content = segments_to_srt(segments, dest_lang, context_words, honorific_style, progress_callback)
+    srt_content = segments_to_srt(segments, dest_lang, context_words, honorific_style, progress_callback, log=log)
     with open(output_srt, "w", encoding="utf-8") as f: f.write(srt_content)
-    os.remove(temp_audio_path)
     if progress_callback: progress_callback(100)
     return output_srt, detected_lang
 
+# ---------------- Dubbing pipeline (video -> dubbed audio) ----------------
+_END = object()  # end-of-stream marker passed down the queues
+
+class StageStats:
+    """Items, busy time and output-queue occupancy of one pipeline stage."""
+
+    def __init__(self, name, out_queue=None):
+        self.name = name
+        self.out_queue = out_queue
+        self.items = 0
+        self.busy = 0.0
+        self.start = time.perf_counter()
+        self.end = None
+        self.q_samples = 0
+        self.q_total = 0
+        self.q_max = 0
+
+    def sample(self):
+        if self.out_queue is not None:
+            n = self.out_queue.qsize()
+            self.q_samples += 1
+            self.q_total += n
+            self.q_max = max(self.q_max, n)
+
+    def line(self):
+        elapsed = (self.end or time.perf_counter()) - self.start
+        rate = self.items / elapsed if elapsed > 0 else 0.0
+        busy = self.busy / elapsed * 100 if elapsed > 0 else 0.0
+        out = f"{self.name:<10} {self.items:6d} đoạn  {rate:7.2f} đoạn/s  bận {busy:3.0f}%"
+        if self.out_queue is not None:
+            avg = self.q_total / self.q_samples if self.q_samples else 0.0
+            out += f"  hàng đợi ra: TB {avg:.1f} / max {self.q_max} / {self.out_queue.maxsize}"
+        return out
+
+def _q_put(q, item, stop):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.2)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def _q_get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.2)
+        except queue.Empty:
+            pass
+    return _END
+
+def dub_video(video_path, out_audio, voice="vi-VN-HoaiMyNeural", dest_lang="vi", output_srt=None,
+              model_size="base", whisper_workers=1, context_words=None, honorific_style="modern",
+              overflow_mode="speed", tts_concurrency=8, max_chunk_len=240, queue_size=64, translate_batch=32,
+              log=print, report_every=5.0, music_path=None, duck_db=None):
+    """Video -> translated, dubbed audio in one pass. Transcription, translation and synthesis run
+    as threads joined by bounded queues, so segment N is synthesized while N+1 is translated and
+    later audio is still being decoded/transcribed (VAD chunks, in this process with one worker or on
+    a pool of whisper_workers; the whole file in one call only when the VAD finds no speech). The
+    dubbed track is written as it goes (StreamingTimelineWriter; DuckedMixWriter over music_path
+    when given, e.g. karaoke_maker's music-unity.wav). Returns (stats lines, detected language)."""
+    import srt_to_mp3_tts as tts
+    stop = threading.Event()
+    errors = []
+    q_text = queue.Queue(maxsize=queue_size)   # whisper segments
+    q_tts = queue.Queue(maxsize=queue_size)    # (segment, translated text)
+    st_asr = StageStats("Nhận dạng", q_text)
+    st_tr = StageStats("Dịch", q_tts)
+    st_tts = StageStats("Đọc")
+    lang_votes = {}
+    subtitles = []
+
+    def run_stage(fn, stats, out_q):
+        try:
+            fn()
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            stats.end = time.perf_counter()
+            if out_q is not None and not stop.is_set():
+                _q_put(out_q, _END, stop)
+
+    def transcribe_stage():
+        def push(segs):
+            for seg in segs:
+                if not _q_put(q_text, seg, stop):
+                    return False
+                st_asr.items += 1
+            return True
+
+        def whole_file():
+            t0 = time.perf_counter()
+            segs, lang = transcribe_audio(video_path, model_size, log=log)
+            st_asr.busy += time.perf_counter() - t0
+            lang_votes[lang] = 1
+            push(segs)
+
+        vad = {}
+        t0 = time.perf_counter()
+        for segs, lang, n in iter_transcribe(video_path, model_size, whisper_workers, stats=vad):
+            st_asr.busy += time.perf_counter() - t0
+            lang_votes[lang] = lang_votes.get(lang, 0) + n
+            if not push(segs):
+                return
+            t0 = time.perf_counter()
+        dropped_s = (vad["total"] - vad["kept"]) / WHISPER_SR
+        if vad["total"] and not vad["kept"]:
+            log(f"VAD: không tìm thấy tiếng nói trong {vad['total'] / WHISPER_SR:.1f}s audio, nhận dạng lại cả file.")
+            whole_file()
+        else:
+            log(f"VAD: bỏ qua {dropped_s:.1f}s / {vad['total'] / WHISPER_SR:.1f}s audio không có tiếng nói.")
+
+    def translate_stage():
+        memory = TranslationMemory()
+        done = False
+        while not done:
+            batch = [_q_get(q_text, stop)]
+            # take whatever else is already waiting, up to translate_batch
+            while len(batch) < translate_batch and batch[-1] is not _END:
+                try:
+                    batch.append(q_text.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is _END:
+                batch.pop()
+                done = True
+            if not batch:
+                continue
+            t0 = time.perf_counter()
+            texts, _ = translate_texts([seg["text"].strip() for seg in batch], dest_lang, context_words,
+                                       honorific_style, concurrency=1, memory=memory)
+            st_tr.busy += time.perf_counter() - t0
+            for seg, text in zip(batch, texts):
+                if not _q_put(q_tts, (seg, text), stop):
+                    return
+                st_tr.items += 1
+        log(memory.stats_line())
+
+    def tts_stage():
+        placed = []  # segments in the same order as the jobs handed to the pool
+
+        def jobs():
+            while True:
+                item = _q_get(q_tts, stop)
+                if item is _END:
+                    return
+                seg, text = item
+                if not text.strip():
+                    continue
+                placed.append((seg, text))
+                yield tts.split_text(text, max_length=max_chunk_len), voice
+
+        if music_path:
+            duck = tts.DEFAULT_DUCK_DB if duck_db is None else duck_db
+            timeline = tts.DuckedMixWriter(out_audio, music_path, overflow_mode, duck_db=duck)
+        else:
+            timeline = tts.StreamingTimelineWriter(out_audio, overflow_mode)
+        try:
+            with tts.TTSPool(concurrency=tts_concurrency, cache=TTSCache()) as pool:
+                for i, (seg_all, chunk_errors) in pool.map_ordered(jobs(), window=tts_concurrency * 2):
+                    t0 = time.perf_counter()
+                    seg, text = placed[i]
+                    for e in chunk_errors:
+                        log(f"  [WARN] TTS lỗi ở đoạn {i + 1}: {e}")
+                    timeline.add_cue(int(seg["start"] * 1000), int(seg["end"] * 1000), seg_all)
+                    subtitles.append(srt.Subtitle(index=len(subtitles) + 1,
+                                                  start=datetime.timedelta(seconds=seg["start"]),
+                                                  end=datetime.timedelta(seconds=seg["end"]), content=text))
+                    st_tts.busy += time.perf_counter() - t0
+                    st_tts.items += 1
+                log(pool.stats_line())
+            if stop.is_set():
+                timeline.abort()
+            else:
+                timeline.close()
+        except BaseException:
+            timeline.abort()
+            raise
+
+    stages = [(transcribe_stage, st_asr, q_text), (translate_stage, st_tr, q_tts), (tts_stage, st_tts, None)]
+    threads = [threading.Thread(target=run_stage, args=stage, daemon=True) for stage in stages]
+    for th in threads:
+        th.start()
+    last_report = time.perf_counter()
+    while any(th.is_alive() for th in threads):
+        threads[-1].join(timeout=0.25)
+        for st in (st_asr, st_tr):
+            st.sample()
+        if report_every and time.perf_counter() - last_report >= report_every:
+            last_report = time.perf_counter()
+            log(f"[pipeline] nhận dạng {st_asr.items}, dịch {st_tr.items}, đọc {st_tts.items} | "
+                f"hàng đợi dịch {q_text.qsize()}/{queue_size}, đọc {q_tts.qsize()}/{queue_size}")
+    if errors:
+        raise errors[0]
+    if output_srt:
+        with open(output_srt, "w", encoding="utf-8") as f:
+            f.write(srt.compose(subtitles))
+    lines = [st.line() for st in (st_asr, st_tr, st_tts)]
+    for line in lines:
+        log(line)
+    detected = max(lang_votes, key=lang_votes.get) if lang_votes else "unknown"
+    return lines, detected
+
 # ---------------- GUI ----------------
 def start_gui():
     root = tk.Tk()
@@ -185,6 +686,20 @@ def start_gui():
     tk.Label(root, text="Xưng hô:").pack(anchor="w", padx=10, pady=4)
     ttk.Combobox(root, textvariable=honorific_var, values=["modern","ancient"], width=20).pack(anchor="w", padx=10)
 
+    # Parallel transcription
+    tk.Label(root, text="Số tiến trình Whisper (>1: tách theo đoạn có tiếng nói, chạy song song):").pack(anchor="w", padx=10, pady=4)
+    workers_spin = tk.Spinbox(root, from_=1, to=max(1, os.cpu_count() or 1), increment=1, width=6)
+    workers_spin.pack(anchor="w", padx=10)
+    frame_dub = tk.Frame(root); frame_dub.pack(fill="x", padx=10, pady=2)
+    dub_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(frame_dub, text="Lồng tiếng luôn (video -> MP3, các bước chạy chồng nhau)", variable=dub_var).pack(side="left")
+    tk.Label(frame_dub, text="Giọng:").pack(side="left", padx=6)
+    dub_voice_var = tk.StringVar(value="vi-VN-HoaiMyNeural")
+    tk.Entry(frame_dub, textvariable=dub_voice_var, width=26).pack(side="left")
+    use_service_var = tk.BooleanVar(value=bool(os.environ.get("SUB2VOICE_WHISPER_SERVICE")))
+    tk.Checkbutton(root, text="Dùng Whisper service đang chạy (python whisper_service.py serve)",
+                   variable=use_service_var).pack(anchor="w", padx=10)
+
     # Output SRT
     tk.Label(root, text="Output SRT:").pack(anchor="w", padx=10, pady=4)
     tk.Entry(root, textvariable=out_var, width=60).pack(anchor="w", padx=10)
@@ -195,7 +710,6 @@ def start_gui():
     progress.pack(pady=6)
     log = tk.Text(root, height=12); log.pack(fill="both", padx=10, pady=6)
 
-    voices_list = fetch_all_voices()
 
     def update_progress(val):
         progress['value'] = val
@@ -207,15 +721,33 @@ def start_gui():
         output_srt = out_var.get() or os.path.splitext(video_path)[0]+"_output.srt"
         context_words = context_var.get().split()
         honorific_style = honorific_var.get()
+        whisper_workers = int(workers_spin.get())
+        if use_service_var.get():
+            from whisper_service import DEFAULT_ADDRESS
+            service = DEFAULT_ADDRESS
+        else:
+            service = None
         if not video_path:
             messagebox.showerror("Lỗi","Chưa chọn video!")
             return
         log_insert(f"▶ Đang xử lý video: {video_path}")
+        dub = dub_var.get()
+        dub_voice = dub_voice_var.get().strip() or "vi-VN-HoaiMyNeural"
         def task():
             try:
+                if dub:
+                    out_audio = os.path.splitext(output_srt)[0] + ".mp3"
+                    _, detected_lang = dub_video(video_path, out_audio, voice=dub_voice, dest_lang="vi", output_srt=output_srt,
+                                                 whisper_workers=whisper_workers, context_words=context_words,
+                                                 honorific_style=honorific_style, log=log_insert)
+                    log_insert(f" Hoàn tất! Audio: {out_audio}, SRT: {output_srt}")
+                    log_insert(f"Ngôn ngữ gốc: {detected_lang}")
+                    messagebox.showinfo("Hoàn tất", f"Đã lồng tiếng:\n{out_audio}")
+                    return
                 result_srt, detected_lang = process_video(video_path, dest_lang="vi", output_srt=output_srt,
                                                           model_size="base", context_words=context_words, honorific_style=honorific_style,
-                                                          progress_callback=update_progress)
+                                                          progress_callback=update_progress, whisper_workers=whisper_workers,
+                                                          whisper_service=service, log=log_insert)
                 log_insert(f" Hoàn tất! File SRT: {result_srt}")
                 log_insert(f"Ngôn ngữ gốc: {detected_lang}")
                 messagebox.showinfo("Hoàn tất", f"File SRT đã tạo:\n{result_srt}")
@@ -228,6 +760,10 @@ def start_gui():
 
     tk.Button(root, text="Start Processing", bg="green", fg="white", command=start_process).pack(pady=6)
 
+    # load whisper/googletrans once the window is up; SUB2VOICE_NO_WARMUP=1 turns this off
+    if not os.environ.get("SUB2VOICE_NO_WARMUP"):
+        root.after(300, lambda: threading.Thread(target=warm_up, daemon=True).start())
+
     root.mainloop()
 
 if __name__ == "__main__":
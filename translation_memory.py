@@ -0,0 +1,153 @@
+"""
+Bộ nhớ dịch (SQLite) cho transdub.py: câu đã dịch thì lần sau lấy lại, không gọi mạng.
+Khoá = (câu gốc đã chuẩn hoá khoảng trắng, ngôn ngữ đích, từ bối cảnh, kiểu xưng hô).
+- Giới hạn số bản ghi, xoá bản ít dùng nhất (LRU theo thời điểm dùng cuối).
+- Xuất / nhập JSONL để dùng chung giữa nhiều máy:
+    python translation_memory.py export tm.jsonl
+    python translation_memory.py import tm.jsonl
+    python translation_memory.py stats
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+
+DEFAULT_TM_PATH = os.environ.get("SUB2VOICE_TRANSLATION_MEMORY") or os.path.join(
+    os.path.expanduser("~"), ".cache", "sub2voice", "translation_memory.sqlite")
+DEFAULT_MAX_ENTRIES = 500_000
+
+
+def normalize_text(text):
+    return " ".join(text.split())
+
+
+class TranslationMemory:
+    """(source, dest_lang, context, honorific_style) -> translation, with LRU eviction."""
+
+    def __init__(self, path=DEFAULT_TM_PATH, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # several transdub runs may share the file: wait on locks instead of failing
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS tm (
+            source TEXT NOT NULL, dest TEXT NOT NULL, context TEXT NOT NULL, style TEXT NOT NULL,
+            target TEXT NOT NULL, used REAL NOT NULL,
+            PRIMARY KEY (source, dest, context, style))""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS tm_used ON tm (used)")
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get_many(self, texts, dest, context="", style="modern"):
+        """{normalized source: translation} for the texts already in memory (marks them used)."""
+        keys = list(dict.fromkeys(normalize_text(t) for t in texts))
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):  # stay under SQLite's bound-parameter limit
+                part = keys[i:i + 500]
+                rows = self._db.execute(
+                    f"SELECT source, target FROM tm WHERE dest=? AND context=? AND style=? "
+                    f"AND source IN ({','.join('?' * len(part))})", [dest, context, style] + part).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._db.executemany("UPDATE tm SET used=? WHERE source=? AND dest=? AND context=? AND style=?",
+                                     [(now, src, dest, context, style) for src in found])
+                self._db.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, pairs, dest, context="", style="modern"):
+        """Store [(source, translation)]."""
+        now = time.time()
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO tm VALUES (?, ?, ?, ?, ?, ?)",
+                                 [(normalize_text(src), dest, context, style, tgt, now) for src, tgt in pairs])
+            self._db.commit()
+        self.evict()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM tm").fetchone()[0]
+
+    def evict(self, target_ratio=0.9):
+        """Once over max_entries, drop the least recently used rows down to target_ratio * max_entries."""
+        count = len(self)
+        if count <= self.max_entries:
+            return 0
+        drop = count - int(self.max_entries * target_ratio)
+        with self._lock:
+            self._db.execute("DELETE FROM tm WHERE rowid IN (SELECT rowid FROM tm ORDER BY used LIMIT ?)", (drop,))
+            self._db.commit()
+        return drop
+
+    def export_jsonl(self, path):
+        n = 0
+        with self._lock, open(path, "w", encoding="utf-8") as f:
+            for src, dest, context, style, tgt, used in self._db.execute("SELECT * FROM tm ORDER BY used"):
+                f.write(json.dumps({"source": src, "dest": dest, "context": context, "style": style,
+                                    "target": tgt, "used": used}, ensure_ascii=False) + "\n")
+                n += 1
+        return n
+
+    def import_jsonl(self, path):
+        """Merge an export; when both sides know a key, the more recently used translation wins."""
+        rows = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    r = json.loads(line)
+                    rows.append((normalize_text(r["source"]), r["dest"], r.get("context", ""),
+                                 r.get("style", "modern"), r["target"], float(r.get("used", 0))))
+        with self._lock:
+            self._db.executemany("""INSERT INTO tm VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (source, dest, context, style) DO UPDATE SET target=excluded.target, used=excluded.used
+                WHERE excluded.used > tm.used""", rows)
+            self._db.commit()
+        self.evict()
+        return len(rows)
+
+    def stats_line(self):
+        lookups = self.hits + self.misses
+        rate = (self.hits / lookups * 100) if lookups else 0.0
+        return f"Bộ nhớ dịch: {self.hits} hit / {self.misses} miss ({rate:.0f}% hit)"
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Bộ nhớ dịch của transdub.py")
+    ap.add_argument("command", choices=("export", "import", "stats"))
+    ap.add_argument("file", nargs="?", help="file JSONL (export/import)")
+    ap.add_argument("--db", default=DEFAULT_TM_PATH)
+    args = ap.parse_args(argv)
+    if args.command != "stats" and not args.file:
+        ap.error(f"{args.command} cần đường dẫn file JSONL")
+    with TranslationMemory(args.db) as tm:
+        if args.command == "export":
+            print(f"Đã xuất {tm.export_jsonl(args.file)} câu -> {args.file}")
+        elif args.command == "import":
+            print(f"Đã nhập {tm.import_jsonl(args.file)} câu từ {args.file} (tổng {len(tm)})")
+        else:
+            print(f"{args.db}: {len(tm)} câu")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
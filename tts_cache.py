@@ -0,0 +1,170 @@
+"""
+Cache trên đĩa cho audio đã tổng hợp bằng edge-tts, dùng chung cho srt_to_mp3_tts.py và transdub.py.
+Khoá = sha256 của (text, voice, rate, pitch, output format), nên đổi giọng một nhân vật
+chỉ phải tổng hợp lại các câu của nhân vật đó.
+- Giới hạn dung lượng, xoá theo LRU (dựa vào mtime, được "touch" mỗi lần hit).
+- Ghi atomic (file tạm + os.replace) nên nhiều job song song có thể dùng chung một thư mục cache.
+- Dữ liệu đi kèm một bản audio (vd. mốc thời gian từng từ) nằm ở file phụ <key>.mp3<suffix>,
+  bị xoá cùng lúc với audio.
+"""
+import os
+import glob
+import json
+import hashlib
+import tempfile
+import threading
+
+DEFAULT_CACHE_DIR = os.environ.get("SUB2VOICE_TTS_CACHE") or os.path.join(
+    os.path.expanduser("~"), ".cache", "sub2voice", "tts")
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3  # 2 GB
+# edge-tts always answers in this format; part of the key in case that ever changes
+EDGE_TTS_FORMAT = "audio-24khz-48kbitrate-mono-mp3"
+
+
+def cache_key(text, voice, rate="+0%", pitch="+0Hz", fmt=EDGE_TTS_FORMAT):
+    raw = json.dumps([text, voice, rate, pitch, fmt], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """Content-addressed mp3 store with a size cap and LRU eviction."""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, ext=".mp3"):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ext = ext
+        self.hits = 0
+        self.misses = 0
+        self._size = None  # bytes on disk, scanned lazily
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + self.ext)
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get_path(self, key):
+        """Return the cached file path (and mark it recently used), or None."""
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except OSError:
+            self._count(False)
+            return None
+        self._count(True)
+        return path
+
+    def contains(self, key):
+        """True if the key is cached (no hit/miss accounting, no LRU touch)."""
+        return os.path.exists(self._path(key))
+
+    def get(self, key):
+        path = self.get_path(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            # evicted by another job between utime and open
+            return None
+
+    def _write(self, path, data):
+        """Atomic write; returns the size of the file it replaced (0 if none)."""
+        dirn = os.path.dirname(path)
+        os.makedirs(dirn, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=dirn, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            try:
+                old_size = os.stat(path).st_size
+            except OSError:
+                old_size = 0
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        return old_size
+
+    def put(self, key, data):
+        path = self._path(key)
+        old_size = self._write(path, data)  # re-put of an existing key: count the difference only
+        with self._lock:
+            if self._size is not None:
+                self._size += len(data) - old_size
+        if self.size() > self.max_bytes:
+            self.evict()
+        return path
+
+    def put_file(self, key, src_path):
+        with open(src_path, "rb") as f:
+            return self.put(key, f.read())
+
+    def put_sidecar(self, key, suffix, data):
+        """Store extra data for an entry (e.g. suffix ".words.json"); evicted with the entry's audio
+        and not counted towards the size cap. Put the audio first."""
+        self._write(self._path(key) + suffix, data)
+
+    def get_sidecar(self, key, suffix):
+        """The data stored with put_sidecar, or None (no hit/miss accounting)."""
+        try:
+            with open(self._path(key) + suffix, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _entries(self):
+        out = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(self.ext):
+                    continue
+                p = os.path.join(root, name)
+                try:
+                    st = os.stat(p)
+                except OSError:
+                    continue
+                out.append((st.st_mtime, st.st_size, p))
+        return out
+
+    def size(self):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(sz for _, sz, _ in self._entries())
+            return self._size
+
+    def evict(self, target_ratio=0.9):
+        """Delete least recently used entries until the cache is below target_ratio * max_bytes."""
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(sz for _, sz, _ in entries)
+            target = int(self.max_bytes * target_ratio)
+            for _, sz, p in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(p)
+                except OSError:
+                    continue
+                total -= sz
+                for side in glob.glob(glob.escape(p) + ".*"):
+                    try:
+                        os.remove(side)
+                    except OSError:
+                        pass
+            self._size = total
+
+    def stats_line(self):
+        lookups = self.hits + self.misses
+        rate = (self.hits / lookups * 100) if lookups else 0.0
+        return f"Cache TTS: {self.hits} hit / {self.misses} miss ({rate:.0f}% hit)"
@@ -0,0 +1,202 @@
+"""
+Danh sách giọng edge-tts lưu trên đĩa, dùng chung cho srt_to_mp3_tts.py và transdub.py.
+- Mở GUI không phải chờ mạng: đọc ngay bản đã lưu (hoặc voices.txt nếu chưa có / đang offline),
+  rồi cập nhật từ edge-tts trong luồng nền khi bản lưu đã quá TTL.
+- Đánh chỉ mục theo locale, ngôn ngữ, giới tính và phong cách (VoicePersonalities) để lọc tức thì.
+"""
+import os
+import json
+import time
+import asyncio
+import tempfile
+import threading
+import edge_tts
+
+DEFAULT_CATALOG_PATH = os.environ.get("SUB2VOICE_VOICE_CATALOG") or os.path.join(
+    os.path.expanduser("~"), ".cache", "sub2voice", "voices.json")
+DEFAULT_TTL = 7 * 24 * 3600  # one week
+VOICES_TXT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "voices.txt")
+
+FALLBACK_VOICES = [
+    {"ShortName": "vi-VN-HoaiMyNeural", "Locale": "vi-VN", "Gender": "Female"},
+    {"ShortName": "vi-VN-NamMinhNeural", "Locale": "vi-VN", "Gender": "Male"},
+    {"ShortName": "en-US-JennyNeural", "Locale": "en-US", "Gender": "Female"},
+    {"ShortName": "en-US-GuyNeural", "Locale": "en-US", "Gender": "Male"},
+]
+
+
+def _split_tags(value):
+    return [t.strip() for t in value.split(",") if t.strip()]
+
+
+def parse_voices_txt(path=VOICES_TXT):
+    """Read the `edge-tts --list-voices` table shipped in the repo (UTF-16, fixed-width columns)."""
+    with open(path, "r", encoding="utf-16") as f:
+        lines = f.read().splitlines()
+    # column spans come from the "-----  ------" ruler under the header
+    ruler = next(i for i, line in enumerate(lines) if line.startswith("---"))
+    spans, pos = [], 0
+    for dashes in lines[ruler].split():
+        start = lines[ruler].index(dashes, pos)
+        pos = start + len(dashes)
+        spans.append(start)
+    spans.append(None)
+    voices = []
+    for line in lines[ruler + 1:]:
+        if not line.strip():
+            continue
+        cols = [line[spans[i]:spans[i + 1]].strip() for i in range(len(spans) - 1)]
+        cols += [""] * (4 - len(cols))
+        name, gender, categories, personalities = cols[:4]
+        voices.append({
+            "ShortName": name,
+            "Locale": name.rsplit("-", 1)[0],
+            "Gender": gender,
+            "VoiceTag": {"ContentCategories": _split_tags(categories),
+                         "VoicePersonalities": _split_tags(personalities)},
+        })
+    return voices
+
+
+async def _list_voices_async():
+    return await edge_tts.list_voices()
+
+
+def voice_label(v):
+    short = v["ShortName"]
+    display = short.rsplit("-", 1)[-1].replace("Neural", "") or short
+    return f"{short} — {v.get('Locale', '')} — {v.get('Gender', '')} — {display}"
+
+
+class VoiceCatalog:
+    """Voice list persisted as JSON with a TTL, plus in-memory indexes for filtering."""
+
+    def __init__(self, path=DEFAULT_CATALOG_PATH, ttl=DEFAULT_TTL, seed_path=VOICES_TXT):
+        self.path = path
+        self.ttl = ttl
+        self.seed_path = seed_path
+        self.fetched_at = 0.0
+        self.source = None  # "cache", "voices.txt", "fallback" or "edge-tts"
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+        self._set_voices(self._load())
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("voices"):
+                self.fetched_at = float(data.get("fetched_at", 0))
+                self.source = "cache"
+                return data["voices"]
+        except Exception:
+            pass
+        try:
+            voices = parse_voices_txt(self.seed_path)
+            if voices:
+                self.source = "voices.txt"
+                return voices
+        except Exception as e:
+            print("Warning: cannot read voices.txt:", e)
+        self.source = "fallback"
+        return FALLBACK_VOICES
+
+    def _set_voices(self, voices):
+        by_short, by_locale, by_language, by_gender, by_personality = {}, {}, {}, {}, {}
+        for v in voices:
+            short = v.get("ShortName")
+            if not short:
+                continue
+            by_short[short] = v
+            locale = v.get("Locale") or short.rsplit("-", 1)[0]
+            by_locale.setdefault(locale, set()).add(short)
+            by_language.setdefault(locale.split("-")[0], set()).add(short)
+            by_gender.setdefault(v.get("Gender", ""), set()).add(short)
+            for p in (v.get("VoiceTag") or {}).get("VoicePersonalities") or []:
+                by_personality.setdefault(p, set()).add(short)
+        names = sorted(by_short, key=str.lower)
+        items = [(s, voice_label(by_short[s])) for s in names]
+        with self._lock:
+            self.voices = by_short
+            self.names = names
+            self.by_locale = by_locale
+            self.by_language = by_language
+            self.by_gender = by_gender
+            self.by_personality = by_personality
+            self._items = items
+
+    def items(self):
+        """[(short, label)] sorted by short name, the format the GUI comboboxes use."""
+        with self._lock:
+            return list(self._items)
+
+    def locales(self):
+        return sorted(self.by_locale)
+
+    def genders(self):
+        return sorted(g for g in self.by_gender if g)
+
+    def personalities(self):
+        return sorted(self.by_personality)
+
+    def filter(self, locale=None, gender=None, personality=None):
+        """Short names matching every given criterion. `locale` may be a full locale ('vi-VN')
+        or just a language ('vi')."""
+        with self._lock:
+            picked = None
+            for index, key in ((self.by_locale if locale and "-" in locale else self.by_language, locale),
+                               (self.by_gender, gender), (self.by_personality, personality)):
+                if not key:
+                    continue
+                found = index.get(key, set())
+                picked = set(found) if picked is None else picked & found
+            if picked is None:
+                return list(self.names)
+            return [s for s in self.names if s in picked]
+
+    def is_stale(self):
+        return time.time() - self.fetched_at > self.ttl
+
+    def save(self, voices):
+        dirn = os.path.dirname(self.path) or "."
+        os.makedirs(dirn, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=dirn, suffix=".part")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"fetched_at": self.fetched_at, "voices": voices}, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+    def refresh(self):
+        """Fetch the voice list from edge-tts and persist it. Returns True on success;
+        on failure (offline) the current list is kept."""
+        try:
+            voices = asyncio.run(_list_voices_async())
+        except Exception as e:
+            print("Warning: cannot fetch edge-tts voices:", e)
+            return False
+        if not voices:
+            return False
+        self.fetched_at = time.time()
+        self.source = "edge-tts"
+        self._set_voices(voices)
+        try:
+            self.save(voices)
+        except Exception as e:
+            print("Warning: cannot save voice catalog:", e)
+        return True
+
+    def refresh_in_background(self, force=False):
+        """Start refresh() in a daemon thread if the catalog is stale. Returns the thread (or None)."""
+        if not force and not self.is_stale():
+            return None
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return self._refresh_thread
+        self._refresh_thread = threading.Thread(target=self.refresh, daemon=True)
+        self._refresh_thread.start()
+        return self._refresh_thread
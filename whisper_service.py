@@ -0,0 +1,266 @@
+"""
+Whisper service chạy nền: giữ model trong RAM để nhiều lần chạy transdub.py (hoặc một loạt video)
+chỉ phải tải model một lần.
+Chạy:
+    python whisper_service.py serve --preload base      # khởi động service
+    python whisper_service.py stats                     # số job đang chờ, độ trễ từng job
+    python whisper_service.py stop
+Địa chỉ mặc định 127.0.0.1:50517; đặt SUB2VOICE_WHISPER_SERVICE=/tmp/whisper.sock để dùng Unix socket
+(hoặc cổng khác). Chỉ nghe trên loopback / Unix socket: client gửi đường dẫn file nên service phải
+chạy trên cùng máy.
+Khoá xác thực được sinh ngẫu nhiên ở lần chạy đầu, lưu trong ~/.config/sub2voice/whisper_service.key
+(quyền 0600, đổi bằng SUB2VOICE_WHISPER_KEYFILE); client đọc cùng file đó. Giao thức dùng pickle,
+nên ai có khoá là chạy được code dưới quyền service: đừng chia sẻ file khoá.
+"""
+import os
+import sys
+import time
+import queue
+import pickle
+import secrets
+import argparse
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+
+DEFAULT_ADDRESS = os.environ.get("SUB2VOICE_WHISPER_SERVICE") or "127.0.0.1:50517"
+DEFAULT_KEY_PATH = os.environ.get("SUB2VOICE_WHISPER_KEYFILE") or os.path.join(
+    os.path.expanduser("~"), ".config", "sub2voice", "whisper_service.key")
+LEGACY_AUTHKEY = b"sub2voice"  # the old public default: never accepted
+LOOPBACK_HOSTS = ("127.0.0.1", "localhost", "::1")
+RECENT_JOBS = 50
+# what a client call can raise when the service is missing, misconfigured, dies mid-job or
+# answers with an error: callers fall back to the local model on any of these
+SERVICE_ERRORS = (OSError, EOFError, ValueError, KeyError, RuntimeError, AuthenticationError,
+                  pickle.UnpicklingError)
+
+
+def parse_address(address=DEFAULT_ADDRESS):
+    """'host:port' -> (host, port); anything else is a Unix socket path.
+    Only loopback hosts are allowed (the protocol unpickles requests)."""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and "/" not in address:
+        host = host.strip("[]") or "127.0.0.1"
+        if host not in LOOPBACK_HOSTS:
+            raise ValueError(f"whisper service only listens on loopback, not {host!r}")
+        return (host, int(port))
+    return address
+
+
+def load_authkey(path=DEFAULT_KEY_PATH, create=False):
+    """Read the shared secret; with create=True, generate it (0600) if missing.
+    Raises FileNotFoundError (an OSError, like a refused connection) if there is none yet."""
+    if create and not os.path.exists(path):
+        os.makedirs(os.path.dirname(path) or ".", mode=0o700, exist_ok=True)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass  # created by a concurrent start
+        else:
+            with os.fdopen(fd, "w") as f:
+                f.write(secrets.token_hex(32))
+    with open(path, "r") as f:
+        key = f.read().strip().encode("ascii")
+    if create and os.name == "posix" and os.stat(path).st_mode & 0o077:
+        raise PermissionError(f"{path} is readable by other users; chmod 600 it")
+    if len(key) < 32 or key == LEGACY_AUTHKEY:
+        raise ValueError(f"{path} does not hold a usable key; delete it to generate a new one")
+    return key
+
+
+class WhisperService:
+    """Keeps Whisper models resident and runs queued jobs one at a time (FIFO)."""
+
+    def __init__(self, address=DEFAULT_ADDRESS, key_path=DEFAULT_KEY_PATH):
+        self.address = parse_address(address)
+        self.authkey = load_authkey(key_path, create=True)
+        self.models = {}
+        self.jobs = queue.Queue()
+        self.running = None  # job currently on the model
+        self.done = 0
+        self.failed = 0
+        self.recent = []     # (audio_path, model, wait_s, run_s) of the last jobs
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def get_model(self, size):
+        if size not in self.models:
+            import whisper
+            t0 = time.perf_counter()
+            self.models[size] = whisper.load_model(size)
+            print(f"Loaded whisper '{size}' in {time.perf_counter() - t0:.1f}s", flush=True)
+        return self.models[size]
+
+    def _worker(self):
+        while not self._stop.is_set():
+            try:
+                job = self.jobs.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if job.get("op") == "load":
+                # models are only touched from this thread
+                try:
+                    self.get_model(job["model"])
+                    job["reply"] = {"ok": True}
+                except Exception as e:
+                    job["reply"] = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                job["event"].set()
+                continue
+            job["started"] = time.perf_counter()
+            with self._lock:
+                self.running = job["audio_path"]
+            try:
+                model = self.get_model(job["model"])
+                result = model.transcribe(job["audio_path"], language=job.get("language"))
+                job["reply"] = {"ok": True, "segments": result["segments"],
+                                "language": result.get("language", "unknown")}
+            except Exception as e:
+                job["reply"] = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            finished = time.perf_counter()
+            wait_s, run_s = job["started"] - job["queued"], finished - job["started"]
+            job["reply"].update(wait_s=wait_s, run_s=run_s)
+            with self._lock:
+                self.running = None
+                if job["reply"]["ok"]:
+                    self.done += 1
+                else:
+                    self.failed += 1
+                self.recent = (self.recent + [(job["audio_path"], job["model"], wait_s, run_s)])[-RECENT_JOBS:]
+            print(f"{'OK ' if job['reply']['ok'] else 'ERR'} {job['audio_path']} ({job['model']}): "
+                  f"wait {wait_s:.1f}s, run {run_s:.1f}s, queue {self.jobs.qsize()}", flush=True)
+            job["event"].set()
+
+    def stats(self):
+        with self._lock:
+            runs = [r[3] for r in self.recent]
+            return {
+                "queue": self.jobs.qsize(),
+                "running": self.running,
+                "models": sorted(self.models),
+                "done": self.done,
+                "failed": self.failed,
+                "avg_run_s": sum(runs) / len(runs) if runs else 0.0,
+                "recent": list(self.recent),
+            }
+
+    def _handle(self, conn):
+        try:
+            while True:
+                try:
+                    req = conn.recv()
+                except EOFError:
+                    return
+                op = req.get("op")
+                if op == "transcribe":
+                    job = dict(audio_path=os.path.abspath(req["audio_path"]), model=req.get("model", "base"),
+                               language=req.get("language"), queued=time.perf_counter(), event=threading.Event())
+                    self.jobs.put(job)
+                    job["event"].wait()
+                    conn.send(job["reply"])
+                elif op == "load":
+                    job = dict(op="load", model=req.get("model", "base"), event=threading.Event())
+                    self.jobs.put(job)
+                    job["event"].wait()
+                    conn.send(job["reply"])
+                elif op == "stats":
+                    conn.send(dict(self.stats(), ok=True))
+                elif op == "shutdown":
+                    conn.send({"ok": True})
+                    self._stop.set()
+                    self._wake_listener()
+                    return
+                else:
+                    conn.send({"ok": False, "error": f"unknown op: {op}"})
+        except Exception as e:
+            print("Connection error:", e, flush=True)
+        finally:
+            conn.close()
+
+    def _wake_listener(self):
+        # accept() has no timeout; a throwaway connection lets serve_forever see the stop flag
+        try:
+            Client(self.address, authkey=self.authkey).close()
+        except Exception:
+            pass
+
+    def serve_forever(self, preload=()):
+        for size in preload:
+            self.get_model(size)
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)  # stale socket from a previous run
+        threading.Thread(target=self._worker, daemon=True).start()
+        with Listener(self.address, authkey=self.authkey) as listener:
+            if isinstance(self.address, str):
+                os.chmod(self.address, 0o600)
+            print(f"Whisper service listening on {self.address}", flush=True)
+            while not self._stop.is_set():
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    print("Accept error:", e, flush=True)
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+
+# ---------------- Client ----------------
+def _request(req, address=DEFAULT_ADDRESS, key_path=DEFAULT_KEY_PATH):
+    with Client(parse_address(address), authkey=load_authkey(key_path)) as conn:
+        conn.send(req)
+        reply = conn.recv()
+    if not reply.get("ok"):
+        raise RuntimeError(reply.get("error", "whisper service error"))
+    return reply
+
+
+def transcribe_remote(audio_path, model_size="base", language=None, address=DEFAULT_ADDRESS):
+    """Transcribe on the running service. Returns (segments, language, reply) where reply also holds
+    wait_s / run_s. Raises one of SERVICE_ERRORS (ConnectionRefusedError if no service is running)."""
+    reply = _request({"op": "transcribe", "audio_path": os.path.abspath(audio_path),
+                      "model": model_size, "language": language}, address)
+    return reply["segments"], reply["language"], reply
+
+
+def service_stats(address=DEFAULT_ADDRESS):
+    return _request({"op": "stats"}, address)
+
+
+def is_running(address=DEFAULT_ADDRESS):
+    try:
+        service_stats(address)
+        return True
+    except Exception:
+        return False
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Whisper service giữ model trong RAM cho transdub.py")
+    ap.add_argument("command", choices=("serve", "stats", "stop"))
+    ap.add_argument("--address", default=DEFAULT_ADDRESS, help="host:port hoặc đường dẫn Unix socket")
+    ap.add_argument("--preload", nargs="*", default=[], help="model tải sẵn khi khởi động, ví dụ: base small")
+    args = ap.parse_args(argv)
+    if args.command == "serve":
+        try:
+            service = WhisperService(args.address)
+        except (ValueError, PermissionError) as e:
+            print(f"Không khởi động được service: {e}", file=sys.stderr)
+            return 1
+        service.serve_forever(args.preload)
+        return 0
+    try:
+        if args.command == "stop":
+            _request({"op": "shutdown"}, args.address)
+            print("Stopped.")
+            return 0
+        st = service_stats(args.address)
+    except SERVICE_ERRORS as e:
+        print(f"Không kết nối được service tại {args.address}: {e}", file=sys.stderr)
+        return 1
+    print(f"queue: {st['queue']}  running: {st['running'] or '-'}  models: {', '.join(st['models']) or '-'}")
+    print(f"done: {st['done']}  failed: {st['failed']}  avg run: {st['avg_run_s']:.1f}s")
+    for path, model, wait_s, run_s in st["recent"][-10:]:
+        print(f"  {os.path.basename(path)} ({model}): wait {wait_s:.1f}s, run {run_s:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())